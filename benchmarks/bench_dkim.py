@@ -0,0 +1,70 @@
+"""Measure the cost of DKIM signing per message, with dkimpy parsing the
+key for every message and with a cached signer for RSA and ed25519 keys.
+
+Usage:
+    python benchmarks/bench_dkim.py [messages]
+"""
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+from spool.message import Message
+from spool.signer import DkimSigner, get_signer
+
+EXAMPLE_DIR = Path(__file__).parent.parent / 'examples'
+
+# RFC 8463, appendix A
+ED25519_KEY = 'nWGxne/9WmC6hEr0kuwsxERJxWl7MmkZcDusAxyuf2A='
+
+
+def create_wire():
+    msg = Message(
+        name='bench', sender='sender@example.org',
+        recipients='recipient@example.org', subject='Benchmark',
+        headers={'Message-ID': '<bench@example.org>'},
+        text_body='Signed message.\n' * 100,
+    )
+    return msg.as_bytes()
+
+
+def measure(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def main(count):
+    from dkim import dkim_sign
+
+    config = yaml.safe_load((EXAMPLE_DIR / 'dkim.yml').read_text())
+    settings = config['mails'][0]['dkim']
+    wire = create_wire()
+
+    rsa = get_signer(**settings)
+    ed25519 = DkimSigner(settings['domain'], settings['selector'],
+                         ED25519_KEY)
+
+    results = [
+        ('dkimpy, RSA key parsed per message', lambda: dkim_sign(
+            wire, settings['selector'].encode(), settings['domain'].encode(),
+            settings['privkey'].encode(), linesep=b'\r\n')),
+        ('signer, RSA key parsed per message',
+         lambda: DkimSigner(**settings).sign(wire)),
+        ('cached signer, RSA', lambda: rsa.sign(wire)),
+        ('cached signer, ed25519', lambda: ed25519.sign(wire)),
+    ]
+
+    baseline = None
+    for label, func in results:
+        elapsed = measure(func, count)
+        baseline = baseline or elapsed
+        print(f'{label}: {elapsed * 1000:.3f} ms/message, '
+              f'{1 / elapsed:.0f} messages/s, '
+              f'{baseline / elapsed:.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,85 @@
+"""Measure the import time of the CLI with `python -X importtime` and fail
+if a budget is exceeded or a heavy dependency is imported.
+
+Usage:
+    python benchmarks/bench_import.py [runs]
+"""
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# milliseconds spent importing modules, the best of all runs
+BUDGETS = {
+    '--help': 100,
+    '--check': 160,
+}
+
+COMMANDS = {
+    '--help': ['--help'],
+    '--check': ['--check', '--no-config-cache',
+                str(ROOT / 'examples' / 'simple.yml')],
+}
+
+HEAVY = ('cerberus', 'cryptography', 'dkim', 'dns', 'gnupg', 'jinja2')
+
+# only the --check path renders templates
+ALLOWED = {
+    '--check': ('jinja2',),
+}
+
+IMPORT_TIME = re.compile(r'import time:\s+\d+ \|\s+(?P<cumulative>\d+) \|'
+                         r'(?P<indent>\s*)(?P<module>\S+)')
+
+
+def measure(args):
+    """Return the import time in milliseconds and the imported modules."""
+
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'spool.main', *args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+        check=False, text=True)
+
+    total = 0
+    modules = set()
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if not match:
+            continue
+        modules.add(match.group('module'))
+        # top level imports include the time of their nested imports
+        if len(match.group('indent')) == 1:
+            total += int(match.group('cumulative'))
+
+    return total / 1000, modules
+
+
+def main(runs):
+
+    failed = False
+
+    for name, args in COMMANDS.items():
+        results = [measure(args) for _ in range(runs)]
+        elapsed = min(elapsed for elapsed, _ in results)
+        modules = results[0][1]
+
+        heavy = sorted(
+            module for module in HEAVY
+            if module in modules and module not in ALLOWED.get(name, ()))
+
+        print(f'{name}: imports: {elapsed:.1f} ms '
+              f'(budget: {BUDGETS[name]} ms), '
+              f'heavy modules: {", ".join(heavy) or "none"}')
+
+        if elapsed > BUDGETS[name] or heavy:
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
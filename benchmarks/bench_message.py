@@ -0,0 +1,63 @@
+"""Measure time and peak memory to serialize a message with a large
+attachment, signed with S/MIME and DKIM.
+
+Usage:
+    python benchmarks/bench_message.py [size in MB]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import yaml
+
+from spool.message import Message
+
+EXAMPLE_DIR = Path(__file__).parent.parent / 'examples'
+
+
+def create_message(attachment, dkim=True):
+    config = yaml.safe_load((EXAMPLE_DIR / 'dkim.yml').read_text())
+    smime = EXAMPLE_DIR / 'smime'
+
+    msg = Message(
+        name='bench', sender='sender@example.org',
+        recipients='recipient@example.org', subject='Benchmark',
+        headers={'Message-ID': '<bench@example.org>'},
+        text_body='Large attachment.',
+        dkim=config['mails'][0]['dkim'] if dkim else None,
+        smime={
+            'from_key': (smime / 'sender.key.pem').read_text(),
+            'from_crt': (smime / 'sender.crt.pem').read_text(),
+        },
+    )
+    msg.attach(attachment)
+
+    return msg
+
+
+def main(size):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        attachment = Path(tmp) / 'large.bin'
+        attachment.write_bytes(os.urandom(size * 1024 * 1024))
+
+        for label, dkim in [('S/MIME', False), ('S/MIME + DKIM', True)]:
+            msg = create_message(attachment, dkim)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            wire = msg.as_bytes()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f'{label}: attachment: {size} MiB, '
+                  f'message: {len(wire) / 2**20:.1f} MiB, '
+                  f'time: {elapsed:.2f}s, peak memory: {peak / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
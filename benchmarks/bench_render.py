@@ -0,0 +1,62 @@
+"""Measure the cost of rendering a looped mail definition per loop item,
+the time until the first mail is ready and the peak memory.
+
+Usage:
+    python benchmarks/bench_render.py [number of loop items]
+"""
+import copy
+import sys
+import time
+import tracemalloc
+
+from spool.parser import Config
+
+CONFIG = {
+    'defaults': {
+        'sender': 'sender@example.org',
+        'description': 'Generated mail',
+    },
+    'vars': {
+        'domain': 'example.org',
+    },
+    'mails': [{
+        'name': 'loop-{{ item.id }}',
+        'recipients': 'user{{ item.id }}@{{ domain }}',
+        'subject': 'Message {{ item.id }} for {{ item.name|upper }}',
+        'headers': {
+            'X-Mailer': 'spool',
+            'X-Item': '{{ item.id }}',
+        },
+        'text_body': 'Hello {{ item.name }},\n\nJust a plain message.\n',
+        'attachments': ['test.txt', 'test.png'],
+        'tags': 'bench, loop',
+    }],
+}
+
+
+def main(count):
+
+    config = copy.deepcopy(CONFIG)
+    config['mails'][0]['loop'] = [
+        {'id': i, 'name': f'user {i}'} for i in range(count)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    mails = Config(config).iter_mails()
+    next(mails)
+    first = time.perf_counter() - start
+
+    rendered = 1 + sum(1 for _ in mails)
+    elapsed = time.perf_counter() - start
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'items: {rendered}, first mail: {first * 1e3:.1f}ms, '
+          f'time: {elapsed:.2f}s, per item: {elapsed / count * 1e6:.1f}us, '
+          f'peak memory: {peak / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,58 @@
+"""Measure the throughput of building S/MIME signed and encrypted messages,
+with the keys and certificates parsed for every message and loaded once by
+the keystore.
+
+Usage:
+    python benchmarks/bench_smime.py [messages]
+"""
+import sys
+import time
+from pathlib import Path
+
+from spool.main import parse_files
+from spool.message import Message
+from spool.smime import KEYSTORE
+
+EXAMPLE_DIR = Path(__file__).parent.parent / 'examples'
+
+
+def build(cached):
+    if not cached:
+        KEYSTORE.clear()
+
+    mail = parse_files(EXAMPLE_DIR / 'smime.yml', {
+        'name': 'bench',
+        'sender': 'sender@example.org',
+        'recipients': 'recipient@example.org',
+        'subject': 'Benchmark',
+        'headers': {'Message-ID': '<bench@example.org>'},
+        'text_body': 'Signed and encrypted message.\n' * 100,
+        'smime': {
+            'from_key_file': 'smime/sender.key.pem',
+            'from_crt_file': 'smime/sender.crt.pem',
+            'to_crts_file': 'smime/recipient.crt.pem',
+        },
+    })
+
+    return Message(**mail).as_bytes()
+
+
+def main(count):
+
+    baseline = None
+    for label, cached in [('parsed per message', False),
+                          ('keystore', True)]:
+        build(cached)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            build(cached)
+        elapsed = (time.perf_counter() - start) / count
+
+        baseline = baseline or elapsed
+        print(f'{label}: {elapsed * 1000:.3f} ms/message, '
+              f'{1 / elapsed:.0f} messages/s, {baseline / elapsed:.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
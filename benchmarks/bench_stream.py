@@ -0,0 +1,76 @@
+"""Measure peak memory to send a message with a large attachment, streamed
+from the file or flattened as a whole, and fail if streaming exceeds the
+memory budget.
+
+Usage:
+    python benchmarks/bench_stream.py [size in MB]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from spool.message import Message
+
+# peak memory allocated while streaming, independent of the attachment size
+BUDGET = 16 * 1024 * 1024
+
+
+def create_message(attachment):
+    msg = Message(
+        name='bench', sender='sender@example.org',
+        recipients='recipient@example.org', subject='Benchmark',
+        headers={'Message-ID': '<bench@example.org>'},
+        text_body='Large attachment.',
+    )
+    msg.attach(attachment)
+    return msg
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def send_stream(msg):
+    # what the mailer sends with the DATA command, chunk by chunk
+    return sum(len(chunk) for chunk in msg.as_stream().chunks(stuffed=True))
+
+
+def main(size):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        attachment = Path(tmp) / 'large.bin'
+        with open(attachment, 'wb') as fh:
+            for _ in range(size):
+                fh.write(os.urandom(1024 * 1024))
+
+        results = [
+            ('flattened', measure(lambda: len(create_message(attachment)
+                                              .as_bytes()))),
+            ('streamed', measure(lambda: send_stream(
+                create_message(attachment)))),
+        ]
+
+    for label, (length, elapsed, peak) in results:
+        print(f'{label}: attachment: {size} MiB, '
+              f'message: {length / 2**20:.1f} MiB, '
+              f'time: {elapsed:.2f}s, peak memory: {peak / 2**20:.1f} MiB')
+
+    peak = results[-1][1][2]
+    if peak > BUDGET:
+        print(f'Peak memory of streaming exceeds {BUDGET / 2**20:.0f} MiB')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
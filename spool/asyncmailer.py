@@ -0,0 +1,611 @@
+import asyncio
+import concurrent.futures
+import logging
+import re
+import smtplib
+import ssl
+import sys
+import threading
+import time
+from email.utils import formataddr
+
+from dns.asyncresolver import Resolver
+from dns.exception import Timeout
+from dns.resolver import NXDOMAIN
+
+from . import metrics
+from .bench import Timings
+from .mailer import (DOMAIN_LITERAL, Mailer, MailerError, PooledConnection,
+                     RemoteNotFoundError, ResolverTimeoutError, Result,
+                     _temporary)
+from .wire import WireStream
+
+LOG = logging.getLogger(__name__)
+
+CRLF = b'\r\n'
+LINE_ENDINGS = re.compile(r'(?:\r\n|\n|\r(?!\n))')
+LEADING_PERIODS = re.compile(br'(?m)^\.')
+
+
+class AsyncSMTP:
+    """Minimal asyncio SMTP client.
+
+    Mirrors the parts of `smtplib.SMTP` used by the mailer and raises the
+    same `smtplib` exceptions, so errors are reported alike for both
+    delivery engines.
+
+    Args:
+        host (str): Remote server host name or address.
+        port (int): Remote server port.
+        local_hostname (str): Name used in the EHLO/HELO greeting.
+        timeout (float): Timeout in seconds for every network operation.
+        debug (bool): Print the SMTP conversation to stderr.
+    """
+
+    def __init__(self, host, port, local_hostname, timeout=5, debug=False):
+        self.host = host
+        self.port = port
+        self.local_hostname = local_hostname
+        self.timeout = timeout
+        self.debug = debug
+        self.esmtp_features = {}
+        self.timings = Timings()
+        self._reader = None
+        self._writer = None
+
+    @property
+    def is_connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        """Connect to the remote server and read its greeting."""
+
+        with self.timings.measure('connect'):
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+
+            code, msg = await self.getreply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, msg)
+
+        return code, msg
+
+    async def getreply(self):
+        """Read a (possibly multiline) reply from the remote server."""
+
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self._reader.readline(),
+                                              self.timeout)
+            except (asyncio.TimeoutError, OSError) as exc:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(
+                    f'Connection to remote failed: {exc}') from exc
+
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(
+                    'Connection unexpectedly closed')
+
+            self._print_debug('reply:', line)
+
+            lines.append(line[4:].strip(b' \t\r\n'))
+            code = line[:3]
+
+            if line[3:4] != b'-':
+                break
+
+        try:
+            code = int(code)
+        except ValueError:
+            code = -1
+
+        return code, b'\n'.join(lines)
+
+    async def command(self, cmd, args=''):
+        """Send a command and return the reply."""
+
+        line = f'{cmd} {args}'.strip() if args else cmd
+        await self.send(line.encode('ascii') + CRLF)
+        return await self.getreply()
+
+    async def send(self, data):
+        """Send raw data to the remote server."""
+
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected('please run connect() first')
+
+        self._print_debug('send:', data)
+        self._writer.write(data)
+
+        try:
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+        except (asyncio.TimeoutError, OSError) as exc:
+            self.close()
+            raise smtplib.SMTPServerDisconnected(
+                f'Connection to remote failed: {exc}') from exc
+
+    async def ehlo(self):
+        """Greet the remote server and record the ESMTP extensions."""
+
+        with self.timings.measure('ehlo'):
+            code, msg = await self.command('EHLO', self.local_hostname)
+
+            if code != 250:
+                self.esmtp_features = {}
+                code, msg = await self.command('HELO', self.local_hostname)
+                if code != 250:
+                    raise smtplib.SMTPHeloError(code, msg)
+                return code, msg
+
+        self.esmtp_features = {}
+        for line in msg.decode('latin-1').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.esmtp_features[keyword.lower()] = params.strip()
+
+        return code, msg
+
+    def has_extn(self, name):
+        return name.lower() in self.esmtp_features
+
+    async def starttls(self, context):
+        """Upgrade the connection to TLS and greet the server again."""
+
+        if not self.has_extn('starttls'):
+            raise smtplib.SMTPNotSupportedError(
+                'STARTTLS extension not supported by server.')
+
+        with self.timings.measure('ehlo'):
+            code, msg = await self.command('STARTTLS')
+            if code != 220:
+                raise smtplib.SMTPResponseException(code, msg)
+
+            if hasattr(self._writer, 'start_tls'):
+                await self._writer.start_tls(context,
+                                             server_hostname=self.host)
+            else:
+                # StreamWriter.start_tls is only available on python 3.11+
+                loop = asyncio.get_running_loop()
+                transport = self._writer.transport
+                transport = await loop.start_tls(transport,
+                                                 transport.get_protocol(),
+                                                 context,
+                                                 server_hostname=self.host)
+                self._writer._transport = transport
+                self._reader._transport = transport
+
+            self.esmtp_features = {}
+            return await self.ehlo()
+
+    async def sendmail(self, from_addr, to_addrs, msg):
+        """Send a message, see `smtplib.SMTP.sendmail`."""
+
+        if isinstance(msg, str):
+            msg = LINE_ENDINGS.sub('\r\n', msg).encode('ascii')
+
+        options = ''
+        if self.has_extn('size'):
+            options = f' size={len(msg)}'
+
+        with self.timings.measure('mail'):
+            code, resp = await self.command(
+                'MAIL', f'FROM:{smtplib.quoteaddr(from_addr)}{options}')
+            if code != 250:
+                await self._reset(code)
+                raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+            refused = {}
+            for addr in to_addrs:
+                code, resp = await self.command(
+                    'RCPT', f'TO:{smtplib.quoteaddr(addr)}')
+                if code not in (250, 251):
+                    refused[addr] = (code, resp)
+                if code == 421:
+                    self.close()
+                    raise smtplib.SMTPRecipientsRefused(refused)
+
+        if len(refused) == len(to_addrs):
+            await self._reset(code)
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, resp = await self.data(msg)
+        if code != 250:
+            await self._reset(code)
+            raise smtplib.SMTPDataError(code, resp)
+
+        return refused
+
+    async def data(self, msg):
+        """Send the message content with the DATA command."""
+
+        with self.timings.measure('data'):
+            code, resp = await self.command('DATA')
+            if code != 354:
+                raise smtplib.SMTPDataError(code, resp)
+
+            if isinstance(msg, WireStream):
+                last = b''
+                for chunk in msg.chunks(stuffed=True):
+                    await self.send(chunk)
+                    last = chunk
+                if not last.endswith(CRLF):
+                    await self.send(CRLF)
+                await self.send(b'.' + CRLF)
+                return await self.getreply()
+
+            data = LEADING_PERIODS.sub(b'..', msg)
+            if not data.endswith(CRLF):
+                data += CRLF
+
+            await self.send(data + b'.' + CRLF)
+            return await self.getreply()
+
+    async def noop(self):
+        return await self.command('NOOP')
+
+    async def rset(self):
+        return await self.command('RSET')
+
+    async def quit(self):
+        """Say goodbye and close the connection."""
+        try:
+            return await self.command('QUIT')
+        finally:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = self._reader = None
+
+    async def _reset(self, code):
+        if code == 421:
+            self.close()
+        else:
+            try:
+                await self.rset()
+            except smtplib.SMTPServerDisconnected:
+                pass
+
+    def _print_debug(self, *args):
+        if self.debug:
+            print(time.strftime('%H:%M:%S'), *args, file=sys.stderr)
+
+
+class AsyncMailer(Mailer):
+    """Drives many SMTP sessions at once from a single event loop.
+
+    Drop-in replacement for `Mailer`: `send` hands the message over to an
+    event loop running in a background thread and returns immediately.
+    Pending deliveries are awaited when the mailer is closed.
+
+    Args:
+        concurrency (int): Maximum number of concurrent SMTP sessions.
+        host_concurrency (int): Maximum number of concurrent SMTP sessions
+            per destination host.
+        *args, **kwargs: See `Mailer`.
+    """
+
+    resolver_class = Resolver
+
+    def __init__(self, *args, concurrency=64, host_concurrency=8, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+
+        self._idle = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        # limit the number of messages in flight to keep memory bounded
+        self._backlog = threading.BoundedSemaphore(concurrency * 2)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        name='spool-async-mailer',
+                                        daemon=True)
+        self._thread.start()
+
+        self._run(self._setup())
+
+    def send(self, msg, print_only=False):
+        """Queue a message for delivery, see `Mailer.send`."""
+
+        if print_only:
+            self._dump_message(msg)
+            return
+
+        sender = formataddr(msg.sender)
+
+        recipients = msg.recipients + msg.cc_addrs + msg.bcc_addrs
+        recipients = [formataddr(r) for r in recipients]
+
+        data = msg.as_stream()
+
+        self._backlog.acquire()
+        future = asyncio.run_coroutine_threadsafe(
+            self._send(sender, recipients, msg.name, data), self.loop)
+
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def close(self):
+        """Wait for pending deliveries and close all connections."""
+
+        try:
+            if not self.loop.is_running():
+                return
+
+            with self._lock:
+                pending = list(self._pending)
+            concurrent.futures.wait(pending)
+
+            self._run(self._close_idle())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+
+        finally:
+            # also release the executor and pool if the loop already stopped
+            super().close()
+
+    def retry(self, entry, data):
+        """Retry the delivery of a queued message, see `Mailer.retry`."""
+        return self._run(self._retry(entry, data))
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._backlog.release()
+
+        if not future.cancelled() and future.exception():
+            LOG.error('Unexpected error while sending message: %s',
+                      future.exception())
+
+    async def _setup(self):
+        # semaphores must be created within the loop on python < 3.10
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._host_semaphores = {}
+
+    async def _send(self, sender, recipients, name, data):
+
+        if self.relay:
+            for domain, _ in self._group_by_domain(recipients):
+                await asyncio.sleep(self.scheduler.reserve(domain))
+
+            result = await self._send_message(self.relay, sender, recipients,
+                                              name, data)
+            await self._enqueue(name, sender, result, data)
+            return
+
+        deliveries = [(domain, list(rcpts)) for domain, rcpts
+                      in self._group_by_domain(recipients)]
+
+        results = await asyncio.gather(*[
+            self._send_domain(domain, sender, rcpts, name, data)
+            for domain, rcpts in deliveries
+        ], return_exceptions=True)
+
+        for (domain, rcpts), result in zip(deliveries, results):
+            # a single domain must not drop the results of the others
+            if isinstance(result, Exception):
+                result = self._unexpected_error(result, name, domain, rcpts)
+            await self._enqueue(name, sender, result, data, domain)
+
+    async def _retry(self, entry, data):
+
+        if entry.host:
+            for domain, _ in self._group_by_domain(entry.recipients):
+                await asyncio.sleep(self.scheduler.reserve(domain))
+
+            return await self._send_message(entry.host, entry.sender,
+                                             entry.recipients, entry.name,
+                                             data)
+
+        return await self._send_domain(entry.domain, entry.sender,
+                                       entry.recipients, entry.name, data)
+
+    async def _enqueue(self, name, sender, result, data, domain=None):
+        # writing to the spool directory must not block the event loop
+        if result.deferred and self.queue is not None:
+            await self.loop.run_in_executor(None, super()._enqueue, name,
+                                            sender, result, data, domain)
+
+    async def _send_domain(self, domain, sender, recipients, name, data):
+
+        await asyncio.sleep(self.scheduler.reserve(domain))
+
+        try:
+            host = await self._get_remote(domain)
+
+        except ResolverTimeoutError as err:
+            LOG.error('Failed to send message: %s [name=%s]', err, name)
+            return Result(deferred=recipients, error=str(err))
+
+        except RemoteNotFoundError as err:
+            LOG.error('Failed to send message: %s [name=%s]', err, name)
+            return Result(error=str(err))
+
+        return await self._send_message(host, sender, recipients, name, data)
+
+    async def _get_remote(self, domain, lifetime=10.0):
+        """Returns the mail exchange server for a given domain."""
+
+        match = DOMAIN_LITERAL.fullmatch(domain)
+        if match:
+            return match.group('ip_address')
+
+        try:
+            with metrics.timer('mailer.mx_lookup'):
+                answers = await self.resolver.resolve(domain, 'MX',
+                                                      lifetime=lifetime)
+            return self._get_exchange(answers)
+
+        except Timeout as exc:
+            raise ResolverTimeoutError(
+                'Query for mx record timed out. '
+                f'[domain={domain}, timeout={lifetime}s]') from exc
+
+        except NXDOMAIN as exc:
+            raise RemoteNotFoundError(
+                f'No mx record found for domain. [domain={domain}]') from exc
+
+    async def _connect(self, host, port):
+        """Connect to the SMTP server."""
+        LOG.info('Connecting to remote server. [host=%s, port=%s, helo=%s]',
+                 host, port, self.helo)
+
+        server = AsyncSMTP(host, port, self.helo, self.timeout, self.debug)
+
+        try:
+            await server.connect()
+
+        except ConnectionRefusedError as exc:
+            raise MailerError(
+                f'Remote refused connection. [host={host}, port={port}]'
+            ) from exc
+
+        except asyncio.TimeoutError as exc:
+            raise MailerError(
+                f'Timeout while connecting to remote. [host={host}, port={port}]'
+            ) from exc
+
+        try:
+            await server.ehlo()
+
+            if self.starttls:
+                context = ssl.create_default_context()
+                try:
+                    await server.starttls(context)
+                except smtplib.SMTPNotSupportedError:
+                    LOG.warning(
+                        ('No support for STARTTLS command by remote server. '
+                         '[host=%s, port=%s]'), host, port)
+
+        except (smtplib.SMTPException, OSError):
+            # don't leave a half-open connection behind
+            server.close()
+            raise
+
+        return server
+
+    async def _send_message(self, host, sender, recipients, name, data):
+        """Send a message to a single remote mail server"""
+
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(
+                self.host_concurrency)
+
+        async with self._semaphore, self._host_semaphores[host]:
+
+            started = time.perf_counter()
+            key = (host, self.port, self.starttls)
+
+            try:
+                pooled = await self._acquire(key)
+                if pooled is None:
+                    with metrics.timer('mailer.connect'):
+                        pooled = PooledConnection(await self._connect(
+                            host, self.port))
+
+            # before OSError, which SMTPException is derived from
+            except smtplib.SMTPException as exc:
+                self._log_failure(exc, name, host)
+                result = Result.from_exception(exc, recipients)
+                self._record(host, name, None, started, data, result)
+                return result
+
+            except (MailerError, OSError) as err:
+                LOG.error('Failed to send message: %s [name=%s]', err, name)
+                result = Result(deferred=recipients, error=str(err))
+                self._record(host, name, None, started, data, result)
+                return result
+
+            try:
+                with metrics.timer('mailer.sendmail'):
+                    refused = await pooled.connection.sendmail(
+                        sender, recipients, data)
+
+            except (smtplib.SMTPException, OSError) as exc:
+                if not isinstance(exc, smtplib.SMTPException):
+                    pooled.connection.close()
+                self._log_failure(exc, name, host)
+                result = Result.from_exception(exc, recipients)
+
+            else:
+                self._log_success(refused, name, host)
+                result = Result(sent=True, deferred=_temporary(refused))
+
+            finally:
+                await self._release(key, pooled)
+
+            self._record(host, name, pooled.connection, started, data, result)
+            return result
+
+    async def _acquire(self, key):
+        """Return a healthy idle connection for `key` or None."""
+
+        idle = self._idle.get(key, [])
+
+        while idle:
+            pooled = idle.pop()
+
+            if time.monotonic() - pooled.last_used > self.pool.idle_timeout:
+                await self._quit(pooled.connection)
+                continue
+
+            try:
+                code, _ = await pooled.connection.noop()
+            except smtplib.SMTPException:
+                code = None
+
+            if code == 250:
+                return pooled
+
+            pooled.connection.close()
+
+        return None
+
+    async def _release(self, key, pooled):
+        """Hand a connection back to the idle list after a transaction."""
+
+        pooled.messages += 1
+
+        if not pooled.connection.is_connected:
+            return
+
+        if pooled.messages >= self.pool.max_messages:
+            await self._quit(pooled.connection)
+            return
+
+        try:
+            code, _ = await pooled.connection.rset()
+        except smtplib.SMTPException:
+            code = None
+
+        if code != 250:
+            pooled.connection.close()
+            return
+
+        pooled.last_used = time.monotonic()
+        self._idle.setdefault(key, []).append(pooled)
+
+    async def _close_idle(self):
+        for idle in self._idle.values():
+            for pooled in idle:
+                await self._quit(pooled.connection)
+
+        self._idle.clear()
+
+    @staticmethod
+    async def _quit(server):
+        try:
+            await server.quit()
+        except smtplib.SMTPException:
+            server.close()
@@ -0,0 +1,250 @@
+import json
+import math
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+PHASES = ('connect', 'ehlo', 'mail', 'data', 'total')
+PERCENTILES = (50, 95, 99)
+
+PHASE_LABELS = {
+    'connect': 'connect',
+    'ehlo': 'EHLO/STARTTLS',
+    'mail': 'MAIL/RCPT',
+    'data': 'DATA',
+    'total': 'total',
+}
+
+
+class Timings:
+    """Seconds spent per SMTP phase on a connection.
+
+    Nested measurements are attributed to the outermost phase, e.g. the
+    EHLO sent by `starttls` is part of the `ehlo` phase.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._active = False
+
+    @contextmanager
+    def measure(self, phase):
+        if self._active:
+            yield
+            return
+
+        self._active = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active = False
+            self.phases[phase] = (self.phases.get(phase, 0.0) +
+                                  time.perf_counter() - start)
+
+    def pop(self):
+        """Return and reset the timings measured so far."""
+        phases, self.phases = self.phases, {}
+        return phases
+
+
+class TimedSMTP(smtplib.SMTP):
+    """SMTP client measuring the time spent per phase of a transaction."""
+
+    def __init__(self, *args, **kwargs):
+        self.timings = Timings()
+        super().__init__(*args, **kwargs)
+
+    def connect(self, *args, **kwargs):
+        with self.timings.measure('connect'):
+            return super().connect(*args, **kwargs)
+
+    def ehlo(self, *args, **kwargs):
+        with self.timings.measure('ehlo'):
+            return super().ehlo(*args, **kwargs)
+
+    def helo(self, *args, **kwargs):
+        with self.timings.measure('ehlo'):
+            return super().helo(*args, **kwargs)
+
+    def starttls(self, *args, **kwargs):
+        with self.timings.measure('ehlo'):
+            return super().starttls(*args, **kwargs)
+
+    def mail(self, *args, **kwargs):
+        with self.timings.measure('mail'):
+            return super().mail(*args, **kwargs)
+
+    def rcpt(self, *args, **kwargs):
+        with self.timings.measure('mail'):
+            return super().rcpt(*args, **kwargs)
+
+    def data(self, *args, **kwargs):
+        with self.timings.measure('data'):
+            return super().data(*args, **kwargs)
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+
+    if not values:
+        return None
+
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(0, rank - 1)]
+
+
+class Sample:
+    """A single delivery attempt recorded by `BenchStats`."""
+
+    __slots__ = ('host', 'name', 'phases', 'size', 'sent')
+
+    def __init__(self, host, name, phases, size, sent):
+        self.host = host
+        self.name = name
+        self.phases = phases
+        self.size = size
+        self.sent = sent
+
+
+class BenchStats:
+    """Collects throughput and latency of delivery attempts.
+
+    Args:
+        clock (callable): Clock returning seconds, used for the duration.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = None
+        self.stopped = None
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = self.clock()
+
+    def stop(self):
+        self.stopped = self.clock()
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        stopped = self.clock() if self.stopped is None else self.stopped
+        return stopped - self.started
+
+    def record(self, host, name, phases, total, size, sent):
+        """Record a delivery attempt.
+
+        Args:
+            host (str): The remote server.
+            name (str): Name of the mail.
+            phases (dict): Seconds spent per SMTP phase.
+            total (float): Seconds spent on the whole attempt.
+            size (int): Size of the message in bytes.
+            sent (bool): Whether the remote server accepted the message.
+        """
+
+        phases = dict(phases, total=total)
+        with self._lock:
+            self._samples.append(Sample(host, name, phases, size, sent))
+
+    def summary(self):
+        """Return the results overall, per host and per mail name."""
+
+        with self._lock:
+            samples = list(self._samples)
+
+        duration = self.duration
+
+        def group(key):
+            groups = {}
+            for sample in samples:
+                groups.setdefault(getattr(sample, key), []).append(sample)
+            return {k: self._aggregate(v, duration)
+                    for k, v in sorted(groups.items())}
+
+        return {
+            'duration': duration,
+            'total': self._aggregate(samples, duration),
+            'hosts': group('host'),
+            'mails': group('name'),
+        }
+
+    @staticmethod
+    def _aggregate(samples, duration):
+
+        sent = [s for s in samples if s.sent]
+        size = sum(s.size for s in sent)
+
+        latency = {}
+        for phase in PHASES:
+            values = sorted(s.phases[phase] for s in sent
+                            if phase in s.phases)
+            if values:
+                latency[phase] = dict(
+                    count=len(values),
+                    **{f'p{p}': percentile(values, p) for p in PERCENTILES})
+
+        return {
+            'messages': len(sent),
+            'failed': len(samples) - len(sent),
+            'bytes': size,
+            'messages_per_sec': len(sent) / duration if duration else 0.0,
+            'bytes_per_sec': size / duration if duration else 0.0,
+            'latency': latency,
+        }
+
+    def write(self, path):
+        """Write the summary as JSON to `path`."""
+        with open(path, 'w') as fh:
+            json.dump(self.summary(), fh, indent=2)
+
+    def report(self):
+        """Return a human readable summary."""
+
+        summary = self.summary()
+        lines = []
+
+        def section(title, stats):
+            lines.append(
+                f'{title}: {stats["messages"]} sent, {stats["failed"]} failed, '
+                f'{stats["messages_per_sec"]:.1f} msg/s, '
+                f'{format_size(stats["bytes_per_sec"])}/s')
+
+            if not stats['latency']:
+                return
+
+            lines.append(f'  {"latency (ms)":<16}{"count":>8}' +
+                         ''.join(f'{"p" + str(p):>10}' for p in PERCENTILES))
+
+            for phase, values in stats['latency'].items():
+                lines.append(
+                    f'  {PHASE_LABELS[phase]:<16}{values["count"]:>8}' +
+                    ''.join(f'{values["p" + str(p)] * 1000:>10.2f}'
+                            for p in PERCENTILES))
+
+        section(f'Total ({summary["duration"]:.2f}s)', summary['total'])
+
+        for host, stats in summary['hosts'].items():
+            lines.append('')
+            section(f'Host {host}', stats)
+
+        for name, stats in summary['mails'].items():
+            lines.append('')
+            section(f'Mail {name}', stats)
+
+        return '\n'.join(lines)
+
+
+def format_size(size):
+    """Format a number of bytes in a human readable way."""
+
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+
+from .parser import CONFIG_SCHEMA
+
+LOG = logging.getLogger(__name__)
+
+# bump when the format of the cached entries changes
+CACHE_FORMAT = 1
+
+
+def default_cache_dir():
+    """Return the cache directory, following the XDG base directory spec."""
+
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'spool'
+
+
+def package_version():
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        return 'unknown'
+
+    try:
+        return version('spool')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def schema_digest(schema):
+    """Return a digest of a schema, stable across processes.
+
+    Callables, like coercions, are represented by their qualified name, as
+    their repr contains a memory address.
+    """
+
+    def default(value):
+        if callable(value):
+            return f'{value.__module__}.{value.__qualname__}'
+        raise TypeError(f'Unexpected value in schema: {value!r}')
+
+    dump = json.dumps(schema, sort_keys=True, default=default)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class ConfigCache:
+    """On-disk cache of parsed and validated configs.
+
+    Entries are keyed by a hash of the config file content, the spool
+    version and the config schema. The referenced loop and S/MIME files are
+    recorded with their modification time and size, an entry is only used
+    if none of them has changed.
+
+    Args:
+        path (str, optional): The cache directory, see `default_cache_dir`.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_cache_dir() / 'configs'
+        self._salt = (f'{CACHE_FORMAT}:{package_version()}:'
+                      f'{schema_digest(CONFIG_SCHEMA)}').encode()
+
+    def key(self, source):
+        """Return the key of a config file's content."""
+        digest = hashlib.sha256(self._salt)
+        digest.update(b'\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def get(self, source):
+        """Return the cached config of a config file's content or None.
+
+        Args:
+            source (bytes): Content of the config file.
+        """
+
+        path = self.path / f'{self.key(source)}.pickle'
+
+        try:
+            with open(path, 'rb') as fh:
+                entry = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:  # pylint: disable=broad-except
+            LOG.debug('Ignoring invalid cache entry: %s [path=%s]', ex, path)
+            return None
+
+        if entry.get('files') != fingerprint(entry.get('files', {})):
+            LOG.debug('Referenced files changed, ignoring cache entry. '
+                      '[path=%s]', path)
+            return None
+
+        return entry['config']
+
+    def put(self, source, config, files=()):
+        """Store a validated config.
+
+        Args:
+            source (bytes): Content of the config file.
+            config (dict): The parsed and validated config.
+            files (iterable): Files referenced by the config.
+        """
+
+        path = self.path / f'{self.key(source)}.pickle'
+        entry = {'files': fingerprint(files), 'config': config}
+
+        try:
+            self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+            tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            with open(tmp, 'wb') as fh:
+                pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except (OSError, pickle.PicklingError) as ex:
+            LOG.debug('Unable to write config cache: %s [path=%s]', ex, path)
+
+
+def fingerprint(files):
+    """Return the modification time and size of files by path."""
+
+    result = {}
+    for name in files:
+        try:
+            stat = os.stat(name)
+        except OSError:
+            result[str(name)] = None
+        else:
+            result[str(name)] = (stat.st_mtime_ns, stat.st_size)
+
+    return result
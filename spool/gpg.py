@@ -1,11 +1,19 @@
 import logging
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
-import gnupg
 
 LOG = logging.getLogger(__name__)
 
-gpg = gnupg.GPG()
+_gpg = None
+
+
+def get_gpg():
+    """Return the GPG instance, spawning the gpg binary on first use."""
+    global _gpg
+    if _gpg is None:
+        import gnupg
+        _gpg = gnupg.GPG()
+    return _gpg
 
 def sign(message, key_fingerprint):
     """Sign a given message with GPG."""
@@ -14,7 +22,7 @@ def sign(message, key_fingerprint):
 
     signed.attach(message)
 
-    result = gpg.sign(message.as_string(), keyid=key_fingerprint, detach=True, clearsign=False)
+    result = get_gpg().sign(message.as_string(), keyid=key_fingerprint, detach=True, clearsign=False)
 
     if not result:
         LOG.error('Failed to sign message with key: %s', key_fingerprint)
@@ -29,7 +37,7 @@ def sign(message, key_fingerprint):
 
 def encrypt(message, recipients):
     """Encrypt a given message with GPG."""
-    encrypted_data = gpg.encrypt(message.as_string(), recipients)
+    encrypted_data = get_gpg().encrypt(message.as_string(), recipients)
 
     if not encrypted_data.ok:
         LOG.error('Failed to encrypt message for recipients: %s', ', '.join(recipients))
@@ -0,0 +1,26 @@
+import functools
+import socket
+
+
+@functools.lru_cache(maxsize=None)
+def fqdn():
+    """Return the fully qualified domain name of the host.
+
+    Resolved once per process, `socket.getfqdn` may query the DNS.
+    """
+    return socket.getfqdn()
+
+
+@functools.lru_cache(maxsize=None)
+def helo_name():
+    """Return the HELO/EHLO name based on the hostname.
+
+    Falls back to the address literal of the host if the hostname is not
+    fully qualified.
+    """
+
+    name = fqdn()
+    if '.' in name:
+        return name
+
+    return f'[{socket.gethostbyname(socket.gethostname())}]'
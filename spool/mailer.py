@@ -1,15 +1,25 @@
+import contextlib
 import itertools
 import logging
 import re
 import smtplib
 import socket
 import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import formataddr
 
 from dns.exception import Timeout
 from dns.resolver import NXDOMAIN, Cache, Resolver
 
+from . import metrics
+from .bench import TimedSMTP
 from .exceptions import SpoolError
+from .hostname import helo_name
+from .queue import QueueEntry
+from .scheduler import RateScheduler
+from .wire import WireStream
 
 LOG = logging.getLogger(__name__)
 
@@ -30,9 +40,236 @@ class ResolverTimeoutError(MailerError):
     """Resolver query timed out."""
 
 
+class Result:
+    """Outcome of a delivery attempt to a single remote server.
+
+    Args:
+        sent (bool): Whether the remote server accepted the message.
+        deferred (list, optional): Recipients failed temporarily and worth
+            retrying later.
+        error (str, optional): Reason of the failure.
+    """
+
+    def __init__(self, sent=False, deferred=None, error=None):
+        self.sent = sent
+        self.deferred = deferred or []
+        self.error = error
+
+    @classmethod
+    def from_exception(cls, exc, recipients):
+        """Create the result of a failed SMTP transaction."""
+
+        if isinstance(exc, smtplib.SMTPRecipientsRefused):
+            return cls(deferred=_temporary(exc.recipients),
+                       error='Remote refused all recipients.')
+
+        if isinstance(exc, smtplib.SMTPResponseException):
+            error = f'{exc.smtp_code} {_decode(exc.smtp_error)}'
+            if 400 <= exc.smtp_code < 500:
+                return cls(deferred=recipients, error=error)
+            return cls(error=error)
+
+        if isinstance(exc, smtplib.SMTPServerDisconnected):
+            return cls(deferred=recipients,
+                       error='Connection closed by remote host.')
+
+        # network errors, e.g. a refused connection or a DNS failure
+        if (isinstance(exc, OSError)
+                and not isinstance(exc, smtplib.SMTPException)):
+            return cls(deferred=recipients, error=str(exc))
+
+        return cls(error=str(exc))
+
+
+def _temporary(refused):
+    """Return the recipients refused with a transient (4xx) error."""
+    if not isinstance(refused, dict):
+        return []
+    return [rcpt for rcpt, (code, _) in refused.items() if 400 <= code < 500]
+
+
+def _decode(response):
+    if isinstance(response, bytes):
+        return response.decode(errors='replace')
+    return response
+
+
+class PooledConnection:
+    """An open SMTP connection held by a connection pool."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        """Close the connection, politely if possible."""
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+
+
+class ConnectionPool:
+    """Pool of open, already greeted SMTP connections.
+
+    Connections are keyed by ``(host, port, tls)``. A connection handed
+    back to the pool is reset with RSET and checked with NOOP before it
+    is reused. Connections are retired after sending `max_messages`
+    messages or after being idle for more than `idle_timeout` seconds.
+
+    Args:
+        max_messages (int): Number of messages to send over a single
+            connection before it is closed.
+        idle_timeout (float): Number of seconds a connection may stay
+            unused in the pool.
+    """
+
+    def __init__(self, max_messages=100, idle_timeout=30.0):
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Return a healthy idle connection for `key` or None."""
+
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                pooled = idle.pop()
+
+            if time.monotonic() - pooled.last_used > self.idle_timeout:
+                LOG.debug('Closing idle connection. [host=%s, port=%s]',
+                          *key[:2])
+                pooled.close()
+                continue
+
+            try:
+                code, _ = pooled.connection.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+
+            if code == 250:
+                LOG.debug('Reusing connection. [host=%s, port=%s]', *key[:2])
+                return pooled
+
+            pooled.connection.close()
+
+    def release(self, key, pooled):
+        """Hand a connection back to the pool after a transaction."""
+
+        pooled.messages += 1
+
+        if pooled.connection.sock is None:
+            return
+
+        if pooled.messages >= self.max_messages:
+            LOG.debug('Retiring connection after %d messages. '
+                      '[host=%s, port=%s]', pooled.messages, *key[:2])
+            pooled.close()
+            return
+
+        try:
+            code, _ = pooled.connection.rset()
+        except (smtplib.SMTPException, OSError):
+            code = None
+
+        if code != 250:
+            pooled.connection.close()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(key, []).append(pooled)
+
+    def close(self):
+        """Close all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for pooled in connections:
+                pooled.close()
+
+
+def sendmail_stream(connection, sender, recipients, stream):
+    """Send a streamed message, see `smtplib.SMTP.sendmail`.
+
+    The message is sent chunk by chunk instead of being quoted and sent as
+    a whole.
+
+    Args:
+        connection (:obj:`smtplib.SMTP`): The connection to send with.
+        sender (str): Envelope sender.
+        recipients (list): Envelope recipients.
+        stream (:obj:`WireStream`): The message.
+
+    Returns:
+        dict: The refused recipients.
+    """
+
+    connection.ehlo_or_helo_if_needed()
+
+    options = []
+    if connection.does_esmtp and connection.has_extn('size'):
+        options.append(f'size={len(stream)}')
+
+    code, resp = connection.mail(sender, options)
+    if code != 250:
+        if code == 421:
+            connection.close()
+        else:
+            connection._rset()  # pylint: disable=protected-access
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+
+    refused = {}
+    for recipient in recipients:
+        code, resp = connection.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+        if code == 421:
+            connection.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+    if len(refused) == len(recipients):
+        connection._rset()  # pylint: disable=protected-access
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    timings = getattr(connection, 'timings', None)
+    with timings.measure('data') if timings else contextlib.nullcontext():
+        code, resp = connection.docmd('data')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+
+        last = b''
+        for chunk in stream.chunks(stuffed=True):
+            connection.send(chunk)
+            last = chunk
+
+        if not last.endswith(b'\r\n'):
+            connection.send(b'\r\n')
+        connection.send(b'.\r\n')
+        code, resp = connection.getreply()
+
+    if code != 250:
+        if code == 421:
+            connection.close()
+        else:
+            connection._rset()  # pylint: disable=protected-access
+        raise smtplib.SMTPDataError(code, resp)
+
+    return refused
+
+
 class Mailer:
     """Represents an SMTP connection."""
 
+    resolver_class = Resolver
+
     def __init__(self,
                  relay=None,
                  port=25,
@@ -41,7 +278,13 @@ class Mailer:
                  debug=False,
                  starttls=False,
                  nameservers=None,
-                 no_cache=False):
+                 no_cache=False,
+                 max_messages=100,
+                 idle_timeout=30.0,
+                 workers=8,
+                 scheduler=None,
+                 queue=None,
+                 stats=None):
 
         self.port = port
         self.relay = relay
@@ -51,14 +294,27 @@ class Mailer:
         self.debug = debug
         self.no_cache = no_cache
         self.reorder_recipients = True
+        self.workers = workers
+        self.scheduler = scheduler or RateScheduler()
+        self.queue = queue
+        self.stats = stats
+        self._executor = None
 
         self.resolver = self._configure_resolver(nameservers)
+        self.pool = ConnectionPool(max_messages, idle_timeout)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        self.close()
+
+    def close(self):
+        """Close all pooled connections."""
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        self.pool.close()
 
     def send(self, msg, print_only=False):
         """Send a message.
@@ -78,32 +334,122 @@ class Mailer:
         recipients = msg.recipients + msg.cc_addrs + msg.bcc_addrs
         recipients = [formataddr(r) for r in recipients]
 
+        data = msg.as_stream()
+
         if self.relay:
-            self._send_message(self.relay, sender, recipients, msg)
+            for domain, _ in self._group_by_domain(recipients):
+                self.scheduler.acquire(domain)
+
+            result = self._send_message(self.relay, sender, recipients,
+                                        msg.name, data)
+            self._enqueue(msg.name, sender, result, data)
 
         else:
+            deliveries = [(domain, list(rcpts)) for domain, rcpts
+                          in self._group_by_domain(recipients)]
 
-            def domain(address):
-                return address.split('@', 1)[-1]
+            def deliver(delivery):
+                domain, rcpts = delivery
+                try:
+                    result = self._send_domain(domain, sender, rcpts,
+                                               msg.name, data)
+                # a single domain must not drop the results of the others
+                except Exception as exc:  # pylint: disable=broad-except
+                    result = self._unexpected_error(exc, msg.name, domain,
+                                                    rcpts)
+                return domain, result
+
+            if len(deliveries) > 1 and self.workers > 1:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='spool-mailer')
+                results = list(self._executor.map(deliver, deliveries))
+            else:
+                results = [deliver(delivery) for delivery in deliveries]
 
-            if self.reorder_recipients:
-                recipients = sorted(recipients, key=domain)
+            for domain, result in results:
+                self._enqueue(msg.name, sender, result, data, domain)
 
-            for domain, recipients in itertools.groupby(recipients, domain):
+            failed = [domain for domain, result in results if not result.sent]
+            if failed and len(results) > 1:
+                LOG.error(('Failed to deliver message to %d of %d domains. '
+                           '[name=%s, domains=%s]'), len(failed), len(results),
+                          msg.name, ', '.join(failed))
 
-                try:
-                    host = self._get_remote(domain)
+    def retry(self, entry, data):
+        """Retry the delivery of a queued message.
+
+        Args:
+            entry (:obj:`QueueEntry`): Envelope of the queued message.
+            data (bytes): The serialized message.
+
+        Returns:
+            :obj:`Result`: The outcome of the delivery attempt.
+        """
+
+        if entry.host:
+            for domain, _ in self._group_by_domain(entry.recipients):
+                self.scheduler.acquire(domain)
+
+            return self._send_message(entry.host, entry.sender,
+                                      entry.recipients, entry.name, data)
 
-                except RemoteNotFoundError as err:
-                    LOG.error('Failed to send message: %s [name=%s]', err,
-                              msg.name)
-                    continue
+        return self._send_domain(entry.domain, entry.sender, entry.recipients,
+                                 entry.name, data)
 
-                self._send_message(host, sender, list(recipients), msg)
+    def _enqueue(self, name, sender, result, data, domain=None):
+        """Put the deferred recipients of a delivery into the queue."""
+
+        if not result.deferred or self.queue is None:
+            return
+
+        entry = QueueEntry(name, sender, result.deferred, host=self.relay,
+                           domain=domain, attempts=1, error=result.error)
+        self.queue.put(entry, data)
+
+    def _send_domain(self, domain, sender, recipients, name, data):
+        """Send a message to the mail exchange of a single domain."""
+
+        self.scheduler.acquire(domain)
+
+        try:
+            host = self._get_remote(domain)
+
+        except ResolverTimeoutError as err:
+            LOG.error('Failed to send message: %s [name=%s]', err, name)
+            return Result(deferred=recipients, error=str(err))
+
+        except MailerError as err:
+            LOG.error('Failed to send message: %s [name=%s]', err, name)
+            return Result(error=str(err))
+
+        return self._send_message(host, sender, recipients, name, data)
+
+    @staticmethod
+    def _unexpected_error(exc, name, domain, recipients):
+        """Return the result of a delivery failed with an unexpected error."""
+
+        LOG.error('Unexpected error while sending message: %s '
+                  '[name=%s, domain=%s]', exc, name, domain)
+        return Result(deferred=recipients, error=str(exc))
+
+    def _group_by_domain(self, recipients):
+        """Group recipient addresses by their domain part."""
+
+        def domain(address):
+            return address.split('@', 1)[-1]
+
+        if self.reorder_recipients:
+            recipients = sorted(recipients, key=domain)
+
+        return itertools.groupby(recipients, domain)
 
     def _configure_resolver(self, nameservers):
         """Configure the DNS resolver."""
-        resolver = Resolver(configure=False) if nameservers else Resolver()
+        if nameservers:
+            resolver = self.resolver_class(configure=False)
+        else:
+            resolver = self.resolver_class()
 
         if nameservers:
             resolver.nameservers = [n.strip() for n in nameservers.split(',')]
@@ -116,11 +462,9 @@ class Mailer:
     @staticmethod
     def _get_helo_name():
         """Retrieve the helo/ehlo name based on the hostname."""
-        fqdn = socket.getfqdn()
-        if '.' in fqdn:
-            return fqdn
-        return f'[{socket.gethostbyname(socket.gethostname())}]'
+        return helo_name()
 
+    @metrics.timed('mailer.mx_lookup')
     def _get_remote(self, domain, lifetime=10.0):
         """Returns the mail exchange server for a given domain."""
 
@@ -130,8 +474,7 @@ class Mailer:
 
         try:
             answers = self.resolver.query(domain, 'MX', lifetime=lifetime)
-            peer = min(answers, key=lambda rdata: rdata.preference).exchange
-            return peer.to_text().rstrip('.') or peer.to_text()
+            return self._get_exchange(answers)
 
         except Timeout as exc:
             raise ResolverTimeoutError(
@@ -142,16 +485,25 @@ class Mailer:
             raise RemoteNotFoundError(
                 f'No mx record found for domain. [domain={domain}]') from exc
 
+    @staticmethod
+    def _get_exchange(answers):
+        """Returns the most preferred exchange of a mx record answer."""
+        peer = min(answers, key=lambda rdata: rdata.preference).exchange
+        return peer.to_text().rstrip('.') or peer.to_text()
+
+    @metrics.timed('mailer.connect')
     def _connect(self, host, port):
         """Connect to the SMTP server."""
         LOG.info('Connecting to remote server. [host=%s, port=%s, helo=%s]',
                  host, port, self.helo)
 
+        smtp_class = smtplib.SMTP if self.stats is None else TimedSMTP
+
         try:
-            server = smtplib.SMTP(host,
-                                  port,
-                                  timeout=self.timeout,
-                                  local_hostname=self.helo)
+            server = smtp_class(host,
+                                port,
+                                timeout=self.timeout,
+                                local_hostname=self.helo)
 
         except ConnectionRefusedError as exc:
             raise MailerError(
@@ -166,53 +518,123 @@ class Mailer:
         if self.debug:
             server.set_debuglevel(2)
 
-        if self.starttls:
-            context = ssl.create_default_context()
-            try:
-                server.starttls(context=context)
-            except smtplib.SMTPNotSupportedError:
-                LOG.warning(
-                    ('No support for STARTTLS command by remote server. '
-                     '[host=%s, port=%s]'), host, port)
+        try:
+            if self.starttls:
+                context = ssl.create_default_context()
+                try:
+                    server.starttls(context=context)
+                except smtplib.SMTPNotSupportedError:
+                    LOG.warning(
+                        ('No support for STARTTLS command by remote server. '
+                         '[host=%s, port=%s]'), host, port)
+
+            server.ehlo_or_helo_if_needed()
+
+        except (smtplib.SMTPException, OSError):
+            # don't leave a half-open connection behind
+            server.close()
+            raise
 
         return server
 
-    def _send_message(self, host, sender, recipients, msg):
-        """Send a message to a single remote mail server"""
+    def _send_message(self, host, sender, recipients, name, data):
+        """Send a message to a single remote mail server.
+
+        Returns:
+            :obj:`Result`: The outcome of the delivery attempt.
+        """
+
+        started = time.perf_counter()
+
+        key = (host, self.port, self.starttls)
+        pooled = self.pool.acquire(key)
+        if pooled is None:
+            try:
+                pooled = PooledConnection(self._connect(host, self.port))
+            except MailerError as err:
+                LOG.error('Failed to send message: %s [name=%s]', err, name)
+                result = Result(deferred=recipients, error=str(err))
+                self._record(host, name, None, started, data, result)
+                return result
+
+            except (smtplib.SMTPException, OSError) as exc:
+                self._log_failure(exc, name, host)
+                result = Result.from_exception(exc, recipients)
+                self._record(host, name, None, started, data, result)
+                return result
 
         try:
-            connection = self._connect(host, self.port)
-            refused = connection.sendmail(sender, recipients, msg.as_string())
+            with metrics.timer('mailer.sendmail'):
+                if isinstance(data, WireStream):
+                    refused = sendmail_stream(pooled.connection, sender,
+                                              recipients, data)
+                else:
+                    refused = pooled.connection.sendmail(sender, recipients,
+                                                         data)
+
+        except (smtplib.SMTPException, OSError) as exc:
+            if (isinstance(exc, smtplib.SMTPServerDisconnected)
+                    or not isinstance(exc, smtplib.SMTPException)):
+                pooled.connection.close()
+
+            self._log_failure(exc, name, host)
+            result = Result.from_exception(exc, recipients)
+
+        else:
+            self._log_success(refused, name, host)
+            result = Result(sent=True, deferred=_temporary(refused))
 
-        except smtplib.SMTPResponseException as err:
+        finally:
+            self.pool.release(key, pooled)
 
-            if isinstance(err, smtplib.SMTPSenderRefused):
-                LOG.error(('Failed to send message: Sender rejected.'
-                           '[name=%s, host=%s, port=%s]'), msg.name, host,
-                          self.port)
-            else:
-                LOG.error(('Error while sending message: %s - %s '
-                           '[name=%s, host=%s, port=%s]'), err.smtp_code,
-                          err.smtp_error.decode(), msg.name, host, self.port)
+        self._record(host, name, pooled.connection, started, data, result)
+        return result
+
+    def _record(self, host, name, connection, started, data, result):
+        """Record the timings of a delivery attempt in bench mode."""
+
+        if self.stats is None:
+            return
+
+        phases = connection.timings.pop() if connection else {}
+        self.stats.record(host, name, phases, time.perf_counter() - started,
+                          len(data), result.sent)
+
+    def _log_failure(self, exc, name, host):
+        """Log why a message could not be sent to a remote server."""
 
-        except smtplib.SMTPException as exc:
+        if isinstance(exc, smtplib.SMTPSenderRefused):
+            LOG.error(('Failed to send message: Sender rejected.'
+                       '[name=%s, host=%s, port=%s]'), name, host,
+                      self.port)
 
+        elif isinstance(exc, smtplib.SMTPResponseException):
+            LOG.error(('Error while sending message: %s - %s '
+                       '[name=%s, host=%s, port=%s]'), exc.smtp_code,
+                      exc.smtp_error.decode(), name, host, self.port)
+
+        else:
             if isinstance(exc, smtplib.SMTPRecipientsRefused):
                 err = 'Remote refused all recipients.'
 
             elif isinstance(exc, smtplib.SMTPServerDisconnected):
                 err = 'Connection closed by remote host.'
 
+            else:
+                err = exc
+
             LOG.error('Failed to send message: %s [name=%s, host=%s, port=%s]',
-                      err, msg.name, host, self.port)
+                      err, name, host, self.port)
 
-        else:
-            for recipient, (code, response) in refused.items():
-                LOG.warning('Remote refused recipient: %s [host=%s, port=%s]',
-                            recipient, host, self.port)
+    def _log_success(self, refused, name, host):
+        """Log a message accepted by a remote server."""
+
+        for recipient, (code, response) in refused.items():
+            LOG.warning('Remote refused recipient: %s [host=%s, port=%s]',
+                        recipient, host, self.port)
 
-            LOG.info('Message sent. [name=%s, host=%s, port=%s]', msg.name,
-                     host, self.port)
+        LOG.info('Message sent. [name=%s, host=%s, port=%s]', name,
+                 host, self.port)
 
     @staticmethod
     def _dump_message(msg):
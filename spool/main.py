@@ -1,15 +1,23 @@
 import argparse
+import functools
 import logging
 import random
 import string
 import sys
+import threading
 import time
 from pathlib import Path
+from queue import Full, Queue
 
+from . import metrics
+from .cache import ConfigCache
 from .exceptions import SpoolError
-from .mailer import Mailer
-from .message import Message, MessageError
-from .parser import Config, ConfigError
+from .parser import Config, ConfigError, Shard, parse_tags
+from .queue import MailQueue
+from .scheduler import Ramp, RateScheduler, parse_duration, parse_rate
+
+# mailers and messages depend on dns, dkim and cryptography, they are
+# imported on first use to keep the startup of the CLI fast
 
 LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
 LOG = logging.getLogger(__name__)
@@ -38,7 +46,27 @@ def parse_args(args):
     )
     parser.add_argument(
         '-d', '--delay', type=float,
-        help='Delay (in seconds) after each mail'
+        help='Delay (in seconds) between mails, same as --rate 1/DELAY'
+    )
+    parser.add_argument(
+        '--rate', type=parse_rate,
+        help='Overall rate of mails, e.g. 200/m (units: s, m, h)'
+    )
+    parser.add_argument(
+        '--burst', type=int, default=1,
+        help='Burst size of the overall rate (default: 1)'
+    )
+    parser.add_argument(
+        '--ramp', type=Ramp.parse, metavar='START:END:DURATION',
+        help='Ramp up the overall rate linearly, e.g. 1:50:2m'
+    )
+    parser.add_argument(
+        '--host-rate', type=parse_rate,
+        help='Rate of mails per destination domain, e.g. 10/m'
+    )
+    parser.add_argument(
+        '--host-burst', type=int, default=1,
+        help='Burst size of the rate per destination domain (default: 1)'
     )
     parser.add_argument(
         '-D', '--debug', action='store_true',
@@ -52,10 +80,19 @@ def parse_args(args):
         '-H', '--helo',
         help='HELO name for SMTP server connection'
     )
+    parser.add_argument(
+        '--msgid-domain', metavar='DOMAIN',
+        help='Domain of generated Message-IDs, defaults to the hostname'
+    )
     parser.add_argument(
         '-c', '--check', action='store_true',
         help='Check config files and exit'
     )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Number of processes checking config files, 0 for one per CPU '
+             '(default: %(default)s)'
+    )
     parser.add_argument(
         '-t', '--tags', help='Tags for execution'
     )
@@ -63,9 +100,83 @@ def parse_args(args):
         '--starttls', action='store_true',
         help='Use STARTTLS'
     )
+    parser.add_argument(
+        '--max-messages', type=int, default=100,
+        help='Messages sent per SMTP connection before reconnecting '
+             '(default: 100)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='Domains delivered to in parallel per message (default: 8)'
+    )
+    parser.add_argument(
+        '--engine', choices=['sync', 'async'], default='sync',
+        help='Delivery engine (default: sync)'
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=64,
+        help='Concurrent SMTP sessions of the async engine (default: 64)'
+    )
+    parser.add_argument(
+        '--host-concurrency', type=int, default=8,
+        help='Concurrent SMTP sessions per host of the async engine '
+             '(default: 8)'
+    )
+
+    parser.add_argument(
+        '--spool-dir', type=Path,
+        help='Queue deferred mails in this directory for later delivery'
+    )
+    parser.add_argument(
+        '--flush', action='store_true',
+        help='Retry queued mails until the spool directory is empty'
+    )
+    parser.add_argument(
+        '--max-attempts', type=int, default=10,
+        help='Delivery attempts of a queued mail before giving up '
+             '(default: 10)'
+    )
+
+    parser.add_argument(
+        '--repeat', type=int,
+        help='Send the mails of all config files N times (bench mode)'
+    )
+    parser.add_argument(
+        '--duration', type=parse_duration,
+        help='Keep sending the mails for a duration, e.g. 60s (bench mode)'
+    )
+    parser.add_argument(
+        '--bench-output', type=Path, metavar='FILE',
+        help='Write throughput and latency results as JSON (bench mode)'
+    )
+
+    parser.add_argument(
+        '--shard', type=Shard.parse, metavar='INDEX/COUNT',
+        help='Only send a share of the mails, e.g. 1/3 on the first of '
+             'three nodes'
+    )
+    parser.add_argument(
+        '--no-config-cache', action='store_true',
+        help='Always parse and validate the config files, instead of using '
+             'the cached results of unchanged files'
+    )
+    parser.add_argument(
+        '--attachment-cache', type=int, default=64, metavar='MB',
+        help='Memory for encoded attachments reused by other mails, 0 to '
+             'disable (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--metrics-json', type=Path, metavar='FILE',
+        help='Write wall time and calls per processing stage as JSON'
+    )
+    parser.add_argument(
+        '--metrics-prom', type=Path, metavar='FILE',
+        help='Write wall time and calls per processing stage in the '
+             'Prometheus text format'
+    )
 
     parser.add_argument(
-        'path', nargs='+', metavar='config', type=Path,
+        'path', nargs='*', metavar='config', type=Path,
         help='Path to spool config file'
     )
 
@@ -82,22 +193,39 @@ def parse_args(args):
         help='Silent mode (only errors)',
     )
 
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+
+    if args.flush and not args.spool_dir:
+        parser.error('--flush requires --spool-dir')
+
+    if not args.path and not args.flush:
+        parser.error('the following arguments are required: config')
+
+    if args.jobs < 0:
+        parser.error('--jobs must not be negative')
+
+    if args.attachment_cache < 0:
+        parser.error('--attachment-cache must not be negative')
+
+    return args
 
 
 def tags_matches_mail(tags, mail):
     """Check if the mail has matching tags."""
 
-    if not tags:
-        return True
-
-    tags = [tag.strip() for tag in tags.split(',')]
+    tags = parse_tags(tags)
 
-    return any(tag in mail for tag in tags)
+    return tags is None or not tags.isdisjoint(mail)
 
 
 def parse_files(file_path, mail):
-    """Parse files for S/MIME-related fields."""
+    """Parse files for S/MIME-related fields.
+
+    The files are read once per process, see `KeyStore.read`.
+    """
+
+    from .smime import KEYSTORE
+
     copy_properties = [
         ('from_key_file', 'from_key'),
         ('from_crt_file', 'from_crt'),
@@ -108,8 +236,8 @@ def parse_files(file_path, mail):
         if 'smime' not in mail or src not in mail['smime']:
             continue
 
-        with open(file_path.parent / mail['smime'][src], 'r') as fh:
-            mail['smime'][dst] = fh.read()
+        mail['smime'][dst] = KEYSTORE.read(file_path.parent /
+                                           mail['smime'][src])
 
         del mail['smime'][src]
 
@@ -157,37 +285,248 @@ def configure_logger(verbosity):
     ])
 
 
-def load_configurations(file_paths):
+def load_configurations(file_paths, shard=None, tags=None, cache=None):
     """Load configuration files and returning valid configurations."""
     for path in file_paths:
         if not path.is_file():
             LOG.warning('No such file, skipping. [path=%s]', path)
             continue
         try:
-            config = Config.load(path)
+            config = Config.load(path, shard, tags, cache)
             yield path, config
         except ConfigError as ex:
             LOG.error('Error while parsing config: %s [path=%s]', ex, path)
 
 
-def process_message(mailer, mail, path, print_only):
+def prefetch(iterable, size=1):
+    """Yield the items of an iterable, produced in a background thread.
+
+    Up to `size` items are produced ahead, e.g. the next config file is
+    loaded while the mails of the current one are sent. Errors raised by
+    the iterable are raised when the failing item would have been yielded.
+    """
+
+    items = Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as ex:  # pylint: disable=broad-except
+            put((done, ex))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def check_configuration(path, shard=None, tags=None, cache=None):
+    """Load a config file and render all of its mails.
+
+    Returns:
+        tuple: The path, the number of mails, the error or None if the
+            config is valid and the seconds spent.
+    """
+
+    start = time.perf_counter()
+    count = 0
+    error = None
+
+    try:
+        if not path.is_file():
+            raise ConfigError('No such file')
+
+        config = Config.load(path, shard, tags, cache)
+        for _ in config.iter_mails():
+            count += 1
+
+    except SpoolError as ex:
+        error = str(ex)
+    except Exception as ex:  # pylint: disable=broad-except
+        error = f'{type(ex).__name__}: {ex}'
+
+    return path, count, error, time.perf_counter() - start
+
+
+def check_configurations(file_paths, jobs=1, shard=None, tags=None,
+                         cache=None):
+    """Check config files in a pool of `jobs` processes.
+
+    Returns:
+        list: The results of `check_configuration` in order of the files.
+    """
+
+    check = functools.partial(check_configuration, shard=shard, tags=tags,
+                              cache=cache)
+
+    if jobs == 1 or len(file_paths) < 2:
+        return [check(path) for path in file_paths]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs or None) as executor:
+        return list(executor.map(check, file_paths))
+
+
+def check_report(results):
+    """Return a human readable summary of checked config files."""
+
+    lines = []
+    for path, count, error, seconds in results:
+        if error:
+            lines.append(f'FAILED {path} ({seconds:.3f}s): {error}')
+        else:
+            lines.append(f'OK     {path} ({count} mails, {seconds:.3f}s)')
+
+    failed = sum(1 for result in results if result[2])
+    lines.append(f'{len(results)} files checked, {failed} failed, '
+                 f'{sum(result[3] for result in results):.3f}s')
+
+    return '\n'.join(lines)
+
+
+def process_message(mailer, mail, path, print_only, msgid_domain=None):
     """Process and send a single mail message."""
 
+    from .message import Message, MessageError
+    from .payload import Payload, PayloadError
+    from .signer import DkimError
+
     mail.pop('description', None)
+    mail.pop('tags', None)
     mail = parse_files(path, mail)
+    if msgid_domain:
+        mail.setdefault('msgid_domain', msgid_domain)
     attachments = mail.pop('attachments', [])
-    msg = Message(**mail)
-
-    if isinstance(attachments, str):
+    if isinstance(attachments, (str, dict)):
         attachments = [attachments]
+
+    try:
+        for key in ('text_body', 'html_body'):
+            if isinstance(mail.get(key), dict):
+                mail[key] = Payload.from_config(mail[key], kind='lorem')
+
+        attachments = [Payload.from_config(attachment)
+                       if isinstance(attachment, dict)
+                       else path.parent / attachment
+                       for attachment in attachments]
+    except PayloadError as exc:
+        LOG.error('Failed to generate payload: %s. [name=%s, path=%s]', exc,
+                  mail['name'], path)
+        return
+
+    msg = Message(**mail)
     for attachment in attachments:
-        msg.attach(path.parent / attachment)
+        msg.attach(attachment)
 
     try:
         mailer.send(msg, print_only)
-    except MessageError as exc:
+    except (MessageError, PayloadError, DkimError) as exc:
         LOG.error('Failed to create message: %s. [name=%s, path=%s]', exc,
-                 mail['name'], path)
+                  mail['name'], path)
+
+
+def create_scheduler(args):
+    """Create the rate scheduler shared by all config files."""
+
+    rate = args.rate
+    if rate is None and args.delay:
+        rate = 1 / args.delay
+
+    return RateScheduler(rate=rate, burst=args.burst, ramp=args.ramp,
+                         host_rate=args.host_rate, host_burst=args.host_burst)
+
+
+def create_mailer(args, scheduler=None, queue=None, stats=None):
+    """Create a mailer for the selected delivery engine."""
+
+    kwargs = {
+        'relay': args.relay,
+        'port': args.port,
+        'helo': args.helo,
+        'debug': args.debug,
+        'nameservers': args.nameservers,
+        'starttls': args.starttls,
+        'no_cache': args.no_cache,
+        'max_messages': args.max_messages,
+        'workers': args.workers,
+        'scheduler': scheduler,
+        'queue': queue,
+        'stats': stats,
+    }
+
+    if args.engine == 'async':
+        from .asyncmailer import AsyncMailer
+        return AsyncMailer(concurrency=args.concurrency,
+                           host_concurrency=args.host_concurrency, **kwargs)
+
+    from .mailer import Mailer
+    return Mailer(**kwargs)
+
+
+def bench_rounds(repeat=None, deadline=None):
+    """Yield the rounds of sending all mails.
+
+    Args:
+        repeat (int, optional): Number of rounds, unlimited if a deadline
+            is set and a single round otherwise.
+        deadline (float, optional): Monotonic time to stop at.
+    """
+
+    if repeat is None and deadline is None:
+        repeat = 1
+
+    count = 0
+    while repeat is None or count < repeat:
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+        yield count
+        count += 1
+
+
+def bench_mails(configs, repeat=None, deadline=None):
+    """Yield the path and mail of every mail in all rounds.
+
+    The deadline is checked before every mail is rendered, so no further
+    mail is rendered once it has passed.
+
+    Args:
+        configs (list): The paths and configs, see `load_configurations`.
+        repeat (int, optional): Number of rounds, see `bench_rounds`.
+        deadline (float, optional): Monotonic time to stop at.
+    """
+
+    for _ in bench_rounds(repeat, deadline):
+        for path, config in configs:
+            for mail in config.iter_mails():
+                yield path, mail
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
 
 
 def run():
@@ -196,28 +535,79 @@ def run():
     args = parse_args(sys.argv[1:])
     configure_logger(args.verbosity)
 
-    for path, config in load_configurations(args.path):
+    registry = None
+    if args.metrics_json or args.metrics_prom:
+        registry = metrics.enable()
 
-        if args.check:
-            continue
+    scheduler = create_scheduler(args)
+
+    queue = None
+    if args.spool_dir:
+        queue = MailQueue(args.spool_dir, max_attempts=args.max_attempts)
+
+    cache = None if args.no_config_cache else ConfigCache()
+
+    if args.check:
+        results = check_configurations(args.path, args.jobs, args.shard,
+                                       parse_tags(args.tags), cache)
+        print(check_report(results))
+
+        failed = [path for path, _, error, _ in results if error]
+        if failed:
+            raise ConfigError(
+                f'{len(failed)} of {len(results)} config files are invalid')
+        return
+
+    configs = load_configurations(args.path, args.shard,
+                                  parse_tags(args.tags), cache)
+
+    stats = None
+    if args.repeat or args.duration or args.bench_output:
+        from .bench import BenchStats
+        stats = BenchStats()
+        configs = list(configs)
+        stats.start()
+    else:
+        configs = prefetch(configs)
+
+    deadline = None
+    if args.duration:
+        deadline = time.monotonic() + args.duration
+
+    from .message import ATTACHMENTS
+    ATTACHMENTS.max_bytes = args.attachment_cache * 1024 * 1024
+
+    # a single mailer keeps the DNS cache and connections of all files
+    with create_mailer(args, scheduler, queue, stats) as mailer:
+
+        for path, mail in bench_mails(configs, args.repeat, deadline):
+            scheduler.acquire()
+            process_message(mailer, mail, path, args.print_only,
+                            args.msgid_domain)
 
+        if args.flush:
+            queue.flush(mailer, wait=True)
 
-        with Mailer(relay=args.relay, port=args.port, helo=args.helo,
-                    debug=args.debug, nameservers=args.nameservers,
-                    starttls=args.starttls, no_cache=args.no_cache) as mailer:
+    LOG.debug('Attachment cache: %d hits, %d misses, %d entries (%s bytes)',
+              ATTACHMENTS.hits, ATTACHMENTS.misses, len(ATTACHMENTS),
+              ATTACHMENTS.size)
 
-            for idx, mail in enumerate(config.mails):
+    from .smime import KEYSTORE
+    LOG.debug('S/MIME keystore: %d hits, %d misses, %d entries',
+              KEYSTORE.hits, KEYSTORE.misses, len(KEYSTORE))
 
-                if not tags_matches_mail(args.tags, mail.pop('tags', [])):
-                    LOG.debug('Skipping message "%s", does not match tags: %s',
-                              mail['name'], args.tags)
-                    continue
+    if stats:
+        stats.stop()
+        print(stats.report())
 
-                process_message(mailer, mail, path, args.print_only)
+        if args.bench_output:
+            stats.write(args.bench_output)
 
-                if args.delay and idx < len(config.mails) - 1:
-                    LOG.debug('Delaying next message by %.2f seconds.', args.delay)
-                    time.sleep(args.delay)
+    if registry:
+        if args.metrics_json:
+            registry.write_json(args.metrics_json)
+        if args.metrics_prom:
+            registry.write_prometheus(args.metrics_prom)
 
 
 def cli():
@@ -1,8 +1,9 @@
 import logging
 import mimetypes
+import threading
 from collections import OrderedDict
 from collections.abc import MutableMapping
-from email import encoders, message_from_string
+from email import message_from_string
 from email.header import Header
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -10,10 +11,12 @@ from email.mime.text import MIMEText
 from email.utils import formataddr, formatdate, make_msgid, parseaddr
 from pathlib import Path
 
-from dkim import dkim_sign
-
+from . import metrics
 from .exceptions import SpoolError
+from .hostname import fqdn
+from .payload import Payload
 from .smime import encrypt, sign
+from .wire import STREAM_THRESHOLD, WireStream, encode_base64, flatten
 
 LOG = logging.getLogger(__name__)
 DEFAULT_ATTACHMENT_MIME_TYPE = 'application/octet-stream'
@@ -88,6 +91,115 @@ class EmailHeaders(MutableMapping):
         return str(dict(self.items()))
 
 
+def attachment_type(file_path):
+    """Return the MIME type of an attached file."""
+
+    mime_type, encoding = mimetypes.guess_type(str(file_path))
+
+    if mime_type is None or encoding is not None:
+        return DEFAULT_ATTACHMENT_MIME_TYPE
+
+    return mime_type
+
+
+def attachment_part(mime_type, payload, filename):
+    """Return the MIME part of an attachment with a base64 payload."""
+
+    part = MIMEBase(*mime_type.split('/'))
+    part.set_payload(payload)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+
+    return part
+
+
+class AttachmentCache:
+    """Process-wide LRU cache of base64 encoded attachments.
+
+    Entries are keyed by the resolved path, size and modification time of
+    a file, changed files are read again. Every lookup returns a new MIME
+    part sharing the encoded payload, which is an immutable string.
+
+    Args:
+        max_bytes (int): Budget of the encoded payloads, the least recently
+            used entries are evicted once it is exceeded.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def part(self, file_path):
+        """Return the MIME part of an attachment.
+
+        Args:
+            file_path (str): Path of the attached file.
+
+        Returns:
+            :obj:`MIMEBase`: The base64 encoded part.
+        """
+
+        path = Path(file_path)
+        stat = path.stat()
+        key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            entry = self._encode(path)
+            self._add(key, entry)
+
+        mime_type, payload = entry
+        return attachment_part(mime_type, payload, path.name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _add(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+
+            self._entries[key] = entry
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, payload) = self._entries.popitem(last=False)
+                self.size -= len(payload)
+
+    @staticmethod
+    def _encode(path):
+
+        mime_type = attachment_type(path)
+
+        # encode the raw bytes directly, `set_payload` would decode them to
+        # an (even larger) string first and `encode_base64` copy them back
+        with open(path, 'rb') as attachment:
+            return mime_type, encode_base64(attachment.read())
+
+
+ATTACHMENTS = AttachmentCache()
+
+
 class Message:
     """Represents a single email message."""
 
@@ -107,6 +219,7 @@ class Message:
                  dkim=None,
                  smime=None,
                  eml=None,
+                 msgid_domain=None,
                  charset='utf-8'):
 
         self.name = name
@@ -148,9 +261,17 @@ class Message:
         self.attachments = []
 
         self.eml = eml
+        self.msgid_domain = msgid_domain
 
         self._headers = EmailHeaders(headers)
 
+    def __setattr__(self, name, value):
+        # any change invalidates the memoized wire representation
+        if not name.startswith('_'):
+            super().__setattr__('_wire', None)
+            super().__setattr__('_stream', None)
+        super().__setattr__(name, value)
+
     @property
     def headers(self):
         """Get the message headers."""
@@ -164,10 +285,11 @@ class Message:
             Header(self.subject, self.charset),
             'Date':
             formatdate(localtime=True),
-            # do not call make_msgid unless it's required, since make_msgid
-            # depends on dns resolution on the hostname
+            # make_msgid resolves the hostname on every call unless a domain
+            # is given
             'Message-ID':
-            make_msgid() if 'message-id' not in self._headers else
+            make_msgid(domain=self.msgid_domain or fqdn())
+            if 'message-id' not in self._headers else
             self._headers['message-id'],
         })
 
@@ -189,13 +311,63 @@ class Message:
         """Add file to message attachments.
 
         Adds a given path to the set of files which are appended to
-        the generated message when the method `as_string` is called.
+        the generated message when the method `as_bytes` is called.
 
         Args:
-            file_path (str): relative or absolute path to the file.
+            file_path (str or :obj:`Payload`): relative or absolute path to
+                the file or a generated payload.
         """
 
         self.attachments.append(file_path)
+        self._wire = None
+        self._stream = None
+
+    def as_bytes(self):
+        """Return the entire message flattened as bytes.
+
+        The message is built once and the result is reused until the
+        message is changed, so every remote server receives an identical
+        copy with the same `Date` and `Message-ID` headers.
+
+        Returns:
+            bytes: The message as Internet Message Format (IMF)
+                formatted bytes with CRLF line endings.
+        """
+
+        if self._wire is None:
+            with metrics.timer('message.build'):
+                wire = flatten(self._build())
+
+            if self.dkim:
+                wire = self._dkim_sign(wire) + wire
+
+            self._wire = wire
+
+        return self._wire
+
+    def as_stream(self):
+        """Return the message flattened for sending.
+
+        Attachments of at least `STREAM_THRESHOLD` bytes are not read into
+        memory, but streamed from their files or generated while sending. Signatures
+        need the whole message, signed or encrypted messages are returned
+        by `as_bytes`.
+
+        Returns:
+            bytes or :obj:`WireStream`: The flattened message.
+        """
+
+        if self.dkim or self.smime or not any(
+                self._is_streamed(path) for path in self.attachments):
+            return self.as_bytes()
+
+        if self._stream is None:
+            stream = WireStream()
+            with metrics.timer('message.build'):
+                stream.flatten(self._build(stream))
+            self._stream = stream
+
+        return self._stream
 
     def as_string(self):
         """Return the entire message flattened as a string.
@@ -205,8 +377,19 @@ class Message:
                 formatted string.
         """
 
+        wire = self.as_bytes().decode('utf-8', 'replace')
+        return wire.replace('\r\n', '\n')
+
+    def _build(self, stream=None):
+        """Build the MIME tree of the message.
+
+        Args:
+            stream (:obj:`WireStream`, optional): Stream to add the large
+                attachments to, instead of reading them.
+        """
+
         if self.attachments or self.ical:
-            msg = self._multipart()
+            msg = self._multipart(stream)
         elif self.eml:
             msg = self._get_eml(self.eml)
         else:
@@ -222,18 +405,23 @@ class Message:
         for name, value in self.headers.items():
             msg[name] = value
 
-        if self.dkim:
+        return msg
 
-            for key, value in self.dkim.items():
-                self.dkim[key] = value.encode()
+    @metrics.timed('dkim.sign')
+    def _dkim_sign(self, wire):
+        """Return the DKIM-Signature header field for the flattened message.
 
-            dkim_header = dkim_sign(msg.as_bytes(), **self.dkim).decode()
-            name, value = dkim_header.split(':', 1)
-            msg[name] = value
+        The header is signed over the already flattened message and can be
+        prepended to it, which saves flattening the message a second time.
+        The signer, with its parsed key, is shared by all messages with the
+        same DKIM config.
+        """
+
+        from .signer import get_signer
 
-        return msg.as_string()
+        return get_signer(**self.dkim).sign(wire)
 
-    def _multipart(self):
+    def _multipart(self, stream=None):
         msg = MIMEMultipart('mixed')
         msg.attach(self._plaintext())
 
@@ -242,7 +430,21 @@ class Message:
             msg.attach(part)
 
         for attachment in self.attachments:
-            msg.attach(self._get_attachment_part(attachment))
+            if isinstance(attachment, Payload):
+                if stream is not None and self._is_streamed(attachment):
+                    payload = stream.placeholder(attachment)
+                else:
+                    payload = encode_base64(attachment.read())
+                msg.attach(attachment_part(attachment.content_type, payload,
+                                           attachment.name))
+
+            elif stream is not None and self._is_streamed(attachment):
+                path = Path(attachment)
+                msg.attach(attachment_part(attachment_type(path),
+                                           stream.placeholder(path),
+                                           path.name))
+            else:
+                msg.attach(self._get_attachment_part(attachment))
 
         return msg
 
@@ -265,6 +467,16 @@ class Message:
 
         return message_from_string(rendered)
 
+    @staticmethod
+    def _is_streamed(file_path):
+        if isinstance(file_path, Payload):
+            return file_path.size >= STREAM_THRESHOLD
+
+        try:
+            return Path(file_path).stat().st_size >= STREAM_THRESHOLD
+        except OSError:
+            return False
+
     @staticmethod
     def _get_attachment_part(file_path):
 
@@ -272,36 +484,28 @@ class Message:
         if not path.is_file():
             raise MessageError(f'File not found: {file_path}')
 
-        mime_type, encoding = mimetypes.guess_type(str(file_path))
-
-        if mime_type is None or encoding is not None:
-            mime_type = DEFAULT_ATTACHMENT_MIME_TYPE
+        return ATTACHMENTS.part(path)
 
-        part = MIMEBase(*mime_type.split('/'))
-
-        with open(file_path, 'rb') as attachment:
-            part.set_payload(attachment.read())
-
-        encoders.encode_base64(part)
+    def _plaintext(self):
 
-        part.add_header('Content-Disposition',
-                        'attachment',
-                        filename=path.name)
+        text_body, html_body = self.text_body, self.html_body
 
-        return part
+        if isinstance(text_body, Payload):
+            text_body = text_body.text()
 
-    def _plaintext(self):
+        if isinstance(html_body, Payload):
+            html_body = html_body.text()
 
-        if not self.html_body:
-            msg = MIMEText(self.text_body, 'plain', self.charset)
+        if not html_body:
+            msg = MIMEText(text_body, 'plain', self.charset)
 
-        elif not self.text_body:
-            msg = MIMEText(self.html_body, 'html', self.charset)
+        elif not text_body:
+            msg = MIMEText(html_body, 'html', self.charset)
 
         else:
             msg = MIMEMultipart('alternative')
-            msg.attach(MIMEText(self.text_body, 'plain', self.charset))
-            msg.attach(MIMEText(self.html_body, 'html', self.charset))
+            msg.attach(MIMEText(text_body, 'plain', self.charset))
+            msg.attach(MIMEText(html_body, 'html', self.charset))
 
         return msg
 
@@ -0,0 +1,164 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = (
+    'config.load',
+    'config.render',
+    'config.validate',
+    'message.build',
+    'smime.sign',
+    'smime.encrypt',
+    'dkim.sign',
+    'mailer.mx_lookup',
+    'mailer.connect',
+    'mailer.sendmail',
+)
+
+_registry = None
+
+
+class Stage:
+    """Accumulated wall time of a single stage."""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'seconds': self.total, 'max': self.max}
+
+
+class Registry:
+    """Collects the wall time of stages, safe to use from any thread."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Add a measurement of `seconds` to stage `name`."""
+
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage()
+
+            stage.count += 1
+            stage.total += seconds
+            stage.max = max(stage.max, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: self.stages[name].to_dict()
+                    for name in sorted(self.stages, key=_stage_order)}
+
+    def to_prometheus(self):
+        """Return the stages in the Prometheus text exposition format."""
+
+        stages = self.to_dict()
+        lines = []
+
+        for metric, key, kind, help_text in (
+                ('spool_stage_seconds_total', 'seconds', 'counter',
+                 'Wall time spent per stage.'),
+                ('spool_stage_calls_total', 'count', 'counter',
+                 'Number of calls per stage.'),
+                ('spool_stage_max_seconds', 'max', 'gauge',
+                 'Longest single call per stage.')):
+
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for name, values in stages.items():
+                lines.append(f'{metric}{{stage="{name}"}} {values[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.to_dict(), fh, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as fh:
+            fh.write(self.to_prometheus())
+
+
+def _stage_order(name):
+    try:
+        return STAGES.index(name), name
+    except ValueError:
+        return len(STAGES), name
+
+
+class _NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+def enable():
+    """Start collecting metrics and return the registry.
+
+    Metrics are disabled by default, measured calls then only cost a
+    single global lookup.
+    """
+    global _registry
+    _registry = Registry()
+    return _registry
+
+
+def disable():
+    """Stop collecting metrics."""
+    global _registry
+    _registry = None
+
+
+def registry():
+    """Return the active registry or None if metrics are disabled."""
+    return _registry
+
+
+def timer(name):
+    """Return a context manager measuring the wall time of stage `name`."""
+
+    if _registry is None:
+        return NULL_TIMER
+
+    return _registry.timer(name)
+
+
+def timed(name):
+    """Decorator measuring the wall time of every call as stage `name`."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _registry is None:
+                return func(*args, **kwargs)
+
+            with _registry.timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
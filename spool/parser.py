@@ -1,15 +1,81 @@
 import codecs
+import copy
+import csv
+import json
 import logging
 import os.path
+import re
+import zlib
+from collections.abc import Mapping, Sequence
+from pathlib import Path
 
-import jinja2
 import yaml
-from cerberus import Validator
 
+from . import metrics
 from .exceptions import SpoolError
+from .payload import KINDS
 
 LOG = logging.getLogger(__name__)
 
+NEWLINES = re.compile(r'\r\n|\r|\n')
+
+# libyaml is a lot faster than the pure python loader
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+SMIME_FILES = ('from_crt_file', 'from_key_file', 'to_crts_file')
+
+# a generated payload, see `spool.payload.Payload`
+GENERATE_SCHEMA = {
+    'type': 'dict',
+    'schema': {
+        'generate': {
+            'type': 'dict',
+            'required': True,
+            'schema': {
+                'size': {
+                    'type': ['string', 'number'],
+                    'required': True,
+                },
+                'kind': {
+                    'type': 'string',
+                    'allowed': list(KINDS),
+                },
+                'seed': {
+                    'type': 'number',
+                },
+                'name': {
+                    'type': 'string',
+                },
+                'content_type': {
+                    'type': 'string',
+                },
+            },
+        },
+    },
+}
+
+# bodies are text, random payloads are binary
+BODY_GENERATE_SCHEMA = copy.deepcopy(GENERATE_SCHEMA)
+BODY_GENERATE_SCHEMA['schema']['generate']['schema']['kind']['allowed'] = [
+    kind for kind in KINDS if kind != 'random'
+]
+
+
+def parse_tags(tags):
+    """Return the set of comma separated tags or None if no tags are given.
+
+    Examples:
+        >>> sorted(parse_tags('smoke, dkim'))
+        ['dkim', 'smoke']
+        >>> parse_tags('') is None
+        True
+    """
+
+    if not tags:
+        return None
+
+    return frozenset(tag.strip() for tag in tags.split(','))
+
 
 def to_list(string):
     """Returns a list of values from a comma separated string"""
@@ -20,149 +86,373 @@ def to_list(string):
     return [item.strip() for item in string.split(',')]
 
 
-CONFIG_SCHEMA = {
-    'defaults': {
+MAIL_SCHEMA = {
+    'name': {
+        'type': 'string'
+    },
+    'description': {
+        'type': 'string'
+    },
+    'sender': {
+        'type': 'string',
+        'required': True
+    },
+    'recipients': {
+        'type': ['string', 'list'],
+        'required': True,
+    },
+    'subject': {
+        'type': 'string'
+    },
+    'headers': {
         'type': 'dict',
-        'allow_unknown': True,
+        'valuesrules': {
+            'type': ['string', 'number'],
+            'nullable': True,
+        },
     },
-    'vars': {
+    'msgid_domain': {
+        'type': 'string'
+    },
+    'from': {
+        'type': 'string',
+        'rename': 'from_addr'
+    },
+    'to': {
+        'type': ['string', 'list'],
+        'rename': 'to_addrs'
+    },
+    'cc': {
+        'type': ['string', 'list'],
+        'rename': 'cc_addrs'
+    },
+    'bcc': {
+        'type': ['string', 'list'],
+        'rename': 'bcc_addrs'
+    },
+    'eml': {
+        'type': ['string', 'dict'],
+        'schema': {
+            'template': {
+                'type': 'string',
+            },
+            'vars': {
+                'type': 'dict',
+                'allow_unknown': True,
+            },
+        },
+        'excludes': [
+            'text_body',
+            'html_body',
+            'attachments',
+            'ical',
+        ],
+    },
+    'text_body': {
+        'anyof': [{'type': 'string'}, BODY_GENERATE_SCHEMA],
+        'excludes': ['eml']
+    },
+    'html_body': {
+        'anyof': [{'type': 'string'}, BODY_GENERATE_SCHEMA],
+        'excludes': ['eml']
+    },
+    'dkim': {
         'type': 'dict',
-        'allow_unknown': True,
+        'schema': {
+            'privkey': {
+                'type': 'string'
+            },
+            'selector': {
+                'type': 'string'
+            },
+            'domain': {
+                'type': 'string'
+            },
+            'canonicalize': {
+                'type': 'string',
+                'allowed': [
+                    'simple', 'relaxed', 'simple/simple', 'simple/relaxed',
+                    'relaxed/simple', 'relaxed/relaxed'
+                ],
+            },
+            'headers': {
+                'type': 'list',
+                'schema': {
+                    'type': 'string'
+                },
+            },
+        },
     },
-    'mails': {
-        'type': 'list',
+    'smime': {
+        'type': 'dict',
         'schema': {
+            'from_crt': {
+                'type': 'string',
+                'excludes': ['from_crt_file'],
+            },
+            'from_crt_file': {
+                'type': 'string',
+                'excludes': ['from_crt'],
+            },
+            'from_key': {
+                'type': 'string',
+                'excludes': ['from_key_file'],
+            },
+            'from_key_file': {
+                'type': 'string',
+                'excludes': ['from_key'],
+            },
+            'to_crts': {
+                'type': 'string',
+                'excludes': ['to_crts_file'],
+            },
+            'to_crts_file': {
+                'type': 'string',
+                'excludes': ['to_crts'],
+            }
+        },
+    },
+    'ical': {
+        'type': 'string',
+        'excludes': ['eml']
+    },
+    'attachments': {
+        'anyof': [{
+            'type': 'string',
+        }, GENERATE_SCHEMA, {
+            'type': 'list',
+            'schema': {
+                'anyof': [{'type': 'string'}, GENERATE_SCHEMA],
+            },
+        }],
+        'excludes': ['eml'],
+    },
+    'loop': {
+        'anyof': [{
+            'type': ['list', 'string'],
+        }, {
             'type': 'dict',
             'schema': {
-                'name': {
-                    'type': 'string'
-                },
-                'description': {
-                    'type': 'string'
-                },
-                'sender': {
+                'file': {
                     'type': 'string',
-                    'required': True
-                },
-                'recipients': {
-                    'type': ['string', 'list'],
                     'required': True,
                 },
-                'subject': {
-                    'type': 'string'
-                },
-                'headers': {
-                    'type': 'dict',
-                    'valuesrules': {
-                        'type': ['string', 'number'],
-                        'nullable': True,
-                    },
-                },
-                'from': {
-                    'type': 'string',
-                    'rename': 'from_addr'
-                },
-                'to': {
-                    'type': ['string', 'list'],
-                    'rename': 'to_addrs'
-                },
-                'cc': {
-                    'type': ['string', 'list'],
-                    'rename': 'cc_addrs'
-                },
-                'bcc': {
-                    'type': ['string', 'list'],
-                    'rename': 'bcc_addrs'
-                },
-                'eml': {
-                    'type': ['string', 'dict'],
-                    'schema': {
-                        'template': {
-                            'type': 'string',
-                        },
-                        'vars': {
-                            'type': 'dict',
-                            'allow_unknown': True,
-                        },
-                    },
-                    'excludes': [
-                        'text_body',
-                        'html_body',
-                        'attachments',
-                        'ical',
-                    ],
-                },
-                'text_body': {
-                    'type': 'string',
-                    'excludes': ['eml']
-                },
-                'html_body': {
-                    'type': 'string',
-                    'excludes': ['eml']
-                },
-                'dkim': {
-                    'type': 'dict',
-                    'schema': {
-                        'privkey': {
-                            'type': 'string'
-                        },
-                        'selector': {
-                            'type': 'string'
-                        },
-                        'domain': {
-                            'type': 'string'
-                        },
-                    },
-                },
-                'smime': {
-                    'type': 'dict',
-                    'schema': {
-                        'from_crt': {
-                            'type': 'string',
-                            'excludes': ['from_crt_file'],
-                        },
-                        'from_crt_file': {
-                            'type': 'string',
-                            'excludes': ['from_crt'],
-                        },
-                        'from_key': {
-                            'type': 'string',
-                            'excludes': ['from_key_file'],
-                        },
-                        'from_key_file': {
-                            'type': 'string',
-                            'excludes': ['from_key'],
-                        },
-                        'to_crts': {
-                            'type': 'string',
-                            'excludes': ['to_crts_file'],
-                        },
-                        'to_crts_file': {
-                            'type': 'string',
-                            'excludes': ['to_crts'],
-                        }
-                    },
-                },
-                'ical': {
+                'format': {
                     'type': 'string',
-                    'excludes': ['eml']
-                },
-                'attachments': {
-                    'type': ['string', 'list'],
-                    'excludes': ['eml'],
-                },
-                'loop': {
-                    'type': 'list'
-                },
-                'tags': {
-                    'type': ['string', 'list'],
-                    'coerce': to_list
+                    'allowed': ['csv', 'jsonl', 'yaml'],
                 },
             },
+        }],
+    },
+    'tags': {
+        'type': ['string', 'list'],
+        'coerce': to_list,
+        'schema': {
+            'type': 'string'
+        }
+    },
+}
+
+# normalization rules of rendered mails, applied without a validator
+RENAMES = {key: rules['rename'] for key, rules in MAIL_SCHEMA.items()
+           if 'rename' in rules}
+COERCIONS = {key: rules['coerce'] for key, rules in MAIL_SCHEMA.items()
+             if 'coerce' in rules}
+
+CONFIG_SCHEMA = {
+    'defaults': {
+        'type': 'dict',
+        'allow_unknown': True,
+    },
+    'vars': {
+        'type': 'dict',
+        'allow_unknown': True,
+    },
+    'mails': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': MAIL_SCHEMA,
         },
     },
 }
 
+TYPES = {
+    'string': lambda value: isinstance(value, str),
+    'list': lambda value: (isinstance(value, Sequence)
+                           and not isinstance(value, str)),
+    'dict': lambda value: isinstance(value, Mapping),
+    'number': lambda value: (isinstance(value, (int, float))
+                             and not isinstance(value, bool)),
+}
+
+
+def compile_schema(schema, allow_unknown=False):
+    """Compile a cerberus schema to a function checking a mapping.
+
+    Only the rules used by `CONFIG_SCHEMA` are supported. The function
+    tells whether a document is valid, without collecting errors, which
+    makes it a lot faster than a `Validator` for valid documents.
+
+    Args:
+        schema (dict): The cerberus schema of the mapping.
+        allow_unknown (bool): Whether to accept fields not in the schema.
+
+    Returns:
+        callable: Function returning whether a document is valid.
+    """
+
+    fields = {key: _compile_rules(rules) for key, rules in schema.items()}
+    required = [key for key, rules in schema.items() if rules.get('required')]
+    excludes = [(key, rules['excludes']) for key, rules in schema.items()
+                if 'excludes' in rules]
+
+    def check(document):
+        if not isinstance(document, Mapping):
+            return False
+
+        for key in required:
+            if key not in document:
+                return False
+
+        for key, value in document.items():
+            check_field = fields.get(key)
+            if check_field is None:
+                if not allow_unknown:
+                    return False
+            elif not check_field(value):
+                return False
+
+        for key, excluded in excludes:
+            if key in document and any(other in document
+                                       for other in excluded):
+                return False
+
+        return True
+
+    return check
+
+
+def _compile_rules(rules):
+    """Compile the rules of a single field, see `compile_schema`."""
+
+    types = rules.get('type', [])
+    if isinstance(types, str):
+        types = [types]
+    type_checks = [TYPES[name] for name in types]
+
+    nullable = rules.get('nullable', False)
+    allowed = rules.get('allowed')
+    anyof = [_compile_rules(dict(rules, anyof=None, **alternative))
+             for alternative in rules.get('anyof') or []]
+
+    # the schema rule describes the fields of a dict or the items of a list
+    check_mapping = check_items = check_values = None
+    if 'schema' in rules:
+        if 'dict' in types:
+            check_mapping = compile_schema(rules['schema'],
+                                           rules.get('allow_unknown', False))
+        else:
+            check_items = _compile_rules(rules['schema'])
+
+    if 'valuesrules' in rules:
+        check_values = _compile_rules(rules['valuesrules'])
+
+    def check(value):
+        if value is None:
+            return nullable
+
+        if anyof and not any(check(value) for check in anyof):
+            return False
+
+        if type_checks and not any(check(value) for check in type_checks):
+            return False
+
+        if allowed is not None and value not in allowed:
+            return False
+
+        if check_mapping and isinstance(value, Mapping):
+            if not check_mapping(value):
+                return False
+
+        if check_items and TYPES['list'](value):
+            if not all(check_items(item) for item in value):
+                return False
+
+        if check_values and isinstance(value, Mapping):
+            if not all(check_values(item) for item in value.values()):
+                return False
+
+        return True
+
+    return check
+
+
+check_document = compile_schema(CONFIG_SCHEMA)
+
+
+class LoopRowError(Exception):
+    """A row of a loop file could not be parsed.
+
+    Raised by the loop readers, `Config` turns it into a `ConfigError`
+    with the path of the file.
+
+    Args:
+        message (str): Why the row is invalid.
+        line (int, optional): Line number of the row, starting at 1.
+    """
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+
+def read_csv(fh):
+    """Yield the rows of a CSV file with a header line as dicts."""
+    reader = csv.DictReader(fh)
+    try:
+        yield from reader
+    except csv.Error as ex:
+        raise LoopRowError(str(ex), reader.reader.line_num)
+
+
+def read_jsonl(fh):
+    """Yield the values of a JSON Lines file."""
+    for number, line in enumerate(fh, 1):
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as ex:
+            raise LoopRowError(f'{ex.msg} (column {ex.colno})', number)
+        yield value
+
+
+def read_yaml(fh):
+    """Yield the documents of a YAML stream."""
+    try:
+        yield from yaml.load_all(fh, Loader=SafeLoader)
+    except yaml.YAMLError as ex:
+        mark = getattr(ex, 'problem_mark', None)
+        raise LoopRowError(getattr(ex, 'problem', None) or str(ex),
+                           mark.line + 1 if mark else None)
+
+
+LOOP_READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'yaml': read_yaml,
+}
+
+LOOP_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.yml': 'yaml',
+    '.yaml': 'yaml',
+}
+
 FILTERS = {
     'basename':
     os.path.basename,
@@ -183,10 +473,80 @@ class ValidationError(ConfigError):
     """Validation Error."""
 
 
+class Shard:
+    """A deterministic share of the mails of all configs.
+
+    Every mail is assigned to a shard by a stable hash of the config file
+    name and its position, so `count` shards together send every mail
+    exactly once, on any machine.
+
+    Args:
+        index (int): Number of this shard, from 1 to `count`.
+        count (int): Total number of shards.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f'Invalid shard: {index}/{count}')
+
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        """Create a shard from an `INDEX/COUNT` string.
+
+        Examples:
+            >>> shard = Shard.parse('2/4')
+            >>> shard.index, shard.count
+            (2, 4)
+        """
+
+        try:
+            index, count = (int(part) for part in value.split('/'))
+        except ValueError:
+            raise ValueError(f'Invalid shard: {value}') from None
+
+        return cls(index, count)
+
+    def owns(self, name, definition, item=None):
+        """Whether a mail belongs to this shard.
+
+        Args:
+            name (str): File name of the config.
+            definition (int): Index of the mail definition in the config.
+            item (int, optional): Index of the loop item.
+        """
+
+        key = f'{name}:{definition}:{"" if item is None else item}'
+        return zlib.crc32(key.encode()) % self.count == self.index - 1
+
+    def __str__(self):
+        return f'{self.index}/{self.count}'
+
+
 class Config:
-    """Represents a single mail instance config."""
+    """Represents a single mail instance config.
+
+    The mail definitions are validated when the config is created. Mails
+    are rendered one at a time while iterating over `iter_mails`, loops
+    are expanded lazily.
+
+    Args:
+        config (dict): The parsed config.
+        path (str, optional): Path of the config file, files referenced
+            by the config are relative to it.
+        shard (:obj:`Shard`, optional): Only render the mails of a shard.
+        tags (set, optional): Only render the mails with any of the tags,
+            see `parse_tags`.
+        validate (bool): Whether to validate the config, disable only for
+            configs known to be valid.
+    """
+
+    def __init__(self, config, path=None, shard=None, tags=None,
+                 validate=True):
 
-    def __init__(self, config):
+        import jinja2
 
         env = jinja2.Environment()
 
@@ -195,76 +555,320 @@ class Config:
 
         env.globals = config.get('vars', {})
 
-        mails = []
         for mail in config.get('mails', []):
-
             for key, value in config.get('defaults', {}).items():
                 if key not in mail:
                     mail[key] = value
 
+        # definitions not matching the tags are not even validated
+        definitions = list(enumerate(config.get('mails', [])))
+        if tags is not None and isinstance(config.get('mails'), list):
+            definitions = [(index, mail) for index, mail in definitions
+                           if self._may_match(mail, tags, env)]
+            config = dict(config, mails=[mail for _, mail in definitions])
+
+        if validate:
+            self.check_config(config)
+
+        self._env = env
+        self._templates = {}
+        self._mails = None
+        self._base_dir = Path(path).parent if path else Path()
+        self._name = Path(path).name if path else ''
+        self.shard = shard
+        self.tags = tags
+        self.files = []
+
+        # compile the fields once and render them for every mail
+        self._definitions = []
+        for index, mail in definitions:
+            mail = dict(mail)
             loop = mail.pop('loop', None)
+            if isinstance(loop, dict):
+                loop = self._loop_source(loop)
+                self.files.append(loop[0])
+            self.files.extend(self._smime_files(mail.get('smime'), env))
+            fields = [(key, self._compile(value, env))
+                      for key, value in mail.items()]
+            # templated tags are only known after rendering
+            check_tags = tags is not None and self._is_templated(
+                mail.get('tags'), env)
+            self._definitions.append((index, loop, fields, check_tags))
+
+    @property
+    def mails(self):
+        """list: All rendered mails, see `iter_mails`."""
+        if self._mails is None:
+            self._mails = list(self.iter_mails())
+        return self._mails
+
+    def iter_mails(self):
+        """Yield the rendered and normalized mails.
+
+        Memory use does not depend on the number of loop items, as every
+        mail is rendered only when it is requested.
+        """
+
+        shard = self.shard
+
+        for index, loop, fields, check_tags in self._definitions:
+
             if loop:
-                loop = self._render(loop, env)
-                try:
-                    loop = yaml.safe_load(loop)
-                except AttributeError:
-                    pass
-                except yaml.YAMLError as ex:
-                    LOG.error(ex)
-
-                for item in loop:
-                    copy = {}
-                    for key, value in mail.items():
-                        copy[key] = self._render(value, env, item=item)
-                    mails.append(copy)
+                items = enumerate(self._expand(loop))
             else:
-                for key, value in mail.items():
-                    mail[key] = self._render(value, env)
-                mails.append(mail)
+                items = [(None, None)]
 
-        # FIXME
-        config['mails'] = mails
-        self._config = self.check_config(config)
+            for number, item in items:
 
-    @property
-    def mails(self):
-        return self._config['mails']
+                # skip mails of other shards before rendering them
+                if shard is not None and not shard.owns(self._name, index,
+                                                        number):
+                    continue
+
+                if number is None:
+                    kwargs = {}
+                elif isinstance(loop, list):
+                    kwargs = {'item': self._render(item, self._env)}
+                else:
+                    kwargs = {'item': item}
+
+                mail = self._render_mail(fields, **kwargs)
+
+                if check_tags and self.tags.isdisjoint(mail.get('tags', [])):
+                    continue
+
+                yield mail
+
+    def _may_match(self, mail, tags, env):
+        """Whether a mail definition may match any of the tags."""
+
+        if not isinstance(mail, dict):
+            # keep invalid definitions to report them
+            return True
+
+        value = mail.get('tags', [])
+        if self._is_templated(value, env):
+            return True
+
+        if isinstance(value, str):
+            value = to_list(value)
+
+        if not isinstance(value, list) or not all(
+                isinstance(tag, str) for tag in value):
+            # keep invalid tags to report them
+            return True
+
+        if not tags.isdisjoint(value):
+            return True
+
+        LOG.debug('Skipping mail "%s", does not match tags: %s',
+                  mail.get('name'), ', '.join(sorted(tags)))
+        return False
+
+    def _is_templated(self, value, env):
+        if isinstance(value, str):
+            return self._is_template(value, env)
+        if isinstance(value, list):
+            return any(self._is_templated(item, env) for item in value)
+        return False
+
+    def _loop_source(self, loop):
+        """Return the file and reader of a loop over a file."""
+
+        file_path = self._base_dir / self._render(loop['file'], self._env)
+
+        fmt = loop.get('format') or LOOP_FORMATS.get(file_path.suffix.lower())
+        if fmt is None:
+            raise ConfigError(
+                f'Unknown format of loop file, set one of: '
+                f'{", ".join(LOOP_READERS)} [path={file_path}]')
+
+        if not file_path.is_file():
+            raise ConfigError(f'No such loop file. [path={file_path}]')
+
+        return file_path, LOOP_READERS[fmt]
+
+    def _smime_files(self, smime, env):
+        """Yield the S/MIME files of a mail, unless they are templated."""
+
+        for key in SMIME_FILES:
+            value = (smime or {}).get(key)
+            if isinstance(value, str) and not self._is_template(value, env):
+                yield self._base_dir / value
 
     @staticmethod
-    def load(config):
-        """Create a config object from a config file."""
+    def _read(file_path, reader):
+        """Yield the items of a loop file, reading it row by row.
+
+        Raises:
+            ConfigError: If a row of the file is invalid.
+        """
+
+        try:
+            with open(file_path, 'r', newline='', encoding='utf-8') as fh:
+                yield from reader(fh)
+        except LoopRowError as ex:
+            line = '' if ex.line is None else f', line={ex.line}'
+            raise ConfigError(f'Invalid row in loop file: {ex.message} '
+                              f'[path={file_path}{line}]')
+        except UnicodeDecodeError as ex:
+            raise ConfigError(f'Loop file is not UTF-8 encoded: {ex.reason} '
+                              f'[path={file_path}]')
+
+    def _expand(self, loop):
+        """Return the items of a (templated) loop.
+
+        The items of an inline list are returned as is, they are rendered
+        by `iter_mails` only if they are owned by the shard.
+        """
+
+        if isinstance(loop, tuple):
+            return self._read(*loop)
+
+        if isinstance(loop, list):
+            return loop
+
+        loop = self._render(loop, self._env)
+        try:
+            loop = yaml.load(loop, Loader=SafeLoader)
+        except AttributeError:
+            pass
+        except yaml.YAMLError as ex:
+            LOG.error(ex)
+
+        return loop
 
-        if not isinstance(config, dict):
-            LOG.info('Parsing config file. [path=%s]', config)
-            with open(config, 'r') as fh:
-                config = yaml.safe_load(fh)
-        return Config(config)
+    def _render_mail(self, fields, **kwargs):
+
+        with metrics.timer('config.render'):
+            mail = {key: render(**kwargs) for key, render in fields}
+
+        return self._normalize(mail)
+
+    @staticmethod
+    def _normalize(mail):
+        """Apply the renames and coercions of the schema to a mail.
+
+        The mail definition is validated already and rendering keeps the
+        types of all fields, so there is no need to validate it again.
+        """
+
+        for key, coerce in COERCIONS.items():
+            if key in mail:
+                mail[key] = coerce(mail[key])
+
+        for key, rename in RENAMES.items():
+            if key in mail:
+                mail[rename] = mail.pop(key)
+
+        return mail
+
+    @staticmethod
+    def load(config, shard=None, tags=None, cache=None):
+        """Create a config object from a config file.
+
+        Args:
+            config (str or dict): Path of the config file or parsed config.
+            shard (:obj:`Shard`, optional): Only render the mails of a shard.
+            tags (set, optional): Only render the mails with any of the tags.
+            cache (:obj:`ConfigCache`, optional): Cache of parsed and
+                validated configs.
+        """
+
+        if isinstance(config, dict):
+            return Config(config, shard=shard, tags=tags)
+
+        LOG.info('Parsing config file. [path=%s]', config)
+        with metrics.timer('config.load'):
+            with open(config, 'rb') as fh:
+                source = fh.read()
+
+            data = cache.get(source) if cache else None
+            if data is not None:
+                LOG.debug('Using cached config. [path=%s]', config)
+                return Config(data, config, shard, tags, validate=False)
+
+            data = yaml.load(source, Loader=SafeLoader)
+
+        loaded = Config(data, config, shard, tags)
+
+        # only cache configs valid as a whole, not just the selected mails
+        if cache and (tags is None or check_document(data)):
+            cache.put(source, data, loaded.files)
+
+        return loaded
 
     @staticmethod
+    @metrics.timed('config.validate')
     def check_config(config):
+        """Validate a config against `CONFIG_SCHEMA`.
+
+        Valid configs are checked by the compiled schema only. A cerberus
+        validator is run only to report the errors of invalid configs.
+
+        Returns:
+            dict: The validated config.
+
+        Raises:
+            ValidationError: If the config is invalid.
+        """
+
+        if check_document(config):
+            return config
+
+        from cerberus import Validator
 
         v = Validator()
         if not v.validate(config, CONFIG_SCHEMA, normalize=False):
             raise ValidationError(v.errors)
 
-        return v.normalized(config)
+        return config
 
     def _render(self, field, env, **kwargs):
+        return self._compile(field, env)(**kwargs)
+
+    def _compile(self, field, env):
+        """Compile a field to a function rendering it with given variables.
+
+        Templates are compiled once per config and shared by all fields
+        with the same source.
+        """
 
         if isinstance(field, str):
-            template = env.from_string(field)
-            return template.render(**kwargs)
+            if not self._is_template(field, env):
+                text = self._plain_text(field)
+                return lambda **kwargs: text
+
+            template = self._templates.get(field)
+            if template is None:
+                template = self._templates[field] = env.from_string(field)
+            return template.render
 
         if isinstance(field, list):
-            copy = []
-            for item in field:
-                copy.append(self._render(item, env, **kwargs))
-            return copy
+            items = [self._compile(item, env) for item in field]
+            return lambda **kwargs: [render(**kwargs) for render in items]
 
         if isinstance(field, dict):
-            copy = {}
-            for key, value in field.items():
-                copy[key] = self._render(value, env, **kwargs)
-            return copy
+            values = [(key, self._compile(value, env))
+                      for key, value in field.items()]
+            return lambda **kwargs: {key: render(**kwargs)
+                                     for key, render in values}
+
+        return lambda **kwargs: field
 
-        return field
+    @staticmethod
+    def _is_template(text, env):
+        return (env.variable_start_string in text
+                or env.block_start_string in text
+                or env.comment_start_string in text)
+
+    @staticmethod
+    def _plain_text(text):
+        """Return a string without template syntax as jinja renders it."""
+
+        # jinja normalizes line endings and removes a single trailing
+        # newline (see `keep_trailing_newline`)
+        text = NEWLINES.sub('\n', text)
+        if text.endswith('\n'):
+            text = text[:-1]
+        return text
@@ -0,0 +1,200 @@
+import random
+import re
+
+from .exceptions import SpoolError
+
+CHUNK_SIZE = 1024 * 1024
+
+KINDS = ('random', 'text', 'lorem')
+
+CONTENT_TYPES = {
+    'random': 'application/octet-stream',
+    'text': 'text/plain',
+    'lorem': 'text/plain',
+}
+
+EXTENSIONS = {
+    'random': 'bin',
+    'text': 'txt',
+    'lorem': 'txt',
+}
+
+SIZE = re.compile(r'(?P<value>\d+(\.\d*)?)\s*(?P<unit>[kmg]i?b?|b)?',
+                  re.IGNORECASE)
+
+UNITS = {
+    '': 1,
+    'b': 1,
+    'k': 1000,
+    'kb': 1000,
+    'kib': 1024,
+    'm': 1000**2,
+    'mb': 1000**2,
+    'mib': 1024**2,
+    'g': 1000**3,
+    'gb': 1000**3,
+    'gib': 1024**3,
+}
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam '
+    'quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum '
+    'eu fugiat nulla pariatur excepteur sint occaecat cupidatat non proident '
+    'sunt culpa qui officia deserunt mollit anim id est laborum').split()
+
+LINE_LENGTH = 72
+
+# size of the block repeated by text payloads
+TEXT_BLOCK = 4096
+
+# number of sentences lorem payloads are composed of
+LOREM_POOL = 4096
+
+
+class PayloadError(SpoolError):
+    """Base class for errors related to generated payloads."""
+
+
+def parse_size(value):
+    """Parse a size like `5MB` or `512 KiB` to bytes.
+
+    Examples:
+        >>> parse_size('5MB')
+        5000000
+        >>> parse_size('1.5 KiB')
+        1536
+        >>> parse_size(100)
+        100
+    """
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        size = value
+    else:
+        match = SIZE.fullmatch(str(value).strip())
+        if not match:
+            raise PayloadError(f'Invalid size: {value}')
+        unit = (match.group('unit') or '').lower()
+        size = int(float(match.group('value')) * UNITS[unit])
+
+    if size < 0:
+        raise PayloadError(f'Invalid size: {value}')
+
+    return size
+
+
+class Payload:
+    """Synthetic content of a given size, generated on the fly.
+
+    The content depends only on the kind, size and seed, so the same
+    payload is generated on every run. It is produced in chunks and never
+    held in memory as a whole when streamed.
+
+    Args:
+        size (int): Size in bytes.
+        kind (str): `random` for incompressible binary data, `text` for
+            highly compressible text or `lorem` for lorem ipsum text.
+        seed (int): Seed of the generator.
+        name (str, optional): File name of an attachment.
+        content_type (str, optional): MIME type of an attachment, depends
+            on the kind by default.
+    """
+
+    def __init__(self, size, kind='random', seed=0, name=None,
+                 content_type=None):
+
+        if kind not in KINDS:
+            raise PayloadError(
+                f'Unknown payload kind: {kind}, use one of: '
+                f'{", ".join(KINDS)}')
+
+        self.size = size
+        self.kind = kind
+        self.seed = seed
+        self.name = name or f'{kind}-{seed}.{EXTENSIONS[kind]}'
+        self.content_type = content_type or CONTENT_TYPES[kind]
+
+    @classmethod
+    def from_config(cls, config, kind='random'):
+        """Create a payload from a config like `{generate: {size: 5MB}}`.
+
+        Args:
+            config (dict): The config of the payload.
+            kind (str): The kind if not configured.
+        """
+
+        options = dict(config['generate'])
+        options['size'] = parse_size(options['size'])
+        options.setdefault('kind', kind)
+        return cls(**options)
+
+    def __repr__(self):
+        return (f'Payload(size={self.size}, kind={self.kind}, '
+                f'seed={self.seed}, name={self.name})')
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """Yield the content in chunks of `chunk_size` bytes.
+
+        Only the last chunk may be shorter.
+        """
+
+        remaining = self.size
+        pending = bytearray()
+
+        for block in self._generate():
+            pending += block
+            while len(pending) >= min(chunk_size, remaining):
+                if not remaining:
+                    return
+                size = min(chunk_size, remaining)
+                chunk = bytes(pending[:size])
+                del pending[:size]
+                remaining -= size
+                yield chunk
+
+    def read(self):
+        """Return the whole content."""
+        return b''.join(self.chunks())
+
+    def text(self):
+        """Return the whole content as text, e.g. for a body."""
+
+        if self.kind == 'random':
+            raise PayloadError(
+                'Random payloads are binary, use text or lorem for bodies')
+
+        return self.read().decode('ascii')
+
+    def _generate(self):
+        """Yield blocks of content, endlessly."""
+
+        rng = random.Random(self.seed)
+
+        if self.kind == 'random':
+            while True:
+                yield rng.getrandbits(CHUNK_SIZE * 8).to_bytes(
+                    CHUNK_SIZE, 'little')
+
+        elif self.kind == 'text':
+            block = b''.join(_sentences(rng, TEXT_BLOCK // 48))
+            while True:
+                yield block
+
+        else:
+            # shuffle a pool of sentences, much faster than picking words
+            pool = _sentences(rng, LOREM_POOL)
+            while True:
+                yield b''.join(rng.choices(pool, k=1024))
+
+
+def _sentences(rng, count):
+    """Return `count` lines of lorem ipsum sentences."""
+
+    lines = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(6, 12))
+        line = ' '.join(words).capitalize()[:LINE_LENGTH - 1] + '.'
+        lines.append(line.encode('ascii') + b'\n')
+
+    return lines
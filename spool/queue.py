@@ -0,0 +1,322 @@
+import collections
+import heapq
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from .exceptions import SpoolError
+
+LOG = logging.getLogger(__name__)
+
+
+class QueueError(SpoolError):
+    """Base class for all errors related to the mail queue."""
+
+
+class QueueEntry:
+    """Envelope and delivery state of a queued message.
+
+    Args:
+        name (str): Name of the message.
+        sender (str): Envelope sender.
+        recipients (list): Envelope recipients.
+        host (str, optional): Remote server to deliver to, looked up from
+            `domain` if not set.
+        domain (str, optional): Recipient domain of a direct delivery.
+        attempts (int): Number of failed delivery attempts.
+        next_attempt (float): Unix timestamp of the next delivery attempt.
+        created (float): Unix timestamp when the message was queued.
+        error (str, optional): Error of the last delivery attempt.
+        id (str, optional): Unique identifier of the entry.
+    """
+
+    def __init__(self,
+                 name,
+                 sender,
+                 recipients,
+                 host=None,
+                 domain=None,
+                 attempts=0,
+                 next_attempt=0.0,
+                 created=None,
+                 error=None,
+                 id=None):
+
+        self.id = id or uuid.uuid4().hex
+        self.name = name
+        self.sender = sender
+        self.recipients = recipients
+        self.host = host
+        self.domain = domain
+        self.attempts = attempts
+        self.next_attempt = next_attempt
+        self.created = created or time.time()
+        self.error = error
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def __str__(self):
+        return (f'[id={self.id}, name={self.name}, host={self.host}, '
+                f'domain={self.domain}, attempts={self.attempts}]')
+
+
+class MailQueue:
+    """Spool directory of deferred messages.
+
+    Every entry is stored as a pair of files, the serialized message
+    `<id>.eml` and its envelope and delivery state `<id>.json`. Files are
+    written to `tmp/` and moved into `queue/` atomically, entries given up
+    on are moved to `failed/`.
+
+    Entries are indexed in memory by the second they become due, which
+    keeps adding and taking entries independent of the queue length. The
+    index is rebuilt from the spool directory when the queue is opened.
+
+    Args:
+        path (str): The spool directory.
+        base_delay (float): Delay in seconds after the first failed attempt,
+            doubled for every further attempt.
+        max_delay (float): Maximum delay in seconds between attempts.
+        max_attempts (int): Number of attempts before giving up.
+    """
+
+    def __init__(self,
+                 path,
+                 base_delay=60.0,
+                 max_delay=3600.0,
+                 max_attempts=10,
+                 clock=time.time):
+
+        self.path = Path(path)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.clock = clock
+
+        self._tmp = self.path / 'tmp'
+        self._queue = self.path / 'queue'
+        self._failed = self.path / 'failed'
+
+        for directory in (self._tmp, self._queue, self._failed):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self._buckets = {}
+        self._seconds = []
+        self._size = 0
+        self._lock = threading.RLock()
+
+        self._load()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, entry, data):
+        """Add a message to the queue.
+
+        An entry with failed attempts is scheduled according to the backoff
+        delay, otherwise it is due immediately.
+
+        Args:
+            entry (:obj:`QueueEntry`): Envelope of the message.
+            data (bytes or :obj:`WireStream`): The serialized message.
+        """
+
+        if not entry.next_attempt:
+            entry.next_attempt = self.clock()
+            if entry.attempts:
+                entry.next_attempt += self.backoff(entry.attempts)
+
+        tmp = self._tmp / f'{entry.id}.eml'
+        with open(tmp, 'wb') as fh:
+            if isinstance(data, bytes):
+                fh.write(data)
+            else:
+                fh.writelines(data)
+        os.replace(tmp, self._queue / tmp.name)
+
+        self._write_entry(entry)
+
+        with self._lock:
+            self._schedule(entry)
+            self._size += 1
+
+        LOG.info('Message queued. %s', entry)
+
+    def get(self):
+        """Take the next due entry from the queue.
+
+        Returns:
+            :obj:`QueueEntry`: The entry or None if no entry is due.
+        """
+
+        now = self.clock()
+
+        with self._lock:
+            while self._seconds and self._seconds[0] <= now:
+                second = self._seconds[0]
+                bucket = self._buckets[second]
+
+                if not bucket:
+                    heapq.heappop(self._seconds)
+                    del self._buckets[second]
+                    continue
+
+                entry_id = bucket.popleft()
+                try:
+                    return self._read_entry(self._queue / f'{entry_id}.json')
+                except FileNotFoundError:
+                    # removed by someone else in the meantime
+                    self._size -= 1
+
+        return None
+
+    def next_due(self):
+        """Return the seconds until the next entry is due or None."""
+
+        with self._lock:
+            while self._seconds and not self._buckets[self._seconds[0]]:
+                del self._buckets[heapq.heappop(self._seconds)]
+
+            if not self._seconds:
+                return None
+
+            return max(0.0, self._seconds[0] - self.clock())
+
+    def read(self, entry):
+        """Return the serialized message of an entry."""
+        return (self._queue / f'{entry.id}.eml').read_bytes()
+
+    def backoff(self, attempts):
+        """Return the delay before the next attempt, with jitter."""
+        delay = min(self.max_delay, self.base_delay * 2**(attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def defer(self, entry, recipients=None, error=None):
+        """Reschedule an entry after a failed attempt.
+
+        Args:
+            entry (:obj:`QueueEntry`): The entry taken from the queue.
+            recipients (list, optional): Recipients still to deliver to.
+            error (str, optional): Reason of the failure.
+        """
+
+        entry.attempts += 1
+        entry.error = error
+        if recipients:
+            entry.recipients = recipients
+
+        if entry.attempts >= self.max_attempts:
+            self.fail(entry, error)
+            return
+
+        entry.next_attempt = self.clock() + self.backoff(entry.attempts)
+        self._write_entry(entry)
+
+        with self._lock:
+            self._schedule(entry)
+
+        LOG.info('Message deferred, retrying in %.0f seconds. %s',
+                 entry.next_attempt - self.clock(), entry)
+
+    def remove(self, entry):
+        """Remove a delivered entry from the queue."""
+
+        for suffix in ('.json', '.eml'):
+            try:
+                (self._queue / f'{entry.id}{suffix}').unlink()
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            self._size -= 1
+
+    def fail(self, entry, error=None):
+        """Give up on an entry and move it to the failed directory."""
+
+        entry.error = error
+        self._write_entry(entry)
+
+        for suffix in ('.json', '.eml'):
+            name = f'{entry.id}{suffix}'
+            os.replace(self._queue / name, self._failed / name)
+
+        with self._lock:
+            self._size -= 1
+
+        LOG.error('Giving up on message after %d attempts: %s %s',
+                  entry.attempts, error, entry)
+
+    def _schedule(self, entry):
+        second = math.ceil(entry.next_attempt)
+
+        bucket = self._buckets.get(second)
+        if bucket is None:
+            bucket = self._buckets[second] = collections.deque()
+            heapq.heappush(self._seconds, second)
+
+        bucket.append(entry.id)
+
+    def _write_entry(self, entry):
+        tmp = self._tmp / f'{entry.id}.json'
+        tmp.write_text(json.dumps(entry.to_dict()))
+        os.replace(tmp, self._queue / tmp.name)
+
+    @staticmethod
+    def _read_entry(path):
+        return QueueEntry.from_dict(json.loads(path.read_text()))
+
+    def _load(self):
+        """Rebuild the index from the spool directory."""
+
+        for path in self._queue.glob('*.json'):
+            try:
+                entry = self._read_entry(path)
+            except (ValueError, TypeError) as exc:
+                raise QueueError(
+                    f'Invalid queue entry: {exc} [path={path}]') from exc
+
+            self._schedule(entry)
+            self._size += 1
+
+        if self._size:
+            LOG.info('Loaded %d queued messages. [path=%s]', self._size,
+                     self.path)
+
+    def flush(self, mailer, wait=False):
+        """Retry the delivery of queued messages.
+
+        Args:
+            mailer (:obj:`Mailer`): The mailer to deliver messages with.
+            wait (bool): Wait for deferred entries to become due until the
+                queue is empty, instead of returning once no entry is due.
+        """
+
+        while True:
+            entry = self.get()
+
+            if entry is None:
+                delay = self.next_due() if wait else None
+                if delay is None:
+                    return
+                time.sleep(delay)
+                continue
+
+            result = mailer.retry(entry, self.read(entry))
+
+            if result.deferred:
+                self.defer(entry, result.deferred, result.error)
+            elif result.sent:
+                self.remove(entry)
+            else:
+                self.fail(entry, result.error)
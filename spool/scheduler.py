@@ -0,0 +1,194 @@
+import logging
+import re
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600}
+RATE = re.compile(r'(?P<count>\d+(\.\d*)?)\s*(/\s*(?P<unit>[smh]))?')
+DURATION = re.compile(r'(?P<value>\d+(\.\d*)?)\s*(?P<unit>[smh])?')
+
+
+def parse_rate(value):
+    """Parse a rate like `200/m` to messages per second.
+
+    Examples:
+        >>> parse_rate('120/m')
+        2.0
+        >>> parse_rate('5')
+        5.0
+    """
+
+    match = RATE.fullmatch(value.strip())
+    if not match or float(match.group('count')) <= 0:
+        raise ValueError(f'Invalid rate: {value}')
+
+    return float(match.group('count')) / UNITS[match.group('unit') or 's']
+
+
+def parse_duration(value):
+    """Parse a duration like `2m` to seconds.
+
+    Examples:
+        >>> parse_duration('2m')
+        120.0
+        >>> parse_duration('90')
+        90.0
+    """
+
+    match = DURATION.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f'Invalid duration: {value}')
+
+    return float(match.group('value')) * UNITS[match.group('unit') or 's']
+
+
+class Ramp:
+    """Linear ramp-up of a rate.
+
+    Args:
+        start (float): Rate (per second) at the beginning of the ramp.
+        end (float): Rate (per second) at the end of the ramp.
+        duration (float): Duration of the ramp in seconds.
+    """
+
+    def __init__(self, start, end, duration):
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    @classmethod
+    def parse(cls, value):
+        """Create a ramp from a `START:END:DURATION` string.
+
+        Examples:
+            >>> ramp = Ramp.parse('1:50:2m')
+            >>> ramp.start, ramp.end, ramp.duration
+            (1.0, 50.0, 120.0)
+        """
+
+        try:
+            start, end, duration = value.split(':')
+        except ValueError:
+            raise ValueError(f'Invalid ramp: {value}') from None
+
+        return cls(parse_rate(start), parse_rate(end), parse_duration(duration))
+
+    def rate(self, elapsed):
+        """Return the rate after `elapsed` seconds."""
+
+        if elapsed >= self.duration:
+            return self.end
+
+        return self.start + (self.end - self.start) * elapsed / self.duration
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens are added at `rate` tokens per second up to a maximum of `burst`
+    tokens. Each message takes one token. A reservation may drive the
+    bucket into debt, callers then have to wait until it is paid back.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (int): Maximum number of tokens in the bucket.
+        ramp (:obj:`Ramp`, optional): Ramp-up profile replacing `rate`.
+        clock (callable): Monotonic clock returning seconds.
+    """
+
+    def __init__(self, rate, burst=1, ramp=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.ramp = ramp
+        self.clock = clock
+        self.started = self.updated = clock()
+        self.tokens = min(burst, 1) if ramp else burst
+
+    def current_rate(self, now):
+        if self.ramp:
+            return self.ramp.rate(now - self.started)
+        return self.rate
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+
+        now = self.clock()
+        rate = self.current_rate(now)
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0.0
+
+        return -self.tokens / rate
+
+
+class RateScheduler:
+    """Schedules messages with a global and per destination token bucket.
+
+    Args:
+        rate (float, optional): Overall messages per second.
+        burst (int): Burst size of the overall rate.
+        host_rate (float, optional): Messages per second per destination.
+        host_burst (int): Burst size of the per destination rate.
+        ramp (:obj:`Ramp`, optional): Ramp-up profile of the overall rate.
+    """
+
+    def __init__(self,
+                 rate=None,
+                 burst=1,
+                 host_rate=None,
+                 host_burst=1,
+                 ramp=None,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.clock = clock
+        self.sleep = sleep
+
+        self._bucket = None
+        if rate or ramp:
+            self._bucket = TokenBucket(rate, burst, ramp, clock)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key=None):
+        """Reserve a slot and return the seconds to wait for it.
+
+        Args:
+            key (str, optional): The destination to reserve a slot for,
+                or `None` for the overall rate.
+        """
+
+        with self._lock:
+
+            if key is None:
+                bucket = self._bucket
+
+            elif self.host_rate:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = TokenBucket(
+                        self.host_rate, self.host_burst, clock=self.clock)
+
+            else:
+                bucket = None
+
+            return bucket.reserve() if bucket else 0.0
+
+    def acquire(self, key=None):
+        """Block until a slot is available, see `reserve`."""
+
+        wait = self.reserve(key)
+        if wait > 0:
+            LOG.debug('Delaying next message by %.2f seconds. [key=%s]', wait,
+                      key)
+            self.sleep(wait)
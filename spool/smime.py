@@ -1,16 +1,154 @@
+import hashlib
 import logging
+import threading
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
+from pathlib import Path
 
-from cryptography import x509
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.serialization import pkcs7
+from . import metrics
+from .wire import flatten
 
 LOG = logging.getLogger(__name__)
 
 
+class KeyStore:
+    """Process-wide cache of parsed S/MIME keys and certificates.
+
+    Keys and certificate bundles are keyed by a hash of their PEM content,
+    so every distinct key is parsed once, no matter how many mails or
+    config files use it. PEM files are keyed by the resolved path, size and
+    modification time, changed files are read again.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def read(self, file_path):
+        """Return the content of a PEM file.
+
+        Args:
+            file_path (str): Path of the file.
+
+        Returns:
+            str: The content of the file.
+        """
+
+        path = Path(file_path)
+        stat = path.stat()
+        key = ('file', str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+        return self._get(key, path.read_text)
+
+    def private_key(self, pem):
+        """Return the private key of a PEM encoded key.
+
+        Args:
+            pem (str): The PEM encoded private key.
+        """
+
+        from cryptography.hazmat.primitives import serialization
+
+        return self._get(
+            ('key', _digest(pem)),
+            lambda: serialization.load_pem_private_key(pem.encode(), None))
+
+    def certificates(self, pem):
+        """Return the certificates of a PEM encoded bundle.
+
+        Args:
+            pem (str): One or more PEM encoded certificates.
+
+        Returns:
+            tuple: The certificates in the order of the bundle.
+        """
+
+        from cryptography import x509
+
+        return self._get(
+            ('certificates', _digest(pem)),
+            lambda: tuple(x509.load_pem_x509_certificates(pem.encode())))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key, load):
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if value is None:
+            value = load()
+            with self._lock:
+                value = self._entries.setdefault(key, value)
+
+        return value
+
+
+def _digest(pem):
+    return hashlib.sha256(pem.encode()).digest()
+
+
+KEYSTORE = KeyStore()
+
+
+def load_private_key(key):
+    """Return a private key, parsing it if PEM encoded.
+
+    Args:
+        key (str or private key): The PEM encoded or an already loaded
+            private key.
+    """
+
+    if isinstance(key, str):
+        return KEYSTORE.private_key(key)
+
+    return key
+
+
+def load_certificates(certs):
+    """Return a sequence of certificates, parsing them if PEM encoded.
+
+    Args:
+        certs (str, :obj:`Certificate` or list): PEM encoded certificates,
+            a loaded certificate or a sequence of loaded certificates.
+    """
+
+    if isinstance(certs, str):
+        return KEYSTORE.certificates(certs)
+
+    from cryptography import x509
+
+    if isinstance(certs, x509.Certificate):
+        return (certs,)
+
+    return tuple(certs)
+
+
+@metrics.timed('smime.sign')
 def sign(message, key, cert):
-    """Sign a a given message."""
+    """Sign a a given message.
+
+    Args:
+        message (:obj:`Message`): The MIME message to sign.
+        key (str or private key): The private key of the signer, PEM
+            encoded or loaded, see `load_private_key`.
+        cert (str or list): The certificate of the signer, preceded by its
+            chain, see `load_certificates`.
+    """
+
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
 
     signed = MIMEMultipart('signed',
                            micalg='sha-256',
@@ -19,10 +157,10 @@ def sign(message, key, cert):
 
     signed.attach(message)
 
-    cann = message.as_bytes().replace(b'\n', b'\r\n')
+    cann = flatten(message)
 
-    certstack = x509.load_pem_x509_certificates(cert.encode())
-    key = serialization.load_pem_private_key(key.encode(), None)
+    certstack = load_certificates(cert)
+    key = load_private_key(key)
 
     cms = pkcs7.PKCS7SignatureBuilder().set_data(cann).add_signer(
         certstack[-1], key, hashes.SHA256())
@@ -43,13 +181,23 @@ def sign(message, key, cert):
     return signed
 
 
+@metrics.timed('smime.encrypt')
 def encrypt(message, certs):
-    """Encrypt a given message."""
+    """Encrypt a given message.
+
+    Args:
+        message (:obj:`Message`): The MIME message to encrypt.
+        certs (str or list): The certificates of the recipients, PEM encoded
+            or loaded, see `load_certificates`.
+    """
+
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
 
-    certs = x509.load_pem_x509_certificates(certs.encode())
+    certs = load_certificates(certs)
 
     options = [pkcs7.PKCS7Options.Text]
-    envelope = pkcs7.PKCS7EnvelopeBuilder().set_data(message.as_bytes())
+    envelope = pkcs7.PKCS7EnvelopeBuilder().set_data(flatten(message))
 
     for cert in certs:
         envelope = envelope.add_recipient(cert)
@@ -0,0 +1,251 @@
+import binascii
+import mmap
+import os
+import re
+import uuid
+from email import policy
+from email.generator import NLCRE, BytesGenerator
+from io import BytesIO
+from pathlib import Path
+
+# policy of the MIME classes, but with the line endings of `policy.SMTP`
+SMTP_POLICY = policy.compat32.clone(linesep='\r\n')
+
+CHUNK_SIZE = 1024 * 1024
+
+# number of bytes encoded in a single line of 76 base64 characters
+BASE64_LINE = 57
+
+# attachments of at least this size are streamed from their files
+STREAM_THRESHOLD = 8 * 1024 * 1024
+
+# bytes read from a streamed file at once, a multiple of the page size and
+# of the bytes encoded in a line
+STREAM_CHUNK = BASE64_LINE * mmap.PAGESIZE * 4
+
+LEADING_PERIODS = re.compile(br'(?m)^\.')
+
+
+class WireGenerator(BytesGenerator):
+    """Generates the wire format of a message.
+
+    Base64 encoded bodies are written in large chunks instead of line by
+    line, which avoids holding a string object for every line of large
+    attachments. Raw 8bit text, e.g. of eml templates, is written as UTF-8.
+    """
+
+    def _handle_text(self, msg):
+        payload = msg.get_payload()
+        encoding = msg.get('content-transfer-encoding', '').lower()
+
+        if (isinstance(payload, str) and '\r' not in payload
+                and encoding == 'base64'):
+            for idx in range(0, len(payload), CHUNK_SIZE):
+                chunk = payload[idx:idx + CHUNK_SIZE]
+                self.write(chunk.replace('\n', self._NL))
+            return
+
+        if (isinstance(payload, str) and not payload.isascii()
+                and encoding not in ('base64', 'quoted-printable')):
+            self._fp.write(NLCRE.sub(self._NL, payload).encode(
+                'utf-8', 'surrogateescape'))
+            return
+
+        super()._handle_text(msg)
+
+    _writeBody = _handle_text
+
+
+def encode_base64(data):
+    """Encode data as base64 body in lines of 76 characters.
+
+    Produces the same result as `email.encoders.encode_base64`, but encodes
+    the data in chunks instead of creating an object for every line.
+
+    Args:
+        data (bytes): The data to encode.
+
+    Returns:
+        str: The encoded data.
+    """
+
+    view = memoryview(data)
+    encoded = bytearray()
+    step = BASE64_LINE * 16384
+
+    for idx in range(0, len(view), step):
+        chunk = binascii.b2a_base64(view[idx:idx + step], newline=False)
+        encoded += b'\n'.join(chunk[pos:pos + 76]
+                              for pos in range(0, len(chunk), 76))
+        encoded += b'\n'
+
+    return encoded.decode('ascii')
+
+
+def flatten(msg):
+    """Return a MIME message flattened with CRLF line endings.
+
+    Args:
+        msg: The `email.message.Message` to flatten.
+
+    Returns:
+        bytes: The flattened message.
+    """
+
+    fp = BytesIO()
+    WireGenerator(fp, mangle_from_=False, policy=SMTP_POLICY).flatten(msg)
+    return fp.getvalue()
+
+
+def encoded_size(size):
+    """Return the size of `size` bytes encoded by `encode_file`."""
+
+    lines, rest = divmod(size, BASE64_LINE)
+    encoded = lines * 78
+    if rest:
+        encoded += (rest + 2) // 3 * 4 + 2
+    return encoded
+
+
+def encode_chunks(chunks):
+    """Yield chunks of data encoded as base64 body with CRLF line endings.
+
+    Produces the same result as `encode_base64`, as long as all chunks but
+    the last are a multiple of `BASE64_LINE` bytes.
+
+    Args:
+        chunks (iterable): The data in chunks of bytes.
+
+    Yields:
+        bytes: Chunks of encoded lines.
+    """
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+
+        encoded = binascii.b2a_base64(chunk, newline=False)
+        yield b'\r\n'.join(encoded[pos:pos + 76]
+                            for pos in range(0, len(encoded), 76))
+        yield b'\r\n'
+
+
+def encode_file(file_path):
+    """Yield the content of a file encoded as base64 body.
+
+    The file is mapped into memory and encoded in chunks of `STREAM_CHUNK`
+    bytes, see `encode_chunks`. Pages already encoded are released, so
+    memory use does not depend on the size of the file.
+
+    Args:
+        file_path (str): Path of the file to encode.
+
+    Yields:
+        bytes: Chunks of encoded lines.
+    """
+
+    return encode_chunks(_read_mapped(file_path))
+
+
+def _read_mapped(file_path):
+
+    with open(file_path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if not size:
+            return
+
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(0, size, STREAM_CHUNK):
+                yield mapped[offset:offset + STREAM_CHUNK]
+
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_DONTNEED, offset,
+                                   min(STREAM_CHUNK, size - offset))
+
+
+class WireStream:
+    """A flattened message with large attachments streamed while sending.
+
+    The MIME parts of streamed attachments hold a placeholder line, see
+    `placeholder`, which is replaced by the encoded content of a file, see
+    `encode_file`, or of a generated payload while iterating over the
+    message. The content is never held in memory as a whole.
+
+    Iterating over a stream yields the message in chunks of bytes with CRLF
+    line endings, `bytes(stream)` returns the whole message.
+    """
+
+    PREFIX = 'X-Spool-Stream'
+
+    def __init__(self):
+        self.sources = []
+        self._token = uuid.uuid4().hex
+        self._segments = []
+
+    def __len__(self):
+        return sum(len(segment) if isinstance(segment, bytes) else
+                   encoded_size(self._size(segment))
+                   for segment in self._segments)
+
+    def __iter__(self):
+        return self.chunks()
+
+    def __bytes__(self):
+        return b''.join(self.chunks())
+
+    def placeholder(self, source):
+        """Add a file or a generated payload to the stream.
+
+        Args:
+            source (:obj:`Path` or :obj:`Payload`): The file or payload.
+
+        Returns:
+            str: The payload of the base64 encoded MIME part of the source.
+        """
+
+        self.sources.append(source)
+        return self._marker(len(self.sources) - 1) + '\n'
+
+    def flatten(self, msg):
+        """Flatten a message holding the placeholders of this stream."""
+
+        wire = flatten(msg)
+
+        self._segments = []
+        start = 0
+        for index, source in enumerate(self.sources):
+            marker = self._marker(index).encode('ascii') + b'\r\n'
+            pos = wire.index(marker, start)
+            self._segments += [wire[start:pos], source]
+            start = pos + len(marker)
+
+        self._segments.append(wire[start:])
+
+    def chunks(self, stuffed=False):
+        """Yield the message in chunks of bytes.
+
+        Args:
+            stuffed (bool): Whether to double periods at the beginning of
+                lines, as required by the SMTP DATA command. Encoded lines
+                never start with a period.
+        """
+
+        for segment in self._segments:
+            if isinstance(segment, bytes):
+                if stuffed:
+                    segment = LEADING_PERIODS.sub(b'..', segment)
+                if segment:
+                    yield segment
+            elif isinstance(segment, Path):
+                yield from encode_file(segment)
+            else:
+                yield from encode_chunks(segment.chunks(STREAM_CHUNK))
+
+    @staticmethod
+    def _size(source):
+        if isinstance(source, Path):
+            return os.stat(source).st_size
+        return source.size
+
+    def _marker(self, index):
+        return f'{self.PREFIX}-{self._token}-{index}'
@@ -1,6 +1,9 @@
 from email.message import EmailMessage
 
 import asyncio
+import socketserver
+import threading
+
 import pytest
 
 from aiosmtpd.controller import Controller
@@ -54,7 +57,68 @@ class SimpleMessageHandler:
         return '250 OK'
 
 
+class RejectingHandler(socketserver.StreamRequestHandler):
+    """Greets with the server's greeting and answers every command with its
+    reply, closing the connection on QUIT."""
+
+    def handle(self):
+        self.wfile.write(self.server.greeting)
+        for line in self.rfile:
+            if line.strip().upper() == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            self.wfile.write(self.server.reply)
+
+
+class RejectingServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, greeting, reply):
+        self.greeting = greeting
+        self.reply = reply
+        super().__init__(('127.0.0.1', 0), RejectingHandler)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@pytest.fixture(params=['greeting', 'ehlo'])
+def rejecting_server(request):
+    """A server rejecting the greeting or the EHLO/HELO commands."""
+
+    if request.param == 'greeting':
+        greeting = b'554 go away\r\n'
+    else:
+        greeting = b'220 Ready\r\n'
+
+    with RejectingServer(greeting, b'554 go away\r\n') as server:
+        yield server
+
+
 @pytest.fixture(scope='function')
 def smtp_server():
     with SMTPServer() as server:
         yield server
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep the config cache of tests out of the user's cache directory."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(path))
+    return path
@@ -0,0 +1,204 @@
+import logging
+import os
+import socket
+from email import message_from_string
+from unittest.mock import Mock, patch
+
+from spool.asyncmailer import AsyncMailer, AsyncSMTP
+from spool.mailer import MAIL_OUT_PREFIX
+from spool.message import Message
+
+
+def create_message(name='test', recipients='recipient@example.org'):
+    return Message(
+        name=name, sender='Sender <sender@example.org>',
+        recipients=recipients,
+        # Set Message-Id header to None to prevent a dns lookup
+        headers={'Message-ID': None},
+        text_body='.leading period\n',
+        charset='us-ascii',
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_messages_sent(smtp_server, caplog):
+
+    caplog.set_level(logging.INFO, logger='spool')
+    with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                     helo='mail.example.com', concurrency=4,
+                     host_concurrency=2) as mailer:
+        for idx in range(10):
+            mailer.send(create_message(name=f'test-{idx}'))
+
+    assert len(smtp_server.messages) == 10
+    sent = [msg for _, _, msg in caplog.record_tuples if 'Message sent.' in msg]
+    assert len(sent) == 10
+    connects = [msg for _, _, msg in caplog.record_tuples
+                if 'Connecting to remote server.' in msg]
+    assert len(connects) <= 2
+
+
+def test_dot_stuffing(smtp_server):
+
+    with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                     helo='mail.example.com') as mailer:
+        mailer.send(create_message())
+
+    assert '\n.leading period' in smtp_server.messages[0]
+
+
+def test_multiple_domains(smtp_server):
+
+    recipients = 'one@[127.0.0.1], two@[127.0.0.1], three@[127.0.0.1]'
+    with AsyncMailer(port=smtp_server.port,
+                     helo='mail.example.com') as mailer:
+        mailer.send(create_message(recipients=recipients))
+
+    assert len(smtp_server.messages) == 1
+
+
+def test_unexpected_domain_error_keeps_other_results(smtp_server):
+
+    async def get_remote(domain, lifetime=10.0):
+        if domain == 'two.example':
+            raise RuntimeError('boom')
+        return smtp_server.host
+
+    queue = Mock()
+    recipients = 'a@one.example, b@two.example, c@three.example'
+
+    with AsyncMailer(port=smtp_server.port, helo='mail.example.com',
+                     queue=queue) as mailer:
+        with patch.object(mailer, '_get_remote', side_effect=get_remote):
+            mailer.send(create_message(recipients=recipients))
+            mailer.close()
+
+    assert len(smtp_server.messages) == 2
+    entry, _ = queue.put.call_args.args
+    assert (entry.domain, entry.recipients) == ('two.example',
+                                                ['b@two.example'])
+
+
+def test_close_after_loop_stopped():
+
+    mailer = AsyncMailer(relay='127.0.0.1', helo='mail.example.com')
+    mailer.pool = Mock()
+    mailer._executor = executor = Mock()
+
+    mailer.loop.call_soon_threadsafe(mailer.loop.stop)
+    mailer._thread.join()
+    mailer.close()
+
+    mailer.pool.close.assert_called_once()
+    executor.shutdown.assert_called_once()
+    assert mailer._executor is None
+
+
+def test_starttls_not_supported(smtp_server, caplog):
+
+    with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                     helo='mail.example.com', starttls=True) as mailer:
+        mailer.send(create_message())
+
+    assert len(smtp_server.messages) == 1
+    assert any('No support for STARTTLS' in msg
+               for _, _, msg in caplog.record_tuples)
+
+
+def test_connection_refused(caplog):
+
+    with AsyncMailer(relay='127.0.0.1', port=free_port(),
+                     helo='mail.example.com') as mailer:
+        mailer.send(create_message())
+
+    _, severity, msg = caplog.record_tuples[-1]
+    assert severity == logging.ERROR
+    assert 'Failed to send message: Remote refused connection.' in msg
+
+
+def test_connection_refused_queued():
+
+    queue = Mock()
+    with AsyncMailer(relay='127.0.0.1', port=free_port(),
+                     helo='mail.example.com', queue=queue) as mailer:
+        mailer.send(create_message())
+
+    entry, _ = queue.put.call_args.args
+    assert entry.host == '127.0.0.1'
+    assert entry.recipients == ['recipient@example.org']
+    assert 'Remote refused connection.' in entry.error
+
+
+
+def test_connection_reset_queued(smtp_server):
+
+    queue = Mock()
+    with patch.object(AsyncSMTP, 'sendmail',
+                      side_effect=ConnectionResetError(104,
+                                                       'Connection reset')):
+        with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                         helo='mail.example.com', queue=queue) as mailer:
+            mailer.send(create_message())
+
+    entry, _ = queue.put.call_args.args
+    assert entry.recipients == ['recipient@example.org']
+    assert 'Connection reset' in entry.error
+
+
+def test_debug_output(smtp_server, capsys):
+
+    with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                     helo='mail.example.com', debug=True) as mailer:
+        mailer.send(create_message())
+
+    _, err = capsys.readouterr()
+    assert 'EHLO mail.example.com' in err
+
+
+def test_print_only(capsys):
+
+    with patch('spool.asyncmailer.AsyncSMTP.connect') as mock_connect:
+        with AsyncMailer(relay='127.0.0.1', helo='mail.example.com') as mailer:
+            mailer.send(create_message(), print_only=True)
+
+    out, _ = capsys.readouterr()
+    assert out.startswith(MAIL_OUT_PREFIX)
+    mock_connect.assert_not_called()
+
+
+def test_large_attachment_streamed(smtp_server, tmp_path, monkeypatch):
+
+    monkeypatch.setattr('spool.message.STREAM_THRESHOLD', 1024)
+    path = tmp_path / 'large.bin'
+    path.write_bytes(os.urandom(200 * 1024))
+
+    msg = create_message()
+    msg.attach(path)
+
+    with AsyncMailer(relay=smtp_server.host, port=smtp_server.port,
+                     helo='mail.example.com') as mailer:
+        mailer.send(msg)
+
+    received = message_from_string(
+        smtp_server.messages[0].replace('\r\n', '\n'))
+    body, attachment = received.get_payload()
+    assert body.get_payload(decode=True) == b'.leading period\n'
+    assert attachment.get_payload(decode=True) == path.read_bytes()
+
+
+def test_rejected_connection(rejecting_server, caplog):
+
+    with AsyncMailer(relay=rejecting_server.host, port=rejecting_server.port,
+                     helo='mail.example.com') as mailer:
+        mailer.send(create_message(name='first'))
+        mailer.send(create_message(name='second'))
+
+    errors = [msg for _, severity, msg in caplog.record_tuples
+              if severity == logging.ERROR]
+    assert len(errors) == 2
+    assert '554 - go away' in errors[0]
@@ -0,0 +1,72 @@
+import pytest
+
+from spool.bench import BenchStats, Timings, percentile
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize('percent, expected', [
+    (50, 50),
+    (95, 95),
+    (99, 99),
+    (100, 100),
+])
+def test_percentile(percent, expected):
+    assert percentile(list(range(1, 101)), percent) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) is None
+
+
+def test_nested_phases_counted_once():
+
+    timings = Timings()
+    with timings.measure('ehlo'):
+        with timings.measure('ehlo'):
+            pass
+
+    phases = timings.pop()
+    assert list(phases) == ['ehlo']
+    assert timings.pop() == {}
+
+
+def test_summary():
+
+    clock = FakeClock()
+    stats = BenchStats(clock=clock)
+    stats.start()
+
+    stats.record('mx1', 'first', {'connect': 0.5, 'data': 0.1}, 1.0, 100, True)
+    stats.record('mx1', 'second', {'data': 0.3}, 0.5, 200, True)
+    stats.record('mx2', 'first', {}, 0.1, 100, False)
+
+    clock.now = 2.0
+    stats.stop()
+    summary = stats.summary()
+
+    assert summary['duration'] == 2.0
+    assert summary['total']['messages'] == 2
+    assert summary['total']['failed'] == 1
+    assert summary['total']['bytes'] == 300
+    assert summary['total']['messages_per_sec'] == 1.0
+    assert summary['total']['bytes_per_sec'] == 150.0
+    assert summary['total']['latency']['connect']['count'] == 1
+    assert summary['total']['latency']['data']['p99'] == 0.3
+    assert summary['total']['latency']['total']['p50'] == 0.5
+
+    assert summary['hosts']['mx1']['messages'] == 2
+    assert summary['hosts']['mx2']['failed'] == 1
+    assert summary['mails']['first']['messages'] == 1
+
+    report = stats.report()
+    assert 'Total (2.00s): 2 sent, 1 failed, 1.0 msg/s' in report
+    assert 'Host mx2: 0 sent, 1 failed' in report
+    assert 'MAIL/RCPT' not in report
@@ -0,0 +1,121 @@
+import subprocess
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from spool.cache import ConfigCache, default_cache_dir, schema_digest
+from spool.parser import Config, parse_tags
+
+CONFIG = b'''\
+---
+mails:
+  - name: cached
+    sender: sender@example.org
+    recipients: recipient@example.org
+    tags: [smoke]
+    loop:
+      file: recipients.csv
+'''
+
+
+def test_default_cache_dir(cache_home):
+    assert default_cache_dir() == cache_home / 'spool'
+
+
+def test_put_and_get(tmp_path):
+
+    cache = ConfigCache(tmp_path)
+    cache.put(b'source', {'mails': []})
+
+    assert cache.get(b'source') == {'mails': []}
+    assert cache.get(b'other') is None
+
+
+def test_changed_file_invalidates(tmp_path):
+
+    referenced = tmp_path / 'recipients.csv'
+    referenced.write_text('address\n')
+
+    cache = ConfigCache(tmp_path)
+    cache.put(b'source', {'mails': []}, [referenced])
+    assert cache.get(b'source') is not None
+
+    referenced.write_text('address\nuser@example.org\n')
+    assert cache.get(b'source') is None
+
+
+def test_invalid_entry_ignored(tmp_path):
+
+    cache = ConfigCache(tmp_path)
+    (tmp_path / f'{cache.key(b"source")}.pickle').write_bytes(b'broken')
+
+    assert cache.get(b'source') is None
+
+
+def test_load_cached_config(tmp_path):
+
+    config = tmp_path / 'config.yml'
+    config.write_bytes(CONFIG)
+    (tmp_path / 'recipients.csv').write_text('address\n')
+    cache = ConfigCache(tmp_path / 'cache')
+
+    first = Config.load(config, cache=cache)
+
+    with patch('spool.parser.yaml.load') as load, \
+            patch.object(Config, 'check_config') as check:
+        second = Config.load(config, cache=cache)
+
+    load.assert_not_called()
+    check.assert_not_called()
+    assert second.files == first.files == [tmp_path / 'recipients.csv']
+    assert list(second.iter_mails()) == list(first.iter_mails())
+
+
+def test_invalid_config_not_cached(tmp_path):
+
+    config = tmp_path / 'config.yml'
+    config.write_bytes(CONFIG.replace(b'loop:', b'unknown: true\n    loop:'))
+    (tmp_path / 'recipients.csv').write_text('address\n')
+    cache = ConfigCache(tmp_path / 'cache')
+
+    Config.load(config, tags=parse_tags('other'), cache=cache)
+
+    assert cache.get(config.read_bytes()) is None
+
+
+def test_schema_digest_stable():
+
+    def coerce(value):
+        return value
+
+    schema = {'b': {'coerce': coerce}, 'a': {'type': ['string']}}
+
+    assert schema_digest(schema) == schema_digest(dict(reversed(
+        list(schema.items()))))
+    assert schema_digest(schema) != schema_digest({'b': {'coerce': str}})
+
+
+def test_cache_hit_across_processes(tmp_path):
+
+    config = tmp_path / 'config.yml'
+    config.write_bytes(CONFIG)
+    (tmp_path / 'recipients.csv').write_text('address\n')
+    cache_dir = tmp_path / 'cache'
+
+    script = (
+        'import sys\n'
+        'from spool.cache import ConfigCache\n'
+        'from spool.parser import Config\n'
+        'cache = ConfigCache(sys.argv[1])\n'
+        'hit = cache.get(open(sys.argv[2], "rb").read()) is not None\n'
+        'Config.load(sys.argv[2], cache=cache)\n'
+        'print(hit)\n')
+
+    root = Path(__file__).parent.parent
+    results = [subprocess.run(
+        [sys.executable, '-c', script, str(cache_dir), str(config)],
+        cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        for _ in range(2)]
+
+    assert results == ['False', 'True']
+    assert len(list(cache_dir.glob('*.pickle'))) == 1
@@ -1,9 +1,13 @@
+import json
+import logging
+from email import message_from_string
 from pathlib import Path
 from unittest import mock
 
 import pytest
 
-from spool import main
+from spool import main, metrics
+from spool.payload import Payload
 
 SIMPLE = '''\
 ---
@@ -17,6 +21,23 @@ mails:
         Just a simple text message.
 '''
 
+GENERATED = '''\
+---
+mails:
+  - name: generated
+    sender: sender@example.org
+    recipients: recipient@example.org
+    subject: Generated Message
+    text_body:
+      generate:
+        size: 1KB
+    attachments:
+      - generate:
+          size: 2KiB
+          seed: 1
+          name: blob.bin
+'''
+
 WITH_VARS = '''\
 ---
 defaults:
@@ -106,6 +127,20 @@ def test_success_with_loop(smtp_server, tmp_path):
     assert len(smtp_server.messages) == 3
 
 
+def test_success_with_async_engine(smtp_server, tmp_path):
+
+    config = tmp_path / 'with_vars.yml'
+    config.write_text(WITH_LOOP)
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port', str(smtp_server.port),
+        '--engine', 'async', '--concurrency', '2', str(config)
+    ]):
+        main.cli()
+
+    assert len(smtp_server.messages) == 3
+
+
 @pytest.mark.parametrize(
     'config', EXAMPLE_DIR.glob('*.yml'), ids=lambda f: f.name)
 def test_examples(smtp_server, tmp_path, caplog, config):
@@ -117,3 +152,180 @@ def test_examples(smtp_server, tmp_path, caplog, config):
         main.cli()
         for record in caplog.records:
             assert record.levelname not in ['ERROR', 'CRITICAL']
+
+
+def test_bench_mode(smtp_server, tmp_path, capsys):
+
+    config = tmp_path / 'with_vars.yml'
+    config.write_text(WITH_LOOP)
+    output = tmp_path / 'bench.json'
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port', str(smtp_server.port),
+        '--repeat', '2', '--bench-output', str(output), str(config)
+    ]):
+        main.cli()
+
+    assert len(smtp_server.messages) == 6
+
+    results = json.loads(output.read_text())
+    assert results['total']['messages'] == 6
+    assert results['hosts'][smtp_server.host]['messages'] == 6
+    assert 'connect' in results['mails']['with-loop']['latency']
+    assert results['mails']['with-loop']['latency']['data']['count'] == 6
+
+    assert 'Total' in capsys.readouterr().out
+
+
+def test_metrics_output(smtp_server, tmp_path):
+
+    config = tmp_path / 'with_vars.yml'
+    config.write_text(WITH_VARS)
+    output = tmp_path / 'metrics.json'
+    prom = tmp_path / 'metrics.prom'
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port', str(smtp_server.port),
+        '--metrics-json', str(output), '--metrics-prom', str(prom),
+        str(config)
+    ]):
+        try:
+            main.cli()
+        finally:
+            metrics.disable()
+
+    stages = json.loads(output.read_text())
+    for stage in ('config.load', 'config.render', 'config.validate',
+                  'message.build', 'mailer.connect', 'mailer.sendmail'):
+        assert stages[stage]['count'] == 1
+
+    assert 'spool_stage_calls_total{stage="mailer.sendmail"} 1' in (
+        prom.read_text())
+
+
+def test_shards(smtp_server, tmp_path):
+
+    config = tmp_path / 'with_loop.yml'
+    config.write_text(WITH_LOOP)
+
+    for index in (1, 2):
+        with mock.patch('sys.argv', [
+            'spool', '--relay', smtp_server.host, '--port',
+            str(smtp_server.port), '--shard', f'{index}/2', str(config)
+        ]):
+            main.cli()
+
+    assert len(smtp_server.messages) == 3
+
+
+def test_tags(smtp_server, tmp_path):
+
+    config = tmp_path / 'tagged.yml'
+    config.write_text(WITH_LOOP + '''
+  - name: tagged
+    sender: sender@example.org
+    recipients: tagged@example.org
+    tags: [smoke]
+''')
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port',
+        str(smtp_server.port), '--tags', 'smoke', str(config)
+    ]):
+        main.cli()
+
+    assert len(smtp_server.messages) == 1
+
+
+@pytest.mark.parametrize('args, cached', [([], True),
+                                          (['--no-config-cache'], False)])
+def test_config_cache(smtp_server, tmp_path, cache_home, args, cached):
+
+    config = tmp_path / 'simple.yml'
+    config.write_text(SIMPLE)
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port',
+        str(smtp_server.port), *args, str(config)
+    ]):
+        main.cli()
+
+    assert len(smtp_server.messages) == 1
+    assert (cache_home / 'spool' / 'configs').exists() == cached
+
+
+def test_check(tmp_path, capsys):
+
+    valid = tmp_path / 'valid.yml'
+    valid.write_text(SIMPLE)
+    invalid = tmp_path / 'invalid.yml'
+    invalid.write_text(SIMPLE.replace('sender:', 'unknown:'))
+
+    with mock.patch('sys.argv', ['spool', '--check', '--jobs', '2',
+                                 str(valid), str(invalid)]):
+        with pytest.raises(SystemExit) as exc:
+            main.cli()
+
+    assert exc.value.code == 1
+    assert 'FAILED' in capsys.readouterr().out
+
+    with mock.patch('sys.argv', ['spool', '--check', str(valid)]):
+        main.cli()
+
+
+def test_msgid_domain(smtp_server, tmp_path):
+
+    config = tmp_path / 'simple.yml'
+    config.write_text(SIMPLE)
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port',
+        str(smtp_server.port), '--helo', 'mail.example.org',
+        '--msgid-domain', 'msgid.example.org', str(config)
+    ]), mock.patch('spool.message.fqdn') as fqdn, \
+            mock.patch('spool.mailer.helo_name') as helo_name:
+        main.cli()
+
+    fqdn.assert_not_called()
+    helo_name.assert_not_called()
+    assert '@msgid.example.org>' in smtp_server.messages[0]
+
+
+def test_files_share_mailer(smtp_server, tmp_path, caplog):
+
+    caplog.set_level(logging.INFO, logger='spool')
+    paths = []
+    for name in ('first.yml', 'second.yml'):
+        paths.append(tmp_path / name)
+        paths[-1].write_text(SIMPLE)
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port',
+        str(smtp_server.port), *map(str, paths)
+    ]):
+        main.cli()
+
+    assert len(smtp_server.messages) == 2
+    connects = [r for r in caplog.records
+                if r.getMessage().startswith('Connecting to remote server.')]
+    assert len(connects) == 1
+
+
+def test_generated_payloads(smtp_server, tmp_path):
+
+    config = tmp_path / 'generated.yml'
+    config.write_text(GENERATED)
+
+    with mock.patch('sys.argv', [
+        'spool', '--relay', smtp_server.host, '--port',
+        str(smtp_server.port), str(config)
+    ]):
+        main.cli()
+
+    received = message_from_string(
+        smtp_server.messages[0].replace('\r\n', '\n'))
+    body, attachment = received.get_payload()
+
+    assert body.get_payload(decode=True) == Payload(1000, 'lorem').read()
+    assert attachment.get_filename() == 'blob.bin'
+    assert attachment.get_payload(decode=True) == Payload(2048, seed=1).read()
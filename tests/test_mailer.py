@@ -1,11 +1,16 @@
 import logging
+import os
 import smtplib
+import time
+from email import message_from_string
 from unittest.mock import Mock, patch
 
 import dns
 import pytest
 
-from spool.mailer import MAIL_OUT_PREFIX, MAIL_OUT_SUFFIX, Mailer
+from spool.mailer import (MAIL_OUT_PREFIX, MAIL_OUT_SUFFIX, Mailer,
+                          RemoteNotFoundError, ResolverTimeoutError)
+from spool.hostname import fqdn, helo_name
 from spool.message import Message
 
 
@@ -180,3 +185,298 @@ def test_dump_to_console(mock_send, mailer, message, capsys):
     assert out.endswith(MAIL_OUT_SUFFIX + '\n')
 
     mock_send.assert_not_called()
+
+
+def count_connects(caplog):
+    return sum('Connecting to remote server.' in msg
+               for _, _, msg in caplog.record_tuples)
+
+
+def test_connection_reused(smtp_server, message, caplog):
+
+    caplog.set_level(logging.INFO, logger='spool')
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com') as mailer:
+        mailer.send(message)
+        mailer.send(message)
+        assert len(mailer.pool._idle[(smtp_server.host, smtp_server.port,
+                                      False)]) == 1
+
+    assert count_connects(caplog) == 1
+    assert len(smtp_server.messages) == 2
+    assert not mailer.pool._idle
+
+
+def test_connection_retired(smtp_server, message, caplog):
+
+    caplog.set_level(logging.INFO, logger='spool')
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', max_messages=1) as mailer:
+        mailer.send(message)
+        mailer.send(message)
+
+    assert count_connects(caplog) == 2
+    assert len(smtp_server.messages) == 2
+
+
+def test_idle_connection_closed(smtp_server, message, caplog):
+
+    caplog.set_level(logging.INFO, logger='spool')
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', idle_timeout=0) as mailer:
+        mailer.send(message)
+        mailer.send(message)
+
+    assert count_connects(caplog) == 2
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_disconnected_connection_discarded(mock_send, mailer, message):
+
+    mock_send.side_effect = smtplib.SMTPServerDisconnected()
+    mailer.send(message)
+
+    assert not any(mailer.pool._idle.values())
+
+
+def test_domains_delivered_in_parallel(smtp_server, caplog):
+
+    def get_remote(domain, lifetime=10.0):
+        time.sleep(0.2)
+        return smtp_server.host
+
+    message = Message(
+        name='test', sender='sender@example.org',
+        recipients='a@one.example, b@two.example, c@three.example',
+        headers={'Message-ID': None},
+    )
+
+    with Mailer(port=smtp_server.port, helo='mail.example.com') as mailer:
+        with patch.object(mailer, '_get_remote', side_effect=get_remote):
+            start = time.monotonic()
+            mailer.send(message)
+            elapsed = time.monotonic() - start
+
+    assert elapsed < 0.5
+    assert len(smtp_server.messages) == 3
+
+
+def test_domain_errors_reported_together(smtp_server, caplog):
+
+    def get_remote(domain, lifetime=10.0):
+        if domain == 'two.example':
+            raise ResolverTimeoutError('Query for mx record timed out.')
+        if domain == 'three.example':
+            raise RemoteNotFoundError('No mx record found for domain.')
+        return smtp_server.host
+
+    message = Message(
+        name='test', sender='sender@example.org',
+        recipients='a@one.example, b@two.example, c@three.example',
+        headers={'Message-ID': None},
+    )
+
+    with Mailer(port=smtp_server.port, helo='mail.example.com') as mailer:
+        with patch.object(mailer, '_get_remote', side_effect=get_remote):
+            mailer.send(message)
+
+    assert len(smtp_server.messages) == 1
+    _, severity, msg = caplog.record_tuples[-1]
+    assert severity == logging.ERROR
+    assert 'Failed to deliver message to 2 of 3 domains.' in msg
+    assert 'three.example, two.example' in msg
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_unexpected_domain_error_keeps_other_results(smtp_server, caplog,
+                                                     workers):
+
+    def get_remote(domain, lifetime=10.0):
+        if domain == 'two.example':
+            raise RuntimeError('boom')
+        return smtp_server.host
+
+    message = Message(
+        name='test', sender='sender@example.org',
+        recipients='a@one.example, b@two.example, c@three.example',
+        headers={'Message-ID': None},
+    )
+    queue = Mock()
+
+    with Mailer(port=smtp_server.port, helo='mail.example.com',
+                queue=queue, workers=workers) as mailer:
+        with patch.object(mailer, '_get_remote', side_effect=get_remote):
+            mailer.send(message)
+
+    assert len(smtp_server.messages) == 2
+    entry, _ = queue.put.call_args.args
+    assert (entry.domain, entry.recipients) == ('two.example',
+                                                ['b@two.example'])
+    _, severity, msg = caplog.record_tuples[-1]
+    assert severity == logging.ERROR
+    assert 'Failed to deliver message to 1 of 3 domains.' in msg
+
+
+def test_message_serialized_once(smtp_server, message):
+
+    message.recipients = [('', 'a@one.example'), ('', 'b@two.example')]
+
+    remote = patch.object(Mailer, '_get_remote',
+                          return_value=smtp_server.host)
+    build = patch.object(Message, '_build', autospec=True,
+                         side_effect=Message._build)
+
+    with remote, build as mock_build, Mailer(
+            port=smtp_server.port, helo='mail.example.com') as mailer:
+        mailer.send(message)
+
+    mock_build.assert_called_once()
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.messages[0] == smtp_server.messages[1]
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_scheduler_consulted_per_domain(mock_send, smtp_server, message):
+
+    scheduler = Mock()
+    message.recipients = [('', 'a@one.example'), ('', 'b@two.example'),
+                          ('', 'c@two.example')]
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', scheduler=scheduler) as mailer:
+        mailer.send(message)
+
+    assert [c.args for c in scheduler.acquire.call_args_list] == [
+        ('one.example',), ('two.example',)]
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_temporary_failure_queued(mock_send, smtp_server, message):
+
+    queue = Mock()
+    mock_send.side_effect = smtplib.SMTPDataError(451, b'Try again later')
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', queue=queue) as mailer:
+        mailer.send(message)
+
+    entry, data = queue.put.call_args.args
+    assert entry.host == smtp_server.host
+    assert entry.recipients == ['recipient@example.org', 'noreply@example.org']
+    assert entry.attempts == 1
+    assert entry.error == '451 Try again later'
+    assert data == message.as_bytes()
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_permanent_failure_not_queued(mock_send, smtp_server, message):
+
+    queue = Mock()
+    mock_send.side_effect = smtplib.SMTPDataError(554, b'Rejected')
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', queue=queue) as mailer:
+        mailer.send(message)
+
+    queue.put.assert_not_called()
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_temporarily_refused_recipients_queued(mock_send, smtp_server,
+                                               message):
+
+    queue = Mock()
+    mock_send.return_value = {'noreply@example.org': (450, b'Mailbox busy')}
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', queue=queue) as mailer:
+        mailer.send(message)
+
+    entry, _ = queue.put.call_args.args
+    assert entry.recipients == ['noreply@example.org']
+
+
+
+@patch.object(smtplib.SMTP, 'connect')
+def test_unreachable_host_queued(mock_connect, message):
+
+    queue = Mock()
+    mock_connect.side_effect = OSError(113, 'No route to host')
+
+    with Mailer(relay='127.0.0.1', helo='mail.example.com',
+                queue=queue) as mailer:
+        mailer.send(message)
+
+    entry, _ = queue.put.call_args.args
+    assert entry.host == '127.0.0.1'
+    assert entry.recipients == ['recipient@example.org', 'noreply@example.org']
+    assert 'No route to host' in entry.error
+
+
+@patch.object(smtplib.SMTP, 'sendmail')
+def test_connection_reset_queued(mock_send, smtp_server, message):
+
+    queue = Mock()
+    mock_send.side_effect = ConnectionResetError(104, 'Connection reset')
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com', queue=queue) as mailer:
+        mailer.send(message)
+
+        assert not mailer.pool._idle
+
+    entry, _ = queue.put.call_args.args
+    assert entry.recipients == ['recipient@example.org', 'noreply@example.org']
+    assert 'Connection reset' in entry.error
+
+
+def test_helo_name_resolved_once():
+
+    helo_name.cache_clear()
+    fqdn.cache_clear()
+
+    with patch('socket.getfqdn', return_value='host.example.org') as getfqdn:
+        names = {Mailer().helo for _ in range(3)}
+
+    helo_name.cache_clear()
+    fqdn.cache_clear()
+    assert names == {'host.example.org'}
+    assert getfqdn.call_count == 1
+
+
+def test_large_attachment_streamed(smtp_server, tmp_path, monkeypatch):
+
+    monkeypatch.setattr('spool.message.STREAM_THRESHOLD', 1024)
+    path = tmp_path / 'large.bin'
+    path.write_bytes(os.urandom(200 * 1024))
+
+    msg = Message(name='test', sender='sender@example.org',
+                  recipients='recipient@example.org',
+                  headers={'Message-ID': None},
+                  text_body='.leading period\n')
+    msg.attach(path)
+
+    with Mailer(relay=smtp_server.host, port=smtp_server.port,
+                helo='mail.example.com') as mailer:
+        mailer.send(msg)
+
+    received = message_from_string(
+        smtp_server.messages[0].replace('\r\n', '\n'))
+    body, attachment = received.get_payload()
+    assert body.get_payload(decode=True) == b'.leading period\n'
+    assert attachment.get_payload(decode=True) == path.read_bytes()
+
+
+def test_rejected_connection(rejecting_server, message, caplog):
+
+    with Mailer(relay=rejecting_server.host, port=rejecting_server.port,
+                helo='mail.example.com') as mailer:
+        mailer.send(message)
+        mailer.send(message)
+
+        assert not mailer.pool._idle
+
+    errors = [msg for _, severity, msg in caplog.record_tuples
+              if severity == logging.ERROR]
+    assert len(errors) == 2
+    assert '554 - go away' in errors[0]
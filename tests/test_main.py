@@ -1,6 +1,36 @@
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
 import pytest
 
-from spool.main import tags_matches_mail
+from spool.mailer import Mailer
+from spool.main import (bench_mails, check_configurations, check_report,
+                        parse_files, prefetch, process_message,
+                        tags_matches_mail)
+from spool.parser import Shard
+from spool.smime import KeyStore
+
+EXAMPLE_DIR = Path(__file__).parent / '../examples'
+
+VALID = '''\
+---
+mails:
+  - name: valid
+    sender: sender@example.org
+    recipients: '{{ item }}@example.org'
+    loop: [a, b]
+'''
+
+INVALID = '''\
+---
+mails:
+  - name: invalid
+    recipients: recipient@example.org
+'''
 
 
 @pytest.mark.parametrize('tags, mail, expected', [
@@ -21,3 +51,188 @@ from spool.main import tags_matches_mail
 ])
 def test_tags_matches_mail(tags, mail, expected):
     assert tags_matches_mail(tags, mail) == expected
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_check_configurations(tmp_path, jobs):
+
+    paths = []
+    for name, content in [('a.yml', VALID), ('b.yml', INVALID),
+                          ('c.yml', VALID)]:
+        paths.append(tmp_path / name)
+        paths[-1].write_text(content)
+    paths.append(tmp_path / 'missing.yml')
+
+    results = check_configurations(paths, jobs)
+
+    assert [path for path, _, _, _ in results] == paths
+    assert [count for _, count, _, _ in results] == [2, 0, 2, 0]
+    assert [bool(error) for _, _, error, _ in results] == [
+        False, True, False, True]
+
+    report = check_report(results).splitlines()
+    assert report[0].startswith('OK ')
+    assert report[1].startswith(f'FAILED {paths[1]}')
+    assert report[-1].startswith('4 files checked, 2 failed')
+
+
+
+def test_check_invalid_loop_row(tmp_path):
+
+    (tmp_path / 'recipients.jsonl').write_text(
+        '{"address": "a@example.org"}\n{"address": "b@example.org"\n')
+    path = tmp_path / 'config.yml'
+    path.write_text('''\
+---
+mails:
+  - sender: sender@example.org
+    recipients: '{{ item.address }}'
+    loop:
+      file: recipients.jsonl
+''')
+
+    # the rows of other shards are read as well
+    for shard in [None, Shard(1, 2), Shard(2, 2)]:
+        (_, _, error, _), = check_configurations([path], shard=shard)
+        assert error.startswith('Invalid row in loop file')
+        assert error.endswith('recipients.jsonl, line=2]')
+
+
+def test_heavy_dependencies_imported_lazily(tmp_path):
+
+    config = tmp_path / 'config.yml'
+    config.write_text(VALID)
+
+    script = (
+        'import sys\n'
+        'from spool import main\n'
+        f'sys.argv = ["spool", "--check", "--no-config-cache", "{config}"]\n'
+        'main.run()\n'
+        'print(" ".join(sorted(sys.modules)))\n'
+    )
+    proc = subprocess.run([sys.executable, '-c', script], check=True,
+                          capture_output=True, text=True,
+                          cwd=Path(__file__).parent.parent)
+    modules = {module.split('.')[0] for module in proc.stdout.split()}
+
+    for module in ('cerberus', 'cryptography', 'dkim', 'dns', 'gnupg'):
+        assert module not in modules
+
+
+def test_prefetch():
+    assert list(prefetch(iter(range(10)), size=2)) == list(range(10))
+
+
+def test_prefetch_raises_errors_in_order():
+
+    def produce():
+        yield 1
+        raise ValueError('broken')
+
+    items = prefetch(produce())
+
+    assert next(items) == 1
+    with pytest.raises(ValueError, match='broken'):
+        next(items)
+
+
+def test_prefetch_stopped_early():
+
+    produced = []
+
+    def produce():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    items = prefetch(produce())
+    assert next(items) == 0
+    items.close()
+    time.sleep(0.3)
+
+    assert len(produced) < 5
+
+
+def test_parse_files_read_once(monkeypatch):
+    keystore = KeyStore()
+    monkeypatch.setattr('spool.smime.KEYSTORE', keystore)
+    path = EXAMPLE_DIR / 'smime.yml'
+
+    for _ in range(3):
+        mail = parse_files(path, {'smime': {
+            'from_key_file': 'smime/sender.key.pem',
+            'to_crts_file': 'smime/recipient.crt.pem',
+        }})
+
+    assert mail['smime'] == {
+        'from_key': (EXAMPLE_DIR / 'smime/sender.key.pem').read_text(),
+        'to_crts': (EXAMPLE_DIR / 'smime/recipient.crt.pem').read_text(),
+    }
+    assert (keystore.hits, keystore.misses) == (4, 2)
+
+
+def test_payload_error_logged(tmp_path, caplog):
+
+    mail = {
+        'name': 'binary-body',
+        'sender': 'sender@example.org',
+        'recipients': 'recipient@example.org',
+        'headers': {'Message-ID': '<1@example.org>'},
+        'text_body': {'generate': {'size': 10, 'kind': 'random'}},
+    }
+
+    process_message(Mailer(helo='mail.example.org'), mail,
+                    tmp_path / 'config.yml', print_only=True)
+
+    _, severity, msg = caplog.record_tuples[-1]
+    assert severity == logging.ERROR
+    assert 'Random payloads are binary' in msg
+
+
+@pytest.mark.parametrize('dkim', [
+    {'privkey': 'invalid'},
+    {'privkey': 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=', 'canonicalize': 'strict'},
+])
+def test_dkim_error_logged(tmp_path, caplog, dkim):
+
+    mail = {
+        'name': 'bad-dkim',
+        'sender': 'sender@example.org',
+        'recipients': 'recipient@example.org',
+        'headers': {'Message-ID': '<1@example.org>'},
+        'text_body': 'Hello',
+        'dkim': dict({'domain': 'example.org', 'selector': 'spool'}, **dkim),
+    }
+
+    process_message(Mailer(helo='mail.example.org'), mail,
+                    tmp_path / 'config.yml', print_only=True)
+
+    _, severity, msg = caplog.record_tuples[-1]
+    assert severity == logging.ERROR
+    assert msg.startswith('Failed to create message: Invalid')
+
+
+def test_bench_mails_stop_at_deadline():
+
+    first, second = Mock(), Mock()
+    first.iter_mails.return_value = iter([{'name': 'a'}, {'name': 'b'}])
+    second.iter_mails.return_value = iter([{'name': 'c'}])
+
+    deadline = time.monotonic() + 60
+    mails = bench_mails([('a.yml', first), ('b.yml', second)],
+                        deadline=deadline)
+
+    assert next(mails) == ('a.yml', {'name': 'a'})
+    with patch('time.monotonic', return_value=deadline):
+        assert list(mails) == []
+
+    second.iter_mails.assert_not_called()
+
+
+def test_bench_mails_repeat():
+
+    config = Mock()
+    config.iter_mails.side_effect = lambda: iter([{'name': 'a'}])
+
+    assert list(bench_mails([('a.yml', config)], repeat=3)) == [
+        ('a.yml', {'name': 'a'})] * 3
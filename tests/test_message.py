@@ -1,8 +1,20 @@
+import os
+import re
+from email import message_from_bytes
 from email.parser import HeaderParser
+from pathlib import Path
+from unittest.mock import patch
 
+import dkim
 import pytest
+import yaml
 
-from spool.message import Message, parse_addrs
+from spool.hostname import fqdn
+from spool.message import AttachmentCache, Message, parse_addrs
+from spool.payload import Payload
+from spool.wire import WireStream
+
+EXAMPLE_DIR = Path(__file__).parent / '../examples'
 
 combinations = [
     (
@@ -88,3 +100,264 @@ recipients = [
 @pytest.mark.parametrize('recipients, parsed', recipients)
 def test_parse_addrs(recipients, parsed):
     assert parsed == parse_addrs(recipients)
+
+
+@pytest.fixture()
+def message():
+    return Message(
+        name='test', sender='sender@example.org',
+        recipients='recipient@example.org',
+        headers={'Message-ID': '<1@example.org>'},
+        text_body='Hello',
+    )
+
+
+def test_as_bytes_memoized(message):
+    wire = message.as_bytes()
+
+    assert isinstance(wire, bytes)
+    assert b'\r\n' in wire and b'\n' not in wire.replace(b'\r\n', b'')
+    assert message.as_bytes() is wire
+
+
+def test_as_bytes_invalidated_on_change(message, tmp_path):
+    wire = message.as_bytes()
+
+    message.subject = 'Changed'
+    changed = message.as_bytes()
+    assert changed is not wire
+    assert b'Changed' in changed
+
+    attachment = tmp_path / 'test.txt'
+    attachment.write_text('attached')
+    message.attach(attachment)
+    assert b'filename="test.txt"' in message.as_bytes()
+
+
+def test_as_string_matches_as_bytes(message):
+    assert message.as_string() == message.as_bytes().decode().replace(
+        '\r\n', '\n')
+
+
+
+def test_8bit_eml(tmp_path):
+
+    eml = tmp_path / 'mail.eml'
+    eml.write_text('Subject: Hello\n'
+                   'Content-Type: text/plain; charset=utf-8\n'
+                   'Content-Transfer-Encoding: 8bit\n'
+                   '\n'
+                   'Hällo Wörld\n'
+                   'Grüße\n', encoding='utf-8')
+
+    message = Message(name='test', sender='sender@example.org',
+                      recipients='recipient@example.org', eml=str(eml))
+
+    assert message.as_bytes().endswith('Hällo Wörld\r\nGrüße'.encode())
+    assert message.as_string().endswith('Hällo Wörld\nGrüße')
+
+
+def test_dkim_signature_prepended():
+    config = yaml.safe_load((EXAMPLE_DIR / 'dkim.yml').read_text())
+    record = (EXAMPLE_DIR / 'dkim.dns').read_text()
+    public_key = ''.join(re.findall(r'"([^"]*)"', record)).encode()
+
+    message = Message(
+        name='test', sender='sender@example.org',
+        recipients='recipient@example.org',
+        headers={'Message-ID': '<1@example.org>'},
+        text_body='Hello',
+        dkim=config['mails'][0]['dkim'],
+    )
+    wire = message.as_bytes()
+
+    assert wire.startswith(b'DKIM-Signature:')
+    assert dkim.verify(wire, dnsfunc=lambda name, timeout=5: public_key)
+
+
+def test_dkim_sign_again():
+    config = yaml.safe_load((EXAMPLE_DIR / 'dkim.yml').read_text())
+    record = (EXAMPLE_DIR / 'dkim.dns').read_text()
+    public_key = ''.join(re.findall(r'"([^"]*)"', record)).encode()
+    settings = dict(config['mails'][0]['dkim'])
+
+    message = Message(
+        name='test', sender='sender@example.org',
+        recipients='recipient@example.org',
+        text_body='Hello',
+        dkim=settings,
+    )
+    message.as_bytes()
+
+    # a change rebuilds the message and signs it again
+    message.subject = 'Changed'
+    wire = message.as_bytes()
+
+    assert message.dkim == config['mails'][0]['dkim']
+    assert dkim.verify(wire, dnsfunc=lambda name, timeout=5: public_key)
+
+
+def test_message_id_domain():
+
+    msg = Message(name='test', sender='sender@example.org',
+                  recipients='recipient@example.org',
+                  msgid_domain='msgid.example.org')
+
+    with patch('socket.getfqdn') as getfqdn:
+        message_id = msg.headers['Message-ID']
+
+    getfqdn.assert_not_called()
+    assert message_id.endswith('@msgid.example.org>')
+
+
+def test_message_id_hostname_resolved_once():
+
+    fqdn.cache_clear()
+    msg = Message(name='test', sender='sender@example.org',
+                  recipients='recipient@example.org')
+
+    with patch('socket.getfqdn', return_value='host.example.org') as getfqdn:
+        message_ids = {msg.headers['Message-ID'] for _ in range(3)}
+
+    fqdn.cache_clear()
+    assert getfqdn.call_count == 1
+    assert len(message_ids) == 3
+    assert all(m.endswith('@host.example.org>') for m in message_ids)
+
+
+@pytest.fixture()
+def attachments():
+    return AttachmentCache(max_bytes=1024)
+
+
+def test_attachment_cache_hit(attachments, tmp_path):
+
+    path = tmp_path / 'test.txt'
+    path.write_text('Hello')
+
+    first = attachments.part(path)
+    second = attachments.part(path)
+
+    assert (attachments.hits, attachments.misses) == (1, 1)
+    assert first is not second
+    assert first.get_payload() is second.get_payload()
+    assert first.get_filename() == 'test.txt'
+
+    first['X-Changed'] = 'yes'
+    assert 'X-Changed' not in second
+
+
+def test_attachment_cache_changed_file(attachments, tmp_path):
+
+    path = tmp_path / 'test.txt'
+    path.write_text('Hello')
+    attachments.part(path)
+
+    path.write_text('Hello, changed')
+
+    assert 'SGVsbG8sIGNoYW5nZWQ=' in attachments.part(path).get_payload()
+    assert attachments.misses == 2
+
+
+def test_attachment_cache_evicts_least_recently_used(attachments, tmp_path):
+
+    paths = []
+    for name in 'abc':
+        paths.append(tmp_path / f'{name}.bin')
+        paths[-1].write_bytes(name.encode() * 300)
+
+    attachments.part(paths[0])
+    attachments.part(paths[1])
+    attachments.part(paths[0])
+    attachments.part(paths[2])
+
+    assert len(attachments) == 2
+    assert attachments.size <= attachments.max_bytes
+
+    attachments.part(paths[0])
+    attachments.part(paths[1])
+    assert (attachments.hits, attachments.misses) == (2, 4)
+
+
+def test_attachment_larger_than_budget_not_cached(attachments, tmp_path):
+
+    path = tmp_path / 'large.bin'
+    path.write_bytes(b'x' * 2048)
+
+    attachments.part(path)
+
+    assert len(attachments) == 0 and attachments.size == 0
+
+
+@pytest.fixture()
+def large_attachment(tmp_path, monkeypatch):
+    monkeypatch.setattr('spool.message.STREAM_THRESHOLD', 1024)
+    path = tmp_path / 'large.bin'
+    path.write_bytes(os.urandom(4096))
+    return path
+
+
+def test_large_attachment_streamed(message, large_attachment):
+
+    message.attach(large_attachment)
+    stream = message.as_stream()
+
+    assert isinstance(stream, WireStream)
+    assert message.as_stream() is stream
+    assert stream.sources == [large_attachment]
+
+    parsed = message_from_bytes(bytes(stream))
+    attachment = parsed.get_payload()[1]
+    assert attachment.get_filename() == 'large.bin'
+    assert attachment.get_payload(decode=True) == large_attachment.read_bytes()
+
+
+def test_signed_message_not_streamed(message, large_attachment):
+
+    config = yaml.safe_load((EXAMPLE_DIR / 'dkim.yml').read_text())
+    message.dkim = config['mails'][0]['dkim']
+    message.attach(large_attachment)
+
+    assert message.as_stream() == message.as_bytes()
+
+
+def test_generated_attachment(message):
+    payload = Payload(3000, seed=1, name='blob.bin')
+    message.attach(payload)
+
+    parsed = message_from_bytes(message.as_bytes())
+    attachment = parsed.get_payload()[1]
+
+    assert message.as_stream() == message.as_bytes()
+    assert attachment.get_filename() == 'blob.bin'
+    assert attachment.get_content_type() == 'application/octet-stream'
+    assert attachment.get_payload(decode=True) == payload.read()
+
+
+def test_large_generated_attachment_streamed(message, monkeypatch):
+    monkeypatch.setattr('spool.message.STREAM_THRESHOLD', 1024)
+    payload = Payload(4096, 'text')
+    message.attach(payload)
+
+    stream = message.as_stream()
+
+    assert isinstance(stream, WireStream)
+    assert stream.sources == [payload]
+
+    parsed = message_from_bytes(bytes(stream))
+    attachment = parsed.get_payload()[1]
+    assert attachment.get_filename() == 'text-0.txt'
+    assert attachment.get_payload(decode=True) == payload.read()
+
+
+def test_generated_bodies():
+    text_body = Payload(500, 'lorem', seed=1)
+    html_body = Payload(800, 'text', seed=2)
+    message = Message('test', 'sender@example.org', 'recipient@example.org',
+                      text_body=text_body, html_body=html_body)
+
+    parsed = message_from_bytes(message.as_bytes())
+    text, html = parsed.get_payload()
+
+    assert text.get_payload(decode=True) == text_body.read()
+    assert html.get_payload(decode=True) == html_body.read()
@@ -0,0 +1,73 @@
+import pytest
+
+from spool import metrics
+
+
+@pytest.fixture()
+def registry():
+    yield metrics.enable()
+    metrics.disable()
+
+
+@metrics.timed('test.stage')
+def stage(value):
+    return value
+
+
+def test_disabled_by_default():
+
+    assert metrics.registry() is None
+    assert metrics.timer('test.stage') is metrics.NULL_TIMER
+    assert stage(42) == 42
+
+
+def test_timer(registry):
+
+    for _ in range(3):
+        with metrics.timer('test.stage'):
+            pass
+
+    stages = registry.to_dict()
+    assert stages['test.stage']['count'] == 3
+    assert stages['test.stage']['seconds'] >= stages['test.stage']['max']
+
+
+def test_timed(registry):
+
+    assert stage(42) == 42
+    assert registry.to_dict()['test.stage']['count'] == 1
+
+
+def test_timed_records_errors(registry):
+
+    @metrics.timed('test.error')
+    def fail():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fail()
+
+    assert registry.to_dict()['test.error']['count'] == 1
+
+
+def test_stages_in_pipeline_order(registry):
+
+    registry.add('mailer.sendmail', 1.0)
+    registry.add('other', 1.0)
+    registry.add('config.load', 1.0)
+
+    assert list(registry.to_dict()) == [
+        'config.load', 'mailer.sendmail', 'other']
+
+
+def test_prometheus(registry):
+
+    registry.add('config.load', 0.5)
+    registry.add('config.load', 1.5)
+
+    lines = registry.to_prometheus().splitlines()
+
+    assert '# TYPE spool_stage_seconds_total counter' in lines
+    assert 'spool_stage_seconds_total{stage="config.load"} 2.0' in lines
+    assert 'spool_stage_calls_total{stage="config.load"} 2' in lines
+    assert 'spool_stage_max_seconds{stage="config.load"} 1.5' in lines
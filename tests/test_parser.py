@@ -1,6 +1,13 @@
+import copy
+import csv
+from unittest.mock import patch
+
+import jinja2
 import pytest
+from cerberus import Validator
 
-from spool.parser import Config, ConfigError
+from spool.parser import (CONFIG_SCHEMA, Config, ConfigError, Shard,
+                          ValidationError, check_document, parse_tags)
 
 
 def test_empty_config():
@@ -72,3 +79,482 @@ def test_fail_eml_and_html_body_given():
                 'eml': 'mail.eml'
             }]
         })
+
+
+def test_loop_templates_compiled_once():
+
+    with patch.object(jinja2.Environment, 'from_string', autospec=True,
+                      side_effect=jinja2.Environment.from_string) as compile:
+        config = Config.load({
+            'mails': [{
+                'sender': '<sender@example.com>',
+                'recipients': '{{ item }}@example.com',
+                'subject': 'Hello {{ item|upper }}',
+                'text_body': 'Just a plain message.',
+                'loop': ['ben', 'karol', 'steve'],
+            }]
+        })
+
+    assert compile.call_count == 2
+    assert [mail['subject'] for mail in config.mails] == [
+        'Hello BEN', 'Hello KAROL', 'Hello STEVE']
+
+
+@pytest.mark.parametrize('text', [
+    'plain',
+    'trailing newline\n',
+    'two trailing newlines\n\n',
+    'windows\r\nline endings\r\n',
+    'old mac\rline endings',
+    '',
+])
+def test_plain_text_rendered_like_jinja(text):
+
+    config = Config.load({
+        'mails': [{
+            'sender': '<sender@example.com>',
+            'recipients': '<recipient@example.com>',
+            'text_body': text,
+        }]
+    })
+
+    expected = jinja2.Environment().from_string(text).render()
+    assert config.mails[0]['text_body'] == expected
+
+
+def test_mails_rendered_lazily():
+
+    config = Config.load({
+        'mails': [{
+            'sender': '<sender@example.com>',
+            'recipients': '{{ item }}@example.com',
+            'loop': ['ben', 'karol', 'steve'],
+        }]
+    })
+
+    with patch.object(Config, '_render_mail',
+                      side_effect=config._render_mail) as render:
+        mails = config.iter_mails()
+        assert next(mails)['recipients'] == 'ben@example.com'
+        assert render.call_count == 1
+
+        assert [m['recipients'] for m in mails] == [
+            'karol@example.com', 'steve@example.com']
+
+
+def test_templated_loop():
+
+    config = Config.load({
+        'vars': {'friends': ['ben', 'karol']},
+        'mails': [{
+            'sender': '<sender@example.com>',
+            'recipients': '{{ item }}@example.com',
+            'loop': '{{ friends }}',
+        }]
+    })
+
+    assert len(config.mails) == 2
+
+
+def test_mails_normalized():
+
+    config = Config.load({
+        'mails': [{
+            'sender': '<sender@example.com>',
+            'recipients': '<recipient@example.com>',
+            'from': '{{ "Sender" }} <sender@example.com>',
+            'tags': 'one, {{ "two" }}',
+        }]
+    })
+
+    mail = config.mails[0]
+    assert mail['from_addr'] == 'Sender <sender@example.com>'
+    assert mail['tags'] == ['one', 'two']
+    assert 'from' not in mail
+
+
+def test_fail_invalid_definition_in_loop():
+    with pytest.raises(ConfigError):
+        Config.load({
+            'mails': [{
+                'sender': '<sender@example.com>',
+                'recipients': '{{ item }}@example.com',
+                'subject': ['not', 'a', 'string'],
+                'loop': ['ben', 'karol'],
+            }]
+        })
+
+
+@pytest.mark.parametrize('config', [
+    {},
+    {'mails': []},
+    {'defaults': {'any': 'thing'}, 'vars': {'any': ['thing']}},
+    {'mails': [{'sender': 's', 'recipients': ['r'], 'loop': '{{ items }}'}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'headers': {'X-A': None}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'eml': {'template': 't'}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'tags': ['a', 'b']}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'tags': [['a']]}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'tags': None}]},
+    {'mails': 'not a list'},
+    {'mails': [{'sender': 's'}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'unknown': 'field'}]},
+    {'mails': [{'sender': None, 'recipients': 'r'}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'headers': {'X-A': []}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'eml': {'other': 't'}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'loop': {}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'eml': 'e', 'ical': 'i'}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'smime': {'from_crt': 'c', 'from_crt_file': 'f'}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r', 'dkim': {'key': 'k'}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'dkim': {'canonicalize': 'relaxed', 'headers': ['from']}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'dkim': {'canonicalize': 'loose'}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'text_body': {'generate': {'size': '5MB', 'seed': 1}},
+                'attachments': ['a', {'generate': {'size': 10}}]}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'attachments': {'generate': {'size': 10, 'kind': 'text'}}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'text_body': {'generate': {'seed': 1}}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'html_body': {'generate': {'size': 1, 'kind': 'zeros'}}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'text_body': {'generate': {'size': 1, 'kind': 'random'}}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'attachments': {'generate': {'size': 1, 'kind': 'random'}}}]},
+    {'mails': [{'sender': 's', 'recipients': 'r',
+                'attachments': [{'size': 10}]}]},
+    {'unknown': {}},
+])
+def test_compiled_schema_agrees_with_cerberus(config):
+    expected = Validator().validate(config, CONFIG_SCHEMA, normalize=False)
+    assert check_document(config) == expected
+
+
+def test_validation_error_from_cerberus():
+
+    with pytest.raises(ValidationError) as error:
+        Config.load({'mails': [{'sender': 's'}, {'recipients': 'r'}]})
+
+    assert error.value.args[0] == {
+        'mails': [{
+            0: [{'recipients': ['required field']}],
+            1: [{'sender': ['required field']}],
+        }]
+    }
+
+
+LOOP_FILES = {
+    'recipients.csv': 'name,address\nBen,ben@example.com\n'
+                      'Karol,karol@example.com\n',
+    'recipients.jsonl': '{"name": "Ben", "address": "ben@example.com"}\n\n'
+                        '{"name": "Karol", "address": "karol@example.com"}\n',
+    'recipients.yml': '---\nname: Ben\naddress: ben@example.com\n'
+                      '---\nname: Karol\naddress: karol@example.com\n',
+}
+
+
+@pytest.mark.parametrize('name', LOOP_FILES)
+def test_loop_over_file(tmp_path, name):
+
+    (tmp_path / name).write_text(LOOP_FILES[name])
+    config_file = tmp_path / 'config.yml'
+    config_file.write_text(f'''
+mails:
+  - sender: sender@example.com
+    recipients: '{{{{ item.address }}}}'
+    subject: 'Hello {{{{ item.name }}}}'
+    loop:
+      file: {name}
+''')
+
+    config = Config.load(config_file)
+
+    assert [mail['recipients'] for mail in config.iter_mails()] == [
+        'ben@example.com', 'karol@example.com']
+    assert config.mails[1]['subject'] == 'Hello Karol'
+
+
+def test_loop_file_format(tmp_path):
+
+    (tmp_path / 'recipients.txt').write_text(LOOP_FILES['recipients.jsonl'])
+
+    config = Config({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': '{{ item.address }}',
+            'loop': {'file': 'recipients.txt', 'format': 'jsonl'},
+        }]
+    }, tmp_path / 'config.yml')
+
+    assert len(config.mails) == 2
+
+
+def test_loop_file_streamed(tmp_path):
+
+    with open(tmp_path / 'recipients.csv', 'w') as fh:
+        fh.write('address\n')
+        for i in range(1000):
+            fh.write(f'user{i}@example.com\n')
+
+    config = Config({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': '{{ item.address }}',
+            'loop': {'file': 'recipients.csv'},
+        }]
+    }, tmp_path / 'config.yml')
+
+    with patch('csv.DictReader.__next__', autospec=True,
+               side_effect=csv.DictReader.__next__) as read:
+        assert next(config.iter_mails())['recipients'] == 'user0@example.com'
+
+    assert read.call_count == 1
+
+
+@pytest.mark.parametrize('loop', [
+    {'file': 'missing.csv'},
+    {'file': 'recipients.txt'},
+    {'file': 'recipients.csv', 'format': 'xml'},
+])
+def test_fail_invalid_loop_file(tmp_path, loop):
+
+    (tmp_path / 'recipients.txt').write_text('')
+
+    with pytest.raises(ConfigError):
+        Config({
+            'mails': [{
+                'sender': 'sender@example.com',
+                'recipients': '{{ item.address }}',
+                'loop': loop,
+            }]
+        }, tmp_path / 'config.yml')
+
+
+
+@pytest.mark.parametrize('name, content, line', [
+    ('recipients.csv',
+     'address\nben@example.com\n"' + 'x' * csv.field_size_limit() + '\n', 3),
+    ('recipients.jsonl', '{"address": "ben@example.com"}\n\n{"address"\n',
+     3),
+    ('recipients.yml', '---\naddress: ben@example.com\n---\naddress: [\n',
+     5),
+])
+def test_fail_invalid_loop_row(tmp_path, name, content, line):
+
+    (tmp_path / name).write_text(content)
+
+    config = Config({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': '{{ item.address }}',
+            'loop': {'file': name},
+        }]
+    }, tmp_path / 'config.yml')
+
+    mails = config.iter_mails()
+    assert next(mails)['recipients'] == 'ben@example.com'
+
+    with pytest.raises(ConfigError, match=rf'path=.*{name}, line={line}\]'):
+        next(mails)
+
+
+def test_fail_loop_file_encoding(tmp_path):
+
+    (tmp_path / 'recipients.csv').write_bytes(b'address\n\xff@example.com\n')
+
+    config = Config({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': '{{ item.address }}',
+            'loop': {'file': 'recipients.csv'},
+        }]
+    }, tmp_path / 'config.yml')
+
+    with pytest.raises(ConfigError, match='not UTF-8'):
+        list(config.iter_mails())
+
+
+@pytest.mark.parametrize('value', ['0/2', '3/2', '1', 'a/b', '1/0'])
+def test_fail_invalid_shard(value):
+    with pytest.raises(ValueError):
+        Shard.parse(value)
+
+
+def test_shards_send_every_mail_once(tmp_path):
+
+    definition = {
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': 'single@example.com',
+        }, {
+            'sender': 'sender@example.com',
+            'recipients': 'user{{ item }}@example.com',
+            'loop': list(range(100)),
+        }]
+    }
+
+    def recipients(shard):
+        config = Config(copy.deepcopy(definition), tmp_path / 'config.yml',
+                        shard)
+        return [mail['recipients'] for mail in config.iter_mails()]
+
+    everything = recipients(None)
+    shards = [recipients(Shard(index, 3)) for index in range(1, 4)]
+
+    assert sorted(sum(shards, [])) == sorted(everything)
+    assert all(shards)
+    assert shards == [recipients(Shard(index, 3)) for index in range(1, 4)]
+
+
+def test_other_shards_not_rendered():
+
+    config = Config.load({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': 'user{{ item }}@example.com',
+            'loop': list(range(100)),
+        }]
+    }, Shard(1, 4))
+
+    with patch.object(Config, '_render_mail',
+                      side_effect=config._render_mail) as render:
+        mails = list(config.iter_mails())
+
+    assert render.call_count == len(mails) < 50
+
+
+
+def test_other_shards_loop_items_not_rendered():
+
+    config = Config.load({
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': 'user{{ item.id }}@example.com',
+            'loop': [{'id': '{{ %d }}' % number} for number in range(100)],
+        }]
+    }, Shard(1, 4))
+
+    with patch.object(Config, '_render',
+                      side_effect=config._render) as render:
+        mails = list(config.iter_mails())
+
+    items = [call for call in render.call_args_list
+             if isinstance(call.args[0], dict)]
+    assert len(items) == len(mails) < 50
+
+
+def test_parse_tags():
+    assert parse_tags(None) is None
+    assert parse_tags('') is None
+    assert parse_tags('a, b') == {'a', 'b'}
+
+
+def test_tags_select_mails():
+
+    config = Config.load({
+        'defaults': {
+            'sender': 'sender@example.com',
+        },
+        'mails': [{
+            'name': 'smoke',
+            'recipients': 'smoke@example.com',
+            'tags': ['smoke'],
+        }, {
+            'name': 'other',
+            'recipients': 'other@example.com',
+            'tags': 'dkim, other',
+        }, {
+            'name': 'untagged',
+            'recipients': 'untagged@example.com',
+        }]
+    }, tags=parse_tags('smoke,dkim'))
+
+    assert [mail['name'] for mail in config.iter_mails()] == [
+        'smoke', 'other']
+
+
+
+@pytest.mark.parametrize('value', [None, 5, [['smoke']], [5]])
+@pytest.mark.parametrize('tags', [None, 'smoke'])
+def test_fail_invalid_tags(value, tags):
+
+    with pytest.raises(ValidationError):
+        Config.load({
+            'mails': [{
+                'sender': 'sender@example.com',
+                'recipients': 'smoke@example.com',
+                'tags': value,
+            }]
+        }, tags=parse_tags(tags))
+
+
+def test_excluded_mails_not_validated():
+
+    config = Config.load({
+        'mails': [{
+            'name': 'selected',
+            'sender': 'sender@example.com',
+            'recipients': 'rcpt@example.com',
+            'tags': ['smoke'],
+        }, {
+            'name': 'excluded',
+            'sender': 'sender@example.com',
+            'recipients': 'rcpt@example.com',
+            'unknown': '{{ broken',
+        }]
+    }, tags=parse_tags('smoke'))
+
+    assert [mail['name'] for mail in config.iter_mails()] == ['selected']
+
+
+def test_templated_tags_checked_after_render():
+
+    config = Config.load({
+        'vars': {
+            'tag': 'smoke',
+        },
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': 'user{{ item }}@example.com',
+            'tags': ['{{ tag if item < 2 else "other" }}'],
+            'loop': [0, 1, 2, 3],
+        }]
+    }, tags=parse_tags('smoke'))
+
+    assert [mail['recipients'] for mail in config.iter_mails()] == [
+        'user0@example.com', 'user1@example.com']
+
+
+def test_tags_keep_shards():
+
+    definition = {
+        'mails': [{
+            'sender': 'sender@example.com',
+            'recipients': 'user{{ item }}@example.com',
+            'loop': list(range(20)),
+        }, {
+            'sender': 'sender@example.com',
+            'recipients': 'tagged{{ item }}@example.com',
+            'tags': ['smoke'],
+            'loop': list(range(20)),
+        }]
+    }
+
+    def recipients(tags):
+        config = Config.load(copy.deepcopy(definition), Shard(1, 2), tags)
+        return [mail['recipients'] for mail in config.iter_mails()
+                if mail['recipients'].startswith('tagged')]
+
+    assert recipients(parse_tags('smoke')) == recipients(None)
+
+
+def test_random_body_rejected():
+
+    with pytest.raises(ValidationError):
+        Config.load({'mails': [{
+            'sender': 's',
+            'recipients': 'r',
+            'text_body': {'generate': {'size': 10, 'kind': 'random'}},
+        }]})
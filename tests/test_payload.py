@@ -0,0 +1,87 @@
+import zlib
+
+import pytest
+
+from spool.payload import Payload, PayloadError, parse_size
+
+
+@pytest.mark.parametrize('value, expected', [
+    (100, 100),
+    ('100', 100),
+    ('5MB', 5000000),
+    ('5 mb', 5000000),
+    ('1.5KiB', 1536),
+    ('2GiB', 2 * 1024**3),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize('value', ['', 'large', '5XB', -1, True])
+def test_parse_size_invalid(value):
+    with pytest.raises(PayloadError):
+        parse_size(value)
+
+
+@pytest.mark.parametrize('kind', ['random', 'text', 'lorem'])
+@pytest.mark.parametrize('size', [0, 1, 4095, 4096, 3 * 1024 * 1024 + 7])
+def test_payload_size(kind, size):
+    payload = Payload(size, kind)
+
+    chunks = list(payload.chunks(1024 * 1024))
+
+    assert sum(len(chunk) for chunk in chunks) == size
+    assert all(len(chunk) == 1024 * 1024 for chunk in chunks[:-1])
+
+
+@pytest.mark.parametrize('kind', ['random', 'text', 'lorem'])
+def test_payload_reproducible(kind):
+    first = Payload(100000, kind, seed=1).read()
+
+    assert Payload(100000, kind, seed=1).read() == first
+    assert Payload(100000, kind, seed=2).read() != first
+    assert b''.join(Payload(100000, kind, seed=1).chunks(57 * 3)) == first
+
+
+def test_payload_entropy():
+    size = 1024 * 1024
+    compressed = {kind: len(zlib.compress(Payload(size, kind).read()))
+                  for kind in ('random', 'text', 'lorem')}
+
+    assert compressed['random'] > size
+    assert compressed['text'] < size / 100
+    assert compressed['text'] < compressed['lorem'] < size / 2
+
+
+def test_payload_text():
+    text = Payload(1000, 'lorem').text()
+
+    assert len(text) == 1000
+    assert text.startswith(text[0].upper())
+
+    with pytest.raises(PayloadError):
+        Payload(1000, 'random').text()
+
+
+def test_payload_from_config():
+    payload = Payload.from_config(
+        {'generate': {'size': '2KiB', 'seed': 3, 'name': 'data.txt'}},
+        kind='text')
+
+    assert payload.size == 2048
+    assert payload.kind == 'text'
+    assert payload.seed == 3
+    assert payload.name == 'data.txt'
+    assert payload.content_type == 'text/plain'
+
+
+def test_payload_defaults():
+    payload = Payload(1)
+
+    assert payload.name == 'random-0.bin'
+    assert payload.content_type == 'application/octet-stream'
+
+
+def test_payload_unknown_kind():
+    with pytest.raises(PayloadError):
+        Payload(1, 'zeros')
@@ -0,0 +1,174 @@
+from email.mime.base import MIMEBase
+
+import pytest
+
+from spool.mailer import Mailer
+from spool.queue import MailQueue, QueueEntry, QueueError
+from spool.wire import WireStream
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def queue(tmp_path, clock):
+    return MailQueue(tmp_path, base_delay=60, max_delay=600, max_attempts=3,
+                     clock=clock)
+
+
+def entry(**kwargs):
+    kwargs.setdefault('name', 'test')
+    kwargs.setdefault('sender', 'sender@example.org')
+    kwargs.setdefault('recipients', ['rcpt@example.org'])
+    return QueueEntry(**kwargs)
+
+
+def test_put_and_get(queue, tmp_path):
+
+    queue.put(entry(), b'data')
+
+    assert len(queue) == 1
+    assert len(list((tmp_path / 'queue').iterdir())) == 2
+
+    queued = queue.get()
+    assert queued.recipients == ['rcpt@example.org']
+    assert queue.read(queued) == b'data'
+    assert queue.get() is None
+
+
+def test_get_in_order_of_due_time(queue, clock):
+
+    queue.put(entry(name='later', next_attempt=clock.now + 30), b'')
+    queue.put(entry(name='first', next_attempt=clock.now - 10), b'')
+    queue.put(entry(name='second', next_attempt=clock.now), b'')
+
+    assert queue.get().name == 'first'
+    assert queue.get().name == 'second'
+    assert queue.get() is None
+    assert queue.next_due() == 30
+
+    clock.now += 30
+    assert queue.get().name == 'later'
+
+
+def test_failed_attempt_is_delayed(queue, clock):
+
+    queue.put(entry(attempts=1), b'')
+
+    assert queue.get() is None
+    assert 30 <= queue.next_due() <= 61
+
+
+def test_backoff_is_exponential_and_capped(queue):
+
+    for attempts, delay in [(1, 60), (2, 120), (3, 240), (5, 600), (9, 600)]:
+        assert delay / 2 <= queue.backoff(attempts) <= delay
+
+
+def test_defer(queue, clock):
+
+    queue.put(entry(recipients=['a@example.org', 'b@example.org']), b'')
+    queued = queue.get()
+
+    queue.defer(queued, ['b@example.org'], '451 Try again later')
+
+    assert queue.get() is None
+    clock.now += 60
+    retried = queue.get()
+    assert retried.recipients == ['b@example.org']
+    assert retried.attempts == 1
+    assert retried.error == '451 Try again later'
+
+
+def test_give_up_after_max_attempts(queue, clock, tmp_path):
+
+    queue.put(entry(attempts=2), b'')
+    clock.now += 3600
+    queue.defer(queue.get(), error='451 Try again later')
+
+    assert len(queue) == 0
+    assert not list((tmp_path / 'queue').iterdir())
+    assert len(list((tmp_path / 'failed').iterdir())) == 2
+
+
+def test_remove(queue, tmp_path):
+
+    queue.put(entry(), b'')
+    queue.remove(queue.get())
+
+    assert len(queue) == 0
+    assert not list((tmp_path / 'queue').iterdir())
+
+
+def test_survives_restart(queue, clock, tmp_path):
+
+    queue.put(entry(), b'data')
+    queue.put(entry(attempts=1), b'data')
+
+    reopened = MailQueue(tmp_path, clock=clock)
+
+    assert len(reopened) == 2
+    assert reopened.read(reopened.get()) == b'data'
+    assert reopened.get() is None
+
+
+def test_invalid_entry(tmp_path):
+
+    (tmp_path / 'queue').mkdir()
+    (tmp_path / 'queue' / 'broken.json').write_text('{')
+
+    with pytest.raises(QueueError):
+        MailQueue(tmp_path)
+
+
+def test_flush(queue, smtp_server):
+
+    queue.put(entry(host=smtp_server.host), b'Subject: test\r\n\r\nHello\r\n')
+    queue.put(entry(domain='[127.0.0.1]'), b'Subject: test\r\n\r\nHello\r\n')
+
+    with Mailer(port=smtp_server.port, helo='mail.example.com') as mailer:
+        queue.flush(mailer)
+
+    assert len(queue) == 0
+    assert len(smtp_server.messages) == 2
+
+
+def test_flush_defers_unreachable(queue, smtp_server, clock):
+
+    queue.put(entry(host=smtp_server.host), b'')
+
+    with Mailer(port=smtp_server.port + 1, helo='mail.example.com') as mailer:
+        queue.flush(mailer)
+
+    assert len(queue) == 1
+    assert queue.get() is None
+
+    clock.now += 60
+    assert queue.get().attempts == 1
+
+
+def test_put_stream(queue, tmp_path):
+
+    path = tmp_path / 'data.bin'
+    path.write_bytes(b'data')
+
+    stream = WireStream()
+    msg = MIMEBase('application', 'octet-stream')
+    msg.set_payload(stream.placeholder(path))
+    msg['Content-Transfer-Encoding'] = 'base64'
+    stream.flatten(msg)
+
+    queue.put(entry(), stream)
+
+    assert queue.read(queue.get()) == bytes(stream)
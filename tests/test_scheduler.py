@@ -0,0 +1,105 @@
+import pytest
+
+from spool.scheduler import (Ramp, RateScheduler, TokenBucket, parse_duration,
+                             parse_rate)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('5', 5.0),
+    ('0.5', 0.5),
+    ('200/m', 200 / 60),
+    ('10 / s', 10.0),
+    ('36/h', 0.01),
+])
+def test_parse_rate(value, expected):
+    assert parse_rate(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('value', ['', '0', '-1', '1/d', 'fast'])
+def test_parse_rate_invalid(value):
+    with pytest.raises(ValueError):
+        parse_rate(value)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('90', 90.0),
+    ('30s', 30.0),
+    ('2m', 120.0),
+    ('1.5h', 5400.0),
+])
+def test_parse_duration(value, expected):
+    assert parse_duration(value) == expected
+
+
+def test_token_bucket_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0, 0.5]
+
+    clock.now += 0.5
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_token_bucket_sustained_rate(clock):
+    bucket = TokenBucket(rate=10, burst=1, clock=clock)
+
+    for _ in range(100):
+        clock.sleep(bucket.reserve())
+
+    assert clock.now == pytest.approx(9.9)
+
+
+def test_ramp():
+    ramp = Ramp.parse('1:50:2m')
+
+    assert ramp.rate(0) == 1
+    assert ramp.rate(60) == pytest.approx(25.5)
+    assert ramp.rate(120) == 50
+    assert ramp.rate(600) == 50
+
+
+def test_scheduler_ramp(clock):
+    scheduler = RateScheduler(ramp=Ramp(1, 10, 10), clock=clock,
+                              sleep=clock.sleep)
+
+    sent = 0
+    while clock.now < 10:
+        scheduler.acquire()
+        sent += 1
+
+    # the average rate of a linear ramp from 1 to 10 msg/s is 5.5 msg/s
+    assert 50 <= sent <= 60
+
+
+def test_scheduler_per_host(clock):
+    scheduler = RateScheduler(rate=100, host_rate=1, clock=clock,
+                              sleep=clock.sleep)
+
+    assert scheduler.reserve('example.org') == 0
+    assert scheduler.reserve('example.com') == 0
+    assert scheduler.reserve('example.org') == 1
+    assert scheduler.reserve() == 0
+
+
+def test_scheduler_unlimited(clock):
+    scheduler = RateScheduler(clock=clock)
+
+    assert all(scheduler.reserve(key) == 0
+               for key in [None, 'example.org'] * 100)
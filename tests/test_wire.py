@@ -0,0 +1,104 @@
+import os
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from spool.payload import Payload
+from spool.wire import (SMTP_POLICY, STREAM_CHUNK, WireStream, encode_base64,
+                        encode_file, encoded_size, flatten)
+
+
+@pytest.mark.parametrize('size', [0, 1, 57, 58, 57 * 16384 + 1])
+@pytest.mark.parametrize('tail', [b'', b'\n'], ids=['no-newline', 'newline'])
+def test_encode_base64(size, tail):
+    data = os.urandom(size) + tail
+
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(data)
+    encoders.encode_base64(part)
+
+    assert encode_base64(data) == part.get_payload()
+
+
+def test_flatten():
+    msg = MIMEMultipart('mixed')
+    msg.attach(MIMEText('Hello\nWorld\n'))
+
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(encode_base64(os.urandom(1024)))
+    part['Content-Transfer-Encoding'] = 'base64'
+    msg.attach(part)
+
+    wire = flatten(msg)
+
+    assert wire == msg.as_bytes(policy=SMTP_POLICY)
+    assert b'\n' not in wire.replace(b'\r\n', b'')
+
+
+@pytest.mark.parametrize('size', [0, 1, 57, 58, STREAM_CHUNK + 1])
+def test_encode_file(tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+
+    encoded = b''.join(encode_file(path))
+
+    assert encoded == encode_base64(data).replace('\n', '\r\n').encode()
+    assert len(encoded) == encoded_size(size)
+
+
+@pytest.fixture()
+def stream(tmp_path):
+    data = os.urandom(4096)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+
+    msg = MIMEMultipart('mixed')
+    msg.attach(MIMEText('.leading period\n'))
+
+    stream = WireStream()
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(stream.placeholder(path))
+    part['Content-Transfer-Encoding'] = 'base64'
+    msg.attach(part)
+    stream.flatten(msg)
+
+    part.set_payload(encode_base64(data))
+
+    return stream, flatten(msg)
+
+
+def test_stream(stream):
+    stream, expected = stream
+
+    assert bytes(stream) == expected
+    assert len(stream) == len(expected)
+
+
+def test_stream_stuffed(stream):
+    stream, expected = stream
+
+    stuffed = b''.join(stream.chunks(stuffed=True))
+
+    assert stuffed == expected.replace(b'\r\n.leading', b'\r\n..leading')
+
+
+def test_stream_payload():
+    payload = Payload(STREAM_CHUNK + 1000, seed=1)
+
+    msg = MIMEMultipart('mixed')
+    stream = WireStream()
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(stream.placeholder(payload))
+    part['Content-Transfer-Encoding'] = 'base64'
+    msg.attach(part)
+    stream.flatten(msg)
+
+    part.set_payload(encode_base64(payload.read()))
+    expected = flatten(msg)
+
+    assert bytes(stream) == expected
+    assert len(stream) == len(expected)